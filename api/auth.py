@@ -1,10 +1,12 @@
 # Authentication utilities
-import jwt
 import hashlib
+import hmac
+import asyncio
+import bcrypt
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from fastapi import HTTPException, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 
 security = HTTPBearer()
@@ -13,19 +15,44 @@ SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-change-in-product
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24 * 30  # 30 days
 
+# bcrypt is deliberately slow, so it runs in a small dedicated thread pool
+# instead of on the event loop; the pool size caps concurrent hashing
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '4'))
+password_hash_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
 
-def hash_password(password: str) -> str:
-    """Hash password using SHA256"""
-    return hashlib.sha256(password.encode()).hexdigest()
 
+async def run_password_hash(func, *args):
+    """Run a bcrypt call in the password hash pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_hash_pool, func, *args)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify password against hash"""
-    return hash_password(plain_password) == hashed_password
+
+async def hash_password(password: str) -> str:
+    """Hash password using bcrypt"""
+    hashed = await run_password_hash(bcrypt.hashpw, password.encode(), bcrypt.gensalt(BCRYPT_ROUNDS))
+    return hashed.decode()
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """True for legacy unsalted SHA256 hashes that should be upgraded to bcrypt"""
+    return not hashed_password.startswith("$2")
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify password against a bcrypt or legacy SHA256 hash"""
+    if not plain_password or not hashed_password:
+        return False
+    if password_needs_rehash(hashed_password):
+        legacy_hash = hashlib.sha256(plain_password.encode()).hexdigest()
+        return hmac.compare_digest(legacy_hash, hashed_password)
+    return await run_password_hash(bcrypt.checkpw, plain_password.encode(), hashed_password.encode())
 
 
 def create_access_token(data: dict) -> str:
     """Create JWT access token"""
+    import jwt
+
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
     to_encode.update({"exp": expire})
@@ -35,6 +62,8 @@ def create_access_token(data: dict) -> str:
 
 def decode_token(token: str) -> dict:
     """Decode and verify JWT token"""
+    import jwt
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return payload
@@ -1,27 +1,49 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from dotenv import load_dotenv
+# Serverless entry point - kept cheap to import, since every cold start pays for it.
+# Motor/pymongo and jwt are imported on first use, and the Mongo client and the
+# Mangum adapter are created once per container and reused by warm invocations.
+from fastapi import FastAPI, APIRouter, HTTPException, Depends
+from fastapi.responses import JSONResponse
+from fastapi.security import HTTPBearer
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional
 import uuid
-from datetime import datetime, timedelta
-import jwt
-import hashlib
-from .auth import get_current_user, hash_password, verify_password, create_access_token
+from datetime import datetime
+from .auth import get_current_user, hash_password, verify_password, password_needs_rehash, create_access_token
 
-# Load environment variables
+# Load environment variables (deployed functions get them from the platform)
 ROOT_DIR = Path(__file__).parent.parent
-load_dotenv(ROOT_DIR / '.env')
+if (ROOT_DIR / '.env').exists():
+    from dotenv import load_dotenv
+    load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ.get('DB_NAME', 'worksite_manager')]
+# MongoDB connection - created on first use
+mongo_client = None
+pool_stats = None
+
+
+def get_db():
+    """Return the Motor database, creating the client on the first call"""
+    global mongo_client, pool_stats
+    if mongo_client is None:
+        from .database import PoolStats, create_client
+        pool_stats = PoolStats()
+        mongo_client = create_client(os.environ['MONGO_URL'], pool_stats)
+    return mongo_client[os.environ.get('DB_NAME', 'worksite_manager')]
+
+
+class LazyDatabase:
+    """Stands in for the Motor database so `db.<collection>` connects on first use"""
+
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+
+db = LazyDatabase()
 
 # JWT Configuration
 SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-change-in-production')
@@ -135,6 +157,15 @@ class AdvanceCreate(BaseModel):
 
 # ==================== AUTHENTICATION ENDPOINTS ====================
 
+async def upgrade_password_hash(user_doc: dict, password: str):
+    """Replace a legacy SHA256 hash with bcrypt after a successful login"""
+    if password_needs_rehash(user_doc["password_hash"]):
+        new_hash = await hash_password(password)
+        await db.users.update_one(
+            {"_id": user_doc["_id"], "password_hash": user_doc["password_hash"]},
+            {"$set": {"password_hash": new_hash}}
+        )
+
 @api_router.post("/auth/register", response_model=Token)
 async def register(user_data: UserCreate):
     """Register a new user"""
@@ -151,7 +182,7 @@ async def register(user_data: UserCreate):
     )
 
     # Hash password
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await hash_password(user_data.password)
 
     user_dict = user.dict()
     user_dict["password_hash"] = hashed_password
@@ -179,8 +210,9 @@ async def login(credentials: UserLogin):
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
     # Verify password
-    if not verify_password(credentials.password, user_doc["password_hash"]):
+    if not await verify_password(credentials.password, user_doc["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid email or password")
+    await upgrade_password_hash(user_doc, credentials.password)
 
     # Create user object from database document
     user = User(**{k: v for k, v in user_doc.items() if k != "_id" and k != "password_hash"})
@@ -195,6 +227,77 @@ async def login(credentials: UserLogin):
     )
 
 
+# ==================== CHANGE TRACKING ====================
+# Attendance written here keeps the same derived data as backend/server.py:
+# month rollups (backend/rollups.py), the data versions behind list ETags
+# (backend/etags.py) and the delta-sync change log (backend/sync.py).
+
+def status_earning(status: str, daily_rate: float) -> float:
+    """Amount earned for one day with the given status"""
+    if status == "present":
+        return daily_rate
+    if status == "half":
+        return daily_rate * 0.5
+    return 0.0
+
+
+def rollup_delta(old_status, new_status, daily_rate: float) -> dict:
+    """$inc document moving one day from old_status to new_status (either may be None)"""
+    inc = {}
+    if old_status == new_status:
+        return inc
+    earned = 0.0
+    if old_status:
+        inc[f"counts.{old_status}"] = -1
+        earned -= status_earning(old_status, daily_rate)
+    if new_status:
+        inc[f"counts.{new_status}"] = 1
+        earned += status_earning(new_status, daily_rate)
+    if earned:
+        inc["earned"] = earned
+    return inc
+
+
+async def apply_rollup_delta(worker_id: str, day: str, old_status, new_status, daily_rate: float):
+    """Atomically move one attendance day between status counters in its month rollup"""
+    inc = rollup_delta(old_status, new_status, daily_rate)
+    if inc:
+        await db.attendance_rollups.update_one({"worker_id": worker_id, "month": day[:7]}, {"$inc": inc}, upsert=True)
+
+
+async def bump_data_versions(keys: list):
+    from pymongo import UpdateOne
+
+    await db.data_versions.bulk_write(
+        [UpdateOne({"_id": key}, {"$inc": {"version": 1}}, upsert=True) for key in keys], ordered=False
+    )
+
+
+async def record_changes(user_id: str, collection: str, doc_ids: list):
+    """Append entries for doc_ids to the tenant's change log"""
+    from pymongo import ReturnDocument
+
+    # Reserve a block of sequence numbers, then write the entries
+    counter = await db.data_versions.find_one_and_update(
+        {"_id": f"{user_id}:sync"}, {"$inc": {"version": len(doc_ids)}},
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    first = counter["version"] - len(doc_ids) + 1
+    now = datetime.utcnow()
+    await db.sync_log.insert_many([
+        {"user_id": user_id, "seq": first + i, "collection": collection, "doc_id": doc_id, "deleted": False, "at": now}
+        for i, doc_id in enumerate(doc_ids)
+    ], ordered=False)
+
+
+async def record_write(user_id: str, collection: str, site_id: Optional[str], doc_ids: list):
+    """Invalidate the ETags a write affects and log it for delta sync; call after the write"""
+    keys = [f"{user_id}:{collection}:*"]
+    if site_id:
+        keys.append(f"{user_id}:{collection}:{site_id}")
+    await asyncio.gather(bump_data_versions(keys), record_changes(user_id, collection, doc_ids))
+
+
 # ==================== SITE ENDPOINTS ====================
 
 @api_router.post("/sites")
@@ -226,6 +329,17 @@ async def get_sites(current_user: dict = Depends(get_current_user)):
 async def root():
     return {"message": "Worksite Manager API", "status": "active"}
 
+@api_router.get("/health/db")
+async def get_db_health():
+    """Ping latency, connection pool usage and checkout wait times"""
+    from .database import db_health
+
+    get_db()
+    health = await db_health(mongo_client, pool_stats)
+    if health["status"] != "ok":
+        return JSONResponse(status_code=503, content=health)
+    return health
+
 # Worker Endpoints
 @api_router.post("/workers")
 async def create_worker(worker: dict, current_user: dict = Depends(get_current_user)):
@@ -267,6 +381,39 @@ async def get_worker(worker_id: str, current_user: dict = Depends(get_current_us
 
 # ==================== ATTENDANCE ENDPOINTS ====================
 
+# Startup events do not run under the serverless adapter, so this function never
+# creates indexes: the unique (worker_id, date) index is provisioned out of band
+# with `python backend/indexes.py ensure`, once `python backend/indexes.py dedupe`
+# has removed any duplicate records.
+
+
+async def upsert_attendance(worker_id: str, date: str, status: str, marked_by: str, daily_rate: float) -> dict:
+    """Atomically create or update the single attendance record for (worker_id, date)"""
+    from pymongo import ReturnDocument
+    from pymongo.errors import DuplicateKeyError
+
+    now = datetime.utcnow()
+    query = {"worker_id": worker_id, "date": date}
+    changes = {"status": status, "marked_at": now, "marked_by": marked_by}
+    on_insert = {"id": str(uuid.uuid4()), "created_at": now}
+    update = {"$set": changes, "$setOnInsert": on_insert}
+    # Return the previous record so the monthly rollup can be moved by a delta
+    try:
+        before = await db.attendance.find_one_and_update(
+            query, update, projection={'_id': 0}, upsert=True, return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        # A concurrent upsert inserted the record first - the retry matches it
+        before = await db.attendance.find_one_and_update(
+            query, update, projection={'_id': 0}, upsert=True, return_document=ReturnDocument.BEFORE
+        )
+
+    await apply_rollup_delta(worker_id, date, before["status"] if before else None, status, daily_rate)
+    if before:
+        return {**before, **changes}
+    return {**query, **changes, **on_insert}
+
+
 @api_router.post("/attendance")
 async def mark_attendance(attendance_data: AttendanceCreate, current_user: dict = Depends(get_current_user)):
     """Mark or update attendance for a worker"""
@@ -275,37 +422,16 @@ async def mark_attendance(attendance_data: AttendanceCreate, current_user: dict
     if not worker:
         raise HTTPException(status_code=404, detail="Worker not found")
 
-    # Check if attendance already exists for this date
-    existing = await db.attendance.find_one({
-        "worker_id": attendance_data.worker_id,
-        "date": attendance_data.date
-    })
-
-    if existing:
-        # Update existing attendance
-        await db.attendance.update_one(
-            {"_id": existing["_id"]},
-            {"$set": {
-                "status": attendance_data.status,
-                "marked_at": datetime.utcnow(),
-                "marked_by": current_user["id"]
-            }}
-        )
-        # Fetch updated record
-        updated = await db.attendance.find_one({"_id": existing["_id"]}, {'_id': 0})
-        return updated
-    else:
-        # Create new attendance record
-        attendance = Attendance(
-            worker_id=attendance_data.worker_id,
-            date=attendance_data.date,
-            status=attendance_data.status,
-            marked_by=current_user["id"]
-        )
-        attendance_dict = attendance.dict()
-        await db.attendance.insert_one(attendance_dict)
-        attendance_dict.pop('_id', None)
-        return attendance_dict
+    # Create or update the record for this date in one round trip
+    attendance = await upsert_attendance(
+        attendance_data.worker_id,
+        attendance_data.date,
+        attendance_data.status,
+        current_user["id"],
+        worker.get("daily_rate", 500)
+    )
+    await record_write(current_user["id"], "attendance", worker.get("site_id"), [attendance["id"]])
+    return attendance
 
 
 @api_router.get("/attendance/{worker_id}")
@@ -336,6 +462,8 @@ async def update_attendance(
     current_user: dict = Depends(get_current_user)
 ):
     """Update attendance status"""
+    from pymongo import ReturnDocument
+
     # Find attendance record
     attendance = await db.attendance.find_one({"id": attendance_id})
     if not attendance:
@@ -346,19 +474,25 @@ async def update_attendance(
     if not worker:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    # Update attendance
-    await db.attendance.update_one(
+    # Update attendance; the previous record gives the rollup delta
+    changes = {
+        "status": update_data.status,
+        "marked_at": datetime.utcnow(),
+        "marked_by": current_user["id"]
+    }
+    before = await db.attendance.find_one_and_update(
         {"id": attendance_id},
-        {"$set": {
-            "status": update_data.status,
-            "marked_at": datetime.utcnow(),
-            "marked_by": current_user["id"]
-        }}
+        {"$set": changes},
+        projection={'_id': 0},
+        return_document=ReturnDocument.BEFORE
     )
-
-    # Return updated record
-    updated = await db.attendance.find_one({"id": attendance_id}, {'_id': 0})
-    return updated
+    if not before:
+        raise HTTPException(status_code=404, detail="Attendance record not found")
+    await apply_rollup_delta(
+        before["worker_id"], before["date"], before["status"], update_data.status, worker.get("daily_rate", 500)
+    )
+    await record_write(current_user["id"], "attendance", worker.get("site_id"), [attendance_id])
+    return {**before, **changes}
 
 
 # ==================== SALARY ENDPOINTS ====================
@@ -483,11 +617,16 @@ logger = logging.getLogger(__name__)
 
 
 # Vercel serverless function handler
+mangum_handler = None
+
+
 def handler(event, context):
     """Vercel serverless function handler"""
-    from mangum import Mangum
+    global mangum_handler
+    if mangum_handler is None:
+        from mangum import Mangum
 
-    # Create Mangum handler for FastAPI
-    mangum_handler = Mangum(app, lifespan="off")
+        # Create the Mangum adapter once per container
+        mangum_handler = Mangum(app, lifespan="off")
 
     return mangum_handler(event, context)
\ No newline at end of file
@@ -0,0 +1,239 @@
+# Worker-month attendance buckets
+#
+# The daily layout stores one `attendance` document per worker per day, each
+# with a uuid, two datetimes and marked_by, plus an index entry per document.
+# The bucketed layout keeps one `attendance_months` document per worker-month:
+#   {"_id": "<worker_id>:YYYY-MM", "worker_id": ..., "month": "YYYY-MM",
+#    "status": [...], "marked_at": [...], "marked_by": [...], "created_at": [...]}
+# Each array has one slot per day of the month (None when unmarked). The _id
+# index serves every lookup, so a month of salary or history reads one
+# document instead of ~30. Days are addressed as "<worker_id>:YYYY-MM-DD",
+# which is also their attendance id in this layout.
+#   ATTENDANCE_LAYOUT=daily     (default) one document per worker per day
+#   ATTENDANCE_LAYOUT=dual      writes go to both layouts, reads stay daily
+#   ATTENDANCE_LAYOUT=bucketed  reads and writes use attendance_months only
+#
+# Migrating online:
+#   1. deploy with ATTENDANCE_LAYOUT=dual
+#   2. python attendance_buckets.py migrate            # copy daily documents into buckets
+#      python attendance_buckets.py migrate --verify   # report buckets that disagree
+#   3. deploy with ATTENDANCE_LAYOUT=bucketed
+# The copy only overwrites a day when the daily document is at least as new as
+# the bucket's, so writes mirrored during the copy are never lost. Attendance
+# ids change at the switch; clients should drop their sync tokens and reload.
+import argparse
+import asyncio
+import calendar
+import os
+from datetime import date, datetime
+from pathlib import Path
+
+from pymongo import UpdateOne
+
+ATTENDANCE_LAYOUT = os.environ.get("ATTENDANCE_LAYOUT", "daily").lower()
+ATTENDANCE_LAYOUTS = ("daily", "dual", "bucketed")
+BUCKET_FIELDS = ("status", "marked_at", "marked_by", "created_at")
+MIGRATE_BATCH_SIZE = 200  # workers per migration batch
+_EPOCH = datetime(1970, 1, 1)
+
+
+def bucket_id(worker_id: str, month: str) -> str:
+    return f"{worker_id}:{month}"
+
+
+def day_id(worker_id: str, day: str) -> str:
+    """Attendance id of one day in the bucketed layout"""
+    return f"{worker_id}:{day}"
+
+
+def parse_day_id(attendance_id: str):
+    """(worker_id, YYYY-MM-DD) from a day id, or None when it is not one"""
+    worker_id, _, day = attendance_id.rpartition(":")
+    try:
+        date.fromisoformat(day)
+    except ValueError:
+        return None
+    return (worker_id, day) if worker_id else None
+
+
+def month_days(month: str) -> int:
+    year, number = int(month[:4]), int(month[5:7])
+    return calendar.monthrange(year, number)[1]
+
+
+def bucket_range(worker_id: str, month_from: str = None, month_to: str = None) -> dict:
+    """_id filter for a worker's buckets between two months (inclusive, either open)"""
+    return {"$gte": bucket_id(worker_id, month_from or ""), "$lte": bucket_id(worker_id, month_to or "~")}
+
+
+def _slot(field: str, days: int):
+    return {"$ifNull": [f"${field}", [None] * days]}
+
+
+def set_day_update(worker_id: str, day: str, status: str, marked_at: datetime, marked_by: str) -> list:
+    """Pipeline update setting one day of a bucket, creating the bucket when upserted; raises
+    ValueError for a malformed date"""
+    date.fromisoformat(day)
+    month, index = day[:7], int(day[8:10]) - 1
+    days = month_days(month)
+
+    def put(field: str, value):
+        return {"$map": {"input": list(range(days)), "as": "d", "in": {
+            "$cond": [{"$eq": ["$$d", index]}, value, {"$arrayElemAt": [_slot(field, days), "$$d"]}]
+        }}}
+
+    created = {"$ifNull": [{"$arrayElemAt": [_slot("created_at", days), index]}, {"$literal": marked_at}]}
+    return [{"$set": {
+        "worker_id": {"$literal": worker_id},
+        "month": {"$literal": month},
+        "status": put("status", {"$literal": status}),
+        "marked_at": put("marked_at", {"$literal": marked_at}),
+        "marked_by": put("marked_by", {"$literal": marked_by}),
+        "created_at": put("created_at", created),
+    }}]
+
+
+def merge_days_update(worker_id: str, month: str, records: list) -> list:
+    """Pipeline update copying daily records into a bucket, keeping any day the bucket has newer"""
+    days = month_days(month)
+    incoming = {field: [None] * days for field in BUCKET_FIELDS}
+    for record in records:
+        index = int(record["date"][8:10]) - 1
+        incoming["status"][index] = record["status"]
+        incoming["marked_at"][index] = record.get("marked_at") or record.get("created_at") or _EPOCH
+        incoming["marked_by"][index] = record.get("marked_by")
+        incoming["created_at"][index] = record.get("created_at")
+
+    new_at = {"$arrayElemAt": [{"$literal": incoming["marked_at"]}, "$$d"]}
+    old_at = {"$arrayElemAt": [_slot("marked_at", days), "$$d"]}
+    take_incoming = {"$and": [{"$ne": [new_at, None]}, {"$or": [{"$eq": [old_at, None]}, {"$lte": [old_at, new_at]}]}]}
+
+    def merge(field: str):
+        return {"$map": {"input": list(range(days)), "as": "d", "in": {"$cond": [
+            take_incoming,
+            {"$arrayElemAt": [{"$literal": incoming[field]}, "$$d"]},
+            {"$arrayElemAt": [_slot(field, days), "$$d"]},
+        ]}}}
+
+    return [{"$set": {
+        "worker_id": {"$literal": worker_id},
+        "month": {"$literal": month},
+        **{field: merge(field) for field in BUCKET_FIELDS},
+    }}]
+
+
+def bucket_days(bucket: dict, date_from: str = None, date_to: str = None):
+    """(slot index, YYYY-MM-DD, status) of each marked day, oldest first, optionally within a period"""
+    for index, status in enumerate(bucket.get("status") or []):
+        day = f"{bucket['month']}-{index + 1:02d}"
+        if status is None or (date_from and day < date_from) or (date_to and day > date_to):
+            continue
+        yield index, day, status
+
+
+def bucket_records(bucket: dict, date_from: str = None, date_to: str = None) -> list:
+    """Marked days of a bucket as daily-layout records, oldest first, optionally within a period"""
+    records = []
+    for index, day, status in bucket_days(bucket, date_from, date_to):
+        records.append({
+            "id": day_id(bucket["worker_id"], day),
+            "worker_id": bucket["worker_id"],
+            "date": day,
+            "status": status,
+            "marked_at": bucket["marked_at"][index],
+            "marked_by": bucket["marked_by"][index],
+            "created_at": bucket["created_at"][index],
+        })
+    return records
+
+
+def status_counts_pipeline(match: dict) -> list:
+    """Aggregation over attendance_months giving one (worker_id, month, status) count per row, like
+    grouping daily documents by month and status"""
+    return [
+        {"$match": match},
+        {"$unwind": "$status"},
+        {"$match": {"status": {"$ne": None}}},
+        {"$group": {"_id": {"worker_id": "$worker_id", "month": "$month", "status": "$status"}, "count": {"$sum": 1}}},
+    ]
+
+
+# ==================== MIGRATION ====================
+
+def _daily_buckets_pipeline(worker_ids: list) -> list:
+    return [
+        {"$match": {"worker_id": {"$in": worker_ids}}},
+        {"$project": {"_id": 0, "worker_id": 1, "date": 1, "status": 1, "marked_at": 1, "marked_by": 1, "created_at": 1}},
+        {"$group": {"_id": {"worker_id": "$worker_id", "month": {"$substrCP": ["$date", 0, 7]}}, "records": {"$push": "$$ROOT"}}},
+    ]
+
+
+async def _worker_batches(db, batch_size: int):
+    """Distinct worker ids with daily attendance, in batches"""
+    worker_ids = await db.attendance.distinct("worker_id")
+    for start in range(0, len(worker_ids), batch_size):
+        yield worker_ids[start:start + batch_size]
+
+
+async def migrate_to_buckets(db, batch_size: int = MIGRATE_BATCH_SIZE) -> int:
+    """Copy daily attendance into worker-month buckets; safe to rerun and to run while serving"""
+    migrated = 0
+    async for worker_ids in _worker_batches(db, batch_size):
+        operations = []
+        async for group in db.attendance.aggregate(_daily_buckets_pipeline(worker_ids)):
+            worker_id, month = group["_id"]["worker_id"], group["_id"]["month"]
+            operations.append(UpdateOne(
+                {"_id": bucket_id(worker_id, month)}, merge_days_update(worker_id, month, group["records"]), upsert=True
+            ))
+        if operations:
+            await db.attendance_months.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+    return migrated
+
+
+async def verify_buckets(db, batch_size: int = MIGRATE_BATCH_SIZE) -> list:
+    """(bucket id, daily statuses, bucket statuses) for every bucket that disagrees with daily documents"""
+    mismatches = []
+    async for worker_ids in _worker_batches(db, batch_size):
+        expected = {}
+        async for group in db.attendance.aggregate(_daily_buckets_pipeline(worker_ids)):
+            key = bucket_id(group["_id"]["worker_id"], group["_id"]["month"])
+            expected[key] = {r["date"]: r["status"] for r in group["records"]}
+        async for bucket in db.attendance_months.find({"worker_id": {"$in": worker_ids}}):
+            stored = {r["date"]: r["status"] for r in bucket_records(bucket)}
+            wanted = expected.pop(bucket["_id"], {})
+            if stored != wanted:
+                mismatches.append((bucket["_id"], wanted, stored))
+        mismatches.extend((key, wanted, {}) for key, wanted in expected.items())
+    return mismatches
+
+
+async def _main(verify: bool, batch_size: int) -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ.get('DB_NAME', 'worksite_manager')]
+    try:
+        if verify:
+            mismatches = await verify_buckets(db, batch_size)
+            for key, wanted, stored in mismatches:
+                print(f"{key}: daily={wanted} bucket={stored}")
+            print(f"{len(mismatches)} mismatched buckets")
+            return 1 if mismatches else 0
+
+        count = await migrate_to_buckets(db, batch_size)
+        print(f"Migrated {count} worker-months")
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move attendance into worker-month buckets for the Worksite Manager API")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--verify", action="store_true", help="compare buckets with daily documents without writing")
+    parser.add_argument("--batch-size", type=int, default=MIGRATE_BATCH_SIZE, help="workers per batch")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(_main(args.verify, args.batch_size)))
@@ -0,0 +1,39 @@
+# Compact site-month attendance grid
+#
+# The attendance report renders a worker x day grid. Instead of every worker's
+# attendance documents, it gets one string per worker with one status code per
+# day of the month (rows[i][d - 1] is worker_ids[i] on day d), built from a
+# single query. A 500-worker month is about 500 * (36-byte id + 31 codes).
+import calendar
+from datetime import date
+
+STATUS_CODES = {"present": "P", "half": "H", "absent": "A", "holiday": "L"}
+UNMARKED = "."
+UNKNOWN = "?"  # a status this encoding has no code for
+
+
+def month_range(month: str):
+    """(first day, last day, number of days) of a YYYY-MM month; raises ValueError"""
+    first = date.fromisoformat(f"{month}-01")
+    days = calendar.monthrange(first.year, first.month)[1]
+    return first.isoformat(), first.replace(day=days).isoformat(), days
+
+
+def encode_row(marks: list, days: int) -> str:
+    """Status code string for one worker from (date, status) pairs within the month"""
+    row = [UNMARKED] * days
+    for day, status in marks:
+        row[int(day[8:10]) - 1] = STATUS_CODES.get(status, UNKNOWN)
+    return "".join(row)
+
+
+def matrix_response(site_id: str, month: str, days: int, workers: list) -> dict:
+    """Grid payload from [(worker_id, [(date, status), ...])] in display order"""
+    return {
+        "site_id": site_id,
+        "month": month,
+        "days": days,
+        "codes": {code: status for status, code in STATUS_CODES.items()},
+        "worker_ids": [worker_id for worker_id, _ in workers],
+        "rows": [encode_row(marks, days) for _, marks in workers],
+    }
@@ -1,6 +1,12 @@
 # Authentication utilities
 import jwt
 import hashlib
+import hmac
+import asyncio
+import bcrypt
+from concurrent.futures import ThreadPoolExecutor
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from fastapi import HTTPException, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
@@ -13,15 +19,90 @@ SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-change-in-product
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24 * 30  # 30 days
 
+# bcrypt is deliberately slow, so it runs in a small dedicated thread pool
+# instead of on the event loop; the pool size caps concurrent hashing
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '4'))
+password_hash_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
 
-def hash_password(password: str) -> str:
-    """Hash password using SHA256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+# Verified-token and user-profile caches. Both live in each worker process:
+# invalidate_user only clears the calling process, so another worker keeps
+# serving a deleted or demoted user's cached profile for up to
+# PROFILE_CACHE_TTL_SECONDS, and a cached token stays valid for up to
+# TOKEN_CACHE_TTL_SECONDS. Keep the TTLs short where that matters.
+# Profiles are cached without password fields.
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '10000'))
+TOKEN_CACHE_TTL_SECONDS = int(os.environ.get('TOKEN_CACHE_TTL_SECONDS', '300'))
+PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', '10000'))
+PROFILE_CACHE_TTL_SECONDS = int(os.environ.get('PROFILE_CACHE_TTL_SECONDS', '60'))
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify password against hash"""
-    return hash_password(plain_password) == hashed_password
+class TTLCache:
+    """Bounded LRU cache whose entries also expire at a per-entry deadline"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, expires_at: float = None):
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        self._entries[key] = (deadline, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key):
+        self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+token_cache = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL_SECONDS)
+profile_cache = TTLCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL_SECONDS)
+
+
+async def run_password_hash(func, *args):
+    """Run a bcrypt call in the password hash pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_hash_pool, func, *args)
+
+
+async def hash_password(password: str) -> str:
+    """Hash password using bcrypt"""
+    hashed = await run_password_hash(bcrypt.hashpw, password.encode(), bcrypt.gensalt(BCRYPT_ROUNDS))
+    return hashed.decode()
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """True for legacy unsalted SHA256 hashes that should be upgraded to bcrypt"""
+    return not hashed_password.startswith("$2")
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify password against a bcrypt or legacy SHA256 hash"""
+    if not plain_password or not hashed_password:
+        return False
+    if password_needs_rehash(hashed_password):
+        legacy_hash = hashlib.sha256(plain_password.encode()).hexdigest()
+        return hmac.compare_digest(legacy_hash, hashed_password)
+    return await run_password_hash(bcrypt.checkpw, plain_password.encode(), hashed_password.encode())
 
 
 def create_access_token(data: dict) -> str:
@@ -40,21 +121,52 @@ def decode_token(token: str) -> dict:
         return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
+def decode_token_cached(token: str) -> dict:
+    """Decode a JWT, skipping signature verification for tokens verified recently.
+    Entries never outlive the token's own exp claim."""
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = decode_token(token)
+        token_cache.set(token, payload, payload.get("exp"))
+    return dict(payload)
+
+
+async def load_user_profile(db, user_id: str):
+    """Fetch a user document without its password fields, served from the profile cache when possible.
+    Returns a copy, so callers may change it freely"""
+    user = profile_cache.get(user_id)
+    if user is None:
+        user = await db.users.find_one({"id": user_id}, {"password": 0, "password_hash": 0})
+        if user:
+            profile_cache.set(user_id, user)
+    return dict(user) if user else None
+
+
+def invalidate_user(user_id: str):
+    """Drop a cached profile after the user is changed or deleted"""
+    if user_id:
+        profile_cache.pop(user_id)
+
+
+def auth_cache_stats() -> dict:
+    return {"tokens": token_cache.stats(), "profiles": profile_cache.stats()}
+
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Security(security), db=None):
     """Get current user from JWT token"""
     token = credentials.credentials
-    payload = decode_token(token)
+    payload = decode_token_cached(token)
     user_id = payload.get("user_id")
     
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     
     if db:
-        user = await db.users.find_one({"id": user_id})
+        user = await load_user_profile(db, user_id)
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
         return user
@@ -70,14 +182,14 @@ async def get_current_user_optional(credentials: HTTPAuthorizationCredentials =
     
     try:
         token = credentials.credentials
-        payload = decode_token(token)
+        payload = decode_token_cached(token)
         user_id = payload.get("user_id")
         
         if not user_id:
             return {"id": "default-user", "email": "user@example.com"}
         
         if db:
-            user = await db.users.find_one({"id": user_id})
+            user = await load_user_profile(db, user_id)
             if not user:
                 return {"id": "default-user", "email": "user@example.com"}
             return user
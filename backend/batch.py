@@ -0,0 +1,42 @@
+# Idempotent batched writes for queued offline mutations
+#
+# Clients tag every queued operation with an idempotency key. Each key's result
+# is remembered for IDEMPOTENCY_TTL_HOURS (default 72) in a TTL-indexed
+# collection, so a batch replayed after a timeout answers from the stored
+# results without writing anything.
+#
+# Documents created by a batch get ids derived from (tenant, key), and are
+# written with upserts that only insert, keyed on a unique index: advances on
+# `id` (id_unique), payments on `_id`. When two copies of a batch race past the
+# key lookup, the later upsert fails with a duplicate key error, which counts
+# as already written, so neither copy creates a second advance or payment.
+#
+# A batch is not one atomic write. Attendance marks, advances and payments each
+# go out as one ordered bulk_write per collection, and the three run
+# concurrently. A failure stops the later operations of its own collection
+# only; every operation reports whether it applied, and only applied keys are
+# remembered, so the client retries the rest under the same keys.
+import os
+import uuid
+
+from bson import ObjectId
+
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get("IDEMPOTENCY_TTL_HOURS", "72"))
+BATCH_MAX_OPERATIONS = int(os.environ.get("BATCH_MAX_OPERATIONS", "500"))
+BATCH_OPERATION_TYPES = ("mark_attendance", "record_advance", "record_payment")
+
+_NAMESPACE = uuid.UUID("5b0b8a2e-43c4-4d53-9d0e-4b1c7d0a9f61")
+
+
+def idempotency_id(user_id: str, key: str) -> str:
+    return f"{user_id}:{key}"
+
+
+def advance_id(user_id: str, key: str) -> str:
+    """Stable advance id for an idempotency key"""
+    return str(uuid.uuid5(_NAMESPACE, idempotency_id(user_id, key)))
+
+
+def payment_object_id(user_id: str, key: str) -> ObjectId:
+    """Stable payment _id for an idempotency key"""
+    return ObjectId(uuid.uuid5(_NAMESPACE, "payment:" + idempotency_id(user_id, key)).bytes[:12])
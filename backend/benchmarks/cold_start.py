@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Serverless cold start benchmark
+
+Starts a fresh interpreter per run (a cold container), imports api.index and
+sends requests through the Vercel `handler()`. Reports import time, first
+request latency (cold) and second request latency (warm).
+
+    python benchmarks/cold_start.py --runs 10
+    python benchmarks/cold_start.py --runs 10 --ref HEAD~1   # compare with an older api/
+    python benchmarks/cold_start.py --path /api/workers      # include the first Mongo round trip
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+from pathlib import Path
+
+from common import BACKEND_DIR
+
+REPO_DIR = BACKEND_DIR.parent
+
+CHILD = r'''
+import json, sys, time
+path = sys.argv[1]
+event = {
+    "resource": "/{proxy+}", "path": path, "httpMethod": "GET",
+    "headers": {"host": "bench"}, "multiValueHeaders": {"host": ["bench"]},
+    "queryStringParameters": None, "multiValueQueryStringParameters": None,
+    "pathParameters": None, "stageVariables": None, "body": None, "isBase64Encoded": False,
+    "requestContext": {"resourcePath": "/{proxy+}", "httpMethod": "GET", "path": path,
+                       "stage": "bench", "identity": {"sourceIp": "127.0.0.1"}},
+}
+start = time.perf_counter()
+import api.index as serverless
+imported = time.perf_counter()
+first = serverless.handler(event, None)
+cold = time.perf_counter()
+serverless.handler(event, None)
+warm = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_request_ms": (cold - imported) * 1000,
+    "warm_request_ms": (warm - cold) * 1000,
+    "status": first["statusCode"],
+}))
+'''
+
+
+def run_once(source_dir: Path, path: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD, path],
+        cwd=source_dir, env=os.environ.copy(), capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(source_dir: Path, path: str, runs: int) -> dict:
+    samples = [run_once(source_dir, path) for _ in range(runs)]
+    summary = {"runs": runs, "status": samples[0]["status"]}
+    for key in ("import_ms", "first_request_ms", "warm_request_ms"):
+        values = [s[key] for s in samples]
+        summary[key] = {"median": round(statistics.median(values), 1), "min": round(min(values), 1)}
+    return summary
+
+
+def checkout_api(ref: str, target: Path):
+    """Extract api/ as of a git ref into target"""
+    archive = subprocess.run(
+        ["git", "-C", str(REPO_DIR), "archive", "--format=tar", ref, "api"],
+        capture_output=True, check=True
+    ).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(target)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--path", default="/api/")
+    parser.add_argument("--ref", help="also measure api/ as of this git ref")
+    args = parser.parse_args()
+
+    report = {"current": measure(REPO_DIR, args.path, args.runs)}
+    if args.ref:
+        with tempfile.TemporaryDirectory() as tmp:
+            checkout_api(args.ref, Path(tmp))
+            report[args.ref] = measure(Path(tmp), args.path, args.runs)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,126 @@
+# Shared helpers for the benchmark scripts
+#
+# The benchmarks drive the FastAPI app in-process through a minimal ASGI client
+# (no HTTP server, no extra dependencies) against a local mongod. They default
+# to a separate database so they never touch real data:
+#   MONGO_URL=mongodb://localhost:27017 DB_NAME=worksite_manager_bench
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "worksite_manager_bench")
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+async def asgi_request(app, method: str, path: str, json_body=None, headers: dict = None):
+    """Send one request through the ASGI app and return (status, body bytes)"""
+    body = json.dumps(json_body).encode() if json_body is not None else b""
+    path, _, query = path.partition("?")
+    raw_headers = [(b"host", b"bench")]
+    raw_headers += [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    if json_body is not None:
+        raw_headers.append((b"content-type", b"application/json"))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": raw_headers,
+        "client": ("bench", 0),
+        "server": ("bench", 80),
+    }
+    request_sent = False
+    response_done = asyncio.Event()
+    status = None
+    chunks = []
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # Only report a disconnect once the response is complete
+        await response_done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                response_done.set()
+
+    await app(scope, receive, send)
+    response_done.set()
+    return status, b"".join(chunks)
+
+
+async def timed_request(app, method: str, path: str, json_body=None, headers: dict = None):
+    """Like asgi_request but returns (status, body, latency in seconds)"""
+    start = time.perf_counter()
+    status, body = await asgi_request(app, method, path, json_body, headers)
+    return status, body, time.perf_counter() - start
+
+
+class lifespan:
+    """Async context manager running the app's ASGI startup and shutdown events"""
+
+    def __init__(self, app):
+        self.app = app
+        self._queue = asyncio.Queue()
+        self._sent = asyncio.Queue()
+        self._task = None
+
+    async def _receive(self):
+        return await self._queue.get()
+
+    async def _send(self, message):
+        await self._sent.put(message)
+
+    async def __aenter__(self):
+        scope = {"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}}
+        self._task = asyncio.create_task(self.app(scope, self._receive, self._send))
+        await self._queue.put({"type": "lifespan.startup"})
+        message = await self._sent.get()
+        if message["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"App startup failed: {message.get('message')}")
+        return self.app
+
+    async def __aexit__(self, *exc):
+        await self._queue.put({"type": "lifespan.shutdown"})
+        await self._sent.get()
+        await self._task
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def latency_summary(latencies: list) -> dict:
+    """p50/p95/p99/max in milliseconds"""
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0,
+    }
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Local load test
+
+Seeds realistic tenants (sites, workers, months of attendance and advances)
+into the benchmark database, then drives the app in-process with concurrent
+clients through the scenarios managers actually hit:
+
+    morning_roll_call  every site marks today's attendance in one roll call
+    worker_detail      worker, attendance, advances and salary for one worker
+    payroll_run        monthly payroll for a whole site
+    report_export      attendance CSV export for a site, payroll XLSX export for a tenant
+
+Each scenario reports requests per second, p50/p95/p99 latency and errors.
+Save a run as the baseline and later runs are compared against it; the exit
+code is non-zero when a scenario's p95 regresses past --threshold.
+
+    python benchmarks/load_test.py --save-baseline benchmarks/baseline.json
+    python benchmarks/load_test.py --baseline benchmarks/baseline.json
+    python benchmarks/load_test.py --tenants 5 --workers 200 --days 60 --scenario payroll_run
+
+Refuses to run against a database whose name does not end in "_bench"
+unless --force is given, because seeding drops the tenants' data.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from common import latency_summary, lifespan, timed_request
+
+from auth import create_access_token
+from rollups import rebuild_rollups
+from server import app, db
+
+STATUSES = ["present"] * 8 + ["half"] + ["absent"]
+SCENARIOS = ("morning_roll_call", "worker_detail", "payroll_run", "report_export")
+
+
+# ==================== SEEDING ====================
+
+async def seed(tenants: int, sites_per_tenant: int, workers_per_site: int, days: int, seed_value: int) -> list:
+    """Insert tenants with sites, workers, attendance and advances; returns the tenant layout"""
+    rng = random.Random(seed_value)
+    today = date.today()
+    first_day = today - timedelta(days=days)
+    layout = []
+    # Leftovers from an earlier --keep-data run
+    await drop_tenants([f"bench-tenant-{t}" for t in range(tenants)])
+
+    for t in range(tenants):
+        user_id = f"bench-tenant-{t}"
+        tenant = {"user_id": user_id, "email": f"{user_id}@bench.local", "sites": []}
+        await db.users.insert_one({
+            "id": user_id, "email": tenant["email"], "name": f"Bench Tenant {t}",
+            "role": "manager", "password_hash": "", "created_at": datetime.utcnow(),
+        })
+
+        for s in range(sites_per_tenant):
+            site_id = str(uuid.uuid4())
+            await db.sites.insert_one({
+                "id": site_id, "name": f"Site {t}-{s}", "location": "Bench",
+                "user_id": user_id, "created_at": datetime.utcnow(),
+            })
+            workers = []
+            for w in range(workers_per_site):
+                workers.append({
+                    "id": str(uuid.uuid4()), "name": f"Worker {t}-{s}-{w}", "phone": None,
+                    "role": rng.choice(["mason", "helper", "carpenter", "electrician"]),
+                    "daily_rate": rng.choice([400, 500, 600, 750]), "site_id": site_id,
+                    "user_id": user_id, "status": "active", "created_at": datetime.utcnow().isoformat(),
+                })
+            await db.workers.insert_many(workers)
+
+            # Attendance and advances are inserted a day at a time to keep batches bounded
+            for offset in range(days):
+                day = (first_day + timedelta(days=offset)).isoformat()
+                await db.attendance.insert_many([{
+                    "id": str(uuid.uuid4()), "worker_id": worker["id"], "date": day,
+                    "status": rng.choice(STATUSES), "marked_by": user_id,
+                    "marked_at": datetime.utcnow(), "created_at": datetime.utcnow(),
+                } for worker in workers])
+                advances = [{
+                    "id": str(uuid.uuid4()), "worker_id": worker["id"], "date": day,
+                    "amount": float(rng.choice([100, 200, 500])), "created_at": datetime.utcnow(),
+                } for worker in workers if rng.random() < 0.05]
+                if advances:
+                    await db.advances.insert_many(advances)
+                if offset % 7 == 6:
+                    # Weekly wage payments, read by the payroll report
+                    paid_at = datetime.combine(first_day + timedelta(days=offset), datetime.min.time())
+                    await db.payments.insert_many([{
+                        "worker_id": worker["id"], "amount": float(worker["daily_rate"] * 6), "date": paid_at,
+                        "user_id": user_id, "description": "Weekly wages",
+                    } for worker in workers])
+
+            tenant["sites"].append({"site_id": site_id, "worker_ids": [w["id"] for w in workers]})
+        layout.append(tenant)
+
+    await rebuild_rollups(db)
+    return layout
+
+
+async def drop_tenants(user_ids: list):
+    """Remove the benchmark tenants and everything that belongs to them"""
+    workers = await db.workers.find({"user_id": {"$in": user_ids}}, {"_id": 0, "id": 1}).to_list(length=None)
+    worker_ids = [w["id"] for w in workers]
+    await db.attendance.delete_many({"worker_id": {"$in": worker_ids}})
+    await db.attendance_rollups.delete_many({"worker_id": {"$in": worker_ids}})
+    await db.advances.delete_many({"worker_id": {"$in": worker_ids}})
+    await db.payments.delete_many({"user_id": {"$in": user_ids}})
+    await db.workers.delete_many({"user_id": {"$in": user_ids}})
+    await db.sites.delete_many({"user_id": {"$in": user_ids}})
+    await db.users.delete_many({"id": {"$in": user_ids}})
+
+
+# ==================== SCENARIOS ====================
+
+def month_period() -> tuple:
+    """First and last day of the previous month"""
+    first_of_month = date.today().replace(day=1)
+    last = first_of_month - timedelta(days=1)
+    return last.replace(day=1).isoformat(), last.isoformat()
+
+
+def build_requests(scenario: str, layout: list, rng: random.Random, roll_call_chunk: int) -> list:
+    """List of (method, path, body, headers) making up one pass of a scenario"""
+    requests = []
+    date_from, date_to = month_period()
+    today = date.today().isoformat()
+
+    for tenant in layout:
+        headers = {"authorization": "Bearer " + create_access_token(
+            {"user_id": tenant["user_id"], "email": tenant["email"]}
+        )}
+        for site in tenant["sites"]:
+            site_id = site["site_id"]
+            if scenario == "morning_roll_call":
+                # The app sends the roll call in chunks as the supervisor works down the list
+                ids = site["worker_ids"]
+                for start in range(0, len(ids), roll_call_chunk):
+                    entries = [{"worker_id": wid, "status": rng.choice(STATUSES)} for wid in ids[start:start + roll_call_chunk]]
+                    requests.append(("POST", "/api/attendance/roll-call",
+                                     {"site_id": site_id, "date": today, "entries": entries}, headers))
+            elif scenario == "worker_detail":
+                for worker_id in rng.sample(site["worker_ids"], min(10, len(site["worker_ids"]))):
+                    requests += [
+                        ("GET", f"/api/workers/{worker_id}", None, headers),
+                        ("GET", f"/api/attendance/{worker_id}?limit=31", None, headers),
+                        ("GET", f"/api/advances/{worker_id}?limit=50", None, headers),
+                        ("GET", f"/api/salary/{worker_id}?date_from={date_from}&date_to={date_to}", None, headers),
+                    ]
+            elif scenario == "payroll_run":
+                requests.append(("GET", f"/api/payroll/run?site_id={site_id}&date_from={date_from}&date_to={date_to}",
+                                 None, headers))
+            elif scenario == "report_export":
+                requests.append(("GET", f"/api/reports/attendance/export?site_id={site_id}&start_date={date_from}"
+                                        f"&end_date={date_to}&format=csv", None, headers))
+        if scenario == "report_export":
+            # The payroll report covers the tenant's payments, not one site
+            requests.append(("GET", f"/api/reports/payroll/export?start_date={date_from}&end_date={date_to}T23:59:59"
+                                    f"&format=xlsx", None, headers))
+    rng.shuffle(requests)
+    return requests
+
+
+async def run_scenario(scenario: str, layout: list, concurrency: int, passes: int, seed_value: int,
+                       roll_call_chunk: int) -> dict:
+    """Run every request of a scenario `passes` times with at most `concurrency` in flight"""
+    rng = random.Random(seed_value)
+    requests = [r for _ in range(passes) for r in build_requests(scenario, layout, rng, roll_call_chunk)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(method, path, body, headers):
+        async with semaphore:
+            return await timed_request(app, method, path, body, headers)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*[one(*r) for r in requests])
+    elapsed = time.perf_counter() - started
+
+    errors = {}
+    for status, _, _ in results:
+        if status != 200:
+            errors[str(status)] = errors.get(str(status), 0) + 1
+    return {
+        "requests": len(results),
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(results) / elapsed, 1) if elapsed else 0.0,
+        **latency_summary([latency for _, _, latency in results]),
+        "errors": errors,
+    }
+
+
+# ==================== BASELINE ====================
+
+def compare(report: dict, baseline: dict, threshold: float) -> list:
+    """Scenarios whose p95 grew or whose RPS fell by more than `threshold` (a fraction)"""
+    regressions = []
+    for scenario, current in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(scenario)
+        if not before:
+            continue
+        current["baseline"] = {"rps": before["rps"], "p95_ms": before["p95_ms"]}
+        if before["p95_ms"] and current["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(f"{scenario}: p95 {before['p95_ms']} ms -> {current['p95_ms']} ms")
+        if before["rps"] and current["rps"] < before["rps"] * (1 - threshold):
+            regressions.append(f"{scenario}: rps {before['rps']} -> {current['rps']}")
+    return regressions
+
+
+async def run(args) -> dict:
+    scenarios = args.scenario or list(SCENARIOS)
+    async with lifespan(app):
+        seed_started = time.perf_counter()
+        layout = await seed(args.tenants, args.sites, args.workers, args.days, args.seed)
+        seeded = {
+            "tenants": args.tenants, "sites_per_tenant": args.sites, "workers_per_site": args.workers,
+            "days": args.days, "seconds": round(time.perf_counter() - seed_started, 1),
+        }
+        try:
+            report = {"seed": seeded, "scenarios": {}}
+            for scenario in scenarios:
+                report["scenarios"][scenario] = await run_scenario(
+                    scenario, layout, args.concurrency, args.passes, args.seed, args.roll_call_chunk
+                )
+        finally:
+            if not args.keep_data:
+                await drop_tenants([tenant["user_id"] for tenant in layout])
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=3)
+    parser.add_argument("--sites", type=int, default=4, help="sites per tenant")
+    parser.add_argument("--workers", type=int, default=100, help="workers per site")
+    parser.add_argument("--days", type=int, default=90, help="days of attendance history")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--passes", type=int, default=3, help="times each scenario's request set is replayed")
+    parser.add_argument("--roll-call-chunk", type=int, default=50, help="workers per roll-call request")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="run only these scenarios")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", help="compare with a saved baseline")
+    parser.add_argument("--save-baseline", help="write this run's results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression as a fraction (default 0.2)")
+    parser.add_argument("--keep-data", action="store_true", help="leave the seeded data in place")
+    parser.add_argument("--force", action="store_true", help="allow a database not named *_bench")
+    args = parser.parse_args()
+
+    if not os.environ["DB_NAME"].endswith("_bench") and not args.force:
+        sys.exit(f"Refusing to seed DB_NAME={os.environ['DB_NAME']}; use a *_bench database or --force")
+
+    report = asyncio.run(run(args))
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        report["regressions"] = regressions
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    if regressions:
+        sys.exit(1)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Login burst benchmark
+
+Fires N concurrent logins (the shift-start burst) while a probe keeps calling
+an unrelated endpoint, and reports the probe's latency percentiles. With
+bcrypt running in the password hash pool the probe should stay fast; run with
+--inline to hash on the event loop instead and compare.
+
+    python benchmarks/login_burst.py --logins 200
+    python benchmarks/login_burst.py --logins 200 --inline
+"""
+import argparse
+import asyncio
+import json
+
+from common import latency_summary, lifespan, timed_request
+
+import auth
+from server import app, db
+
+BENCH_EMAIL = "login-burst@bench.local"
+BENCH_PASSWORD = "bench-password"
+
+
+async def seed_user():
+    await db.users.delete_many({"email": BENCH_EMAIL})
+    await db.users.insert_one({
+        "id": "login-burst-user",
+        "email": BENCH_EMAIL,
+        "name": "Login Burst",
+        "role": "manager",
+        "password_hash": await auth.hash_password(BENCH_PASSWORD),
+    })
+
+
+async def probe(stop: asyncio.Event, latencies: list):
+    """Call the API root back to back until the burst is over"""
+    while not stop.is_set():
+        _, _, latency = await timed_request(app, "GET", "/api/")
+        latencies.append(latency)
+        await asyncio.sleep(0.005)
+
+
+async def run(logins: int, inline: bool) -> dict:
+    if inline:
+        async def run_inline(func, *args):
+            return func(*args)
+        auth.run_password_hash = run_inline
+
+    async with lifespan(app):
+        await seed_user()
+
+        # Baseline probe latency with no logins in flight
+        idle = []
+        stop = asyncio.Event()
+        idle_probe = asyncio.create_task(probe(stop, idle))
+        await asyncio.sleep(1)
+        stop.set()
+        await idle_probe
+
+        busy = []
+        stop = asyncio.Event()
+        busy_probe = asyncio.create_task(probe(stop, busy))
+        results = await asyncio.gather(*[
+            timed_request(app, "POST", "/api/auth/login", {"email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+            for _ in range(logins)
+        ])
+        stop.set()
+        await busy_probe
+
+        await db.users.delete_many({"email": BENCH_EMAIL})
+
+    return {
+        "mode": "inline" if inline else "thread-pool",
+        "bcrypt_rounds": auth.BCRYPT_ROUNDS,
+        "hash_workers": auth.PASSWORD_HASH_WORKERS,
+        "logins": latency_summary([latency for _, _, latency in results]),
+        "failed_logins": sum(1 for status, _, _ in results if status != 200),
+        "probe_idle": latency_summary(idle),
+        "probe_during_burst": latency_summary(busy),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--inline", action="store_true", help="hash on the event loop (pre-thread-pool behaviour)")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.logins, args.inline)), indent=2))
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Payroll engine benchmark
+
+Times salaries for every worker of a large tenant over one month:
+
+    per_worker  the calculate_salary path for each worker: count statuses with
+                generator passes over its attendance, sum its advances, build
+                the SalaryRecord
+    vectorized  payroll.compute_payroll over the same columns in one call
+
+Both run on the same in-memory data and must agree worker for worker. With
+--sqlite the data is also written to a temporary SQLite database, and the
+comparison is repeated end to end: per-worker repository queries against one
+payroll_inputs read followed by compute_payroll.
+
+    python benchmarks/payroll_bench.py --workers 5000 --days 30 --repeat 5 [--sqlite]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from common import BACKEND_DIR  # noqa: F401 - puts backend/ on sys.path
+
+from payroll import compute_payroll, payroll_rows
+from server import build_salary_record
+
+STATUSES = ["present"] * 7 + ["half", "absent", "holiday"]
+FIELDS = ("total_days", "present_days", "half_days", "absent_days", "total_advances", "net_payable")
+
+
+def tenant_data(workers: int, days: int, seed: int = 7):
+    """Workers, attendance documents and advance documents shaped like the collections"""
+    rng = random.Random(seed)
+    start = date(2024, 5, 1)
+    worker_docs = [{"id": str(uuid.uuid4()), "daily_rate": rng.choice([450, 500, 600, 750])} for _ in range(workers)]
+    attendance = [
+        {"worker_id": w["id"], "date": (start + timedelta(days=d)).isoformat(), "status": rng.choice(STATUSES)}
+        for w in worker_docs for d in range(days)
+    ]
+    advances = [
+        {"worker_id": w["id"], "date": (start + timedelta(days=rng.randrange(days))).isoformat(), "amount": float(rng.randrange(100, 2000, 50))}
+        for w in worker_docs for _ in range(rng.randrange(3))
+    ]
+    period = (start.isoformat(), (start + timedelta(days=days - 1)).isoformat())
+    return worker_docs, attendance, advances, period
+
+
+def per_worker(worker_docs, attendance_by_worker, advances_by_worker, date_from, date_to) -> list:
+    salaries = []
+    for worker in worker_docs:
+        records = attendance_by_worker.get(worker["id"], [])
+        status_counts = {
+            "present": sum(1 for a in records if a["status"] == "present"),
+            "half": sum(1 for a in records if a["status"] == "half"),
+            "absent": sum(1 for a in records if a["status"] == "absent"),
+        }
+        status_counts["other"] = len(records) - sum(status_counts.values())
+        total_advances = 0.0
+        for advance in advances_by_worker.get(worker["id"], []):
+            total_advances += advance["amount"]
+        salaries.append(build_salary_record(
+            worker["id"], worker["daily_rate"], status_counts, total_advances, date_from, date_to
+        ).dict())
+    return salaries
+
+
+def vectorized(inputs: tuple, date_from, date_to) -> list:
+    return payroll_rows(compute_payroll(*inputs), date_from, date_to)
+
+
+def agree(expected: list, actual: list):
+    assert len(expected) == len(actual)
+    by_worker = {row["worker_id"]: row for row in actual}
+    for want in expected:
+        got = by_worker[want["worker_id"]]
+        for field in FIELDS:
+            assert abs(want[field] - got[field]) < 1e-6, (want["worker_id"], field, want[field], got[field])
+
+
+def time_ms(func, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(samples), 2), "min_ms": round(min(samples), 2)}
+
+
+async def time_ms_async(func, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(samples), 2), "min_ms": round(min(samples), 2)}
+
+
+async def run_sqlite(worker_docs, attendance, advances, date_from, date_to, repeat: int) -> dict:
+    from sqlite_repository import SQLiteRepository
+
+    with tempfile.TemporaryDirectory() as tmp:
+        repository = SQLiteRepository(os.path.join(tmp, "payroll.db"))
+        await repository.open()
+        try:
+            now = datetime.utcnow()
+            for worker in worker_docs:
+                await repository.create_worker({**worker, "name": "w", "phone": "0", "role": "mason", "site_id": "site-1",
+                                                "user_id": "bench-user", "status": "active", "created_at": now})
+            by_day = {}
+            for a in attendance:
+                by_day.setdefault(a["date"], []).append((a["worker_id"], a["status"], 0))
+            for day, marks in by_day.items():
+                await repository.mark_attendance_many(day, marks, "bench-user")
+            for advance in advances:
+                await repository.create_advance({**advance, "id": str(uuid.uuid4()), "created_at": now})
+
+            async def per_worker_queries():
+                salaries = []
+                for worker in worker_docs:
+                    counts = await repository.attendance_status_counts(worker["id"], date_from, date_to)
+                    total = await repository.total_advances(worker["id"], date_from, date_to)
+                    salaries.append(build_salary_record(worker["id"], worker["daily_rate"], counts, total, date_from, date_to).dict())
+                return salaries
+
+            async def batch_query():
+                inputs = await repository.payroll_inputs("bench-user", "site-1", date_from, date_to)
+                return payroll_rows(compute_payroll(*inputs), date_from, date_to)
+
+            agree(await per_worker_queries(), await batch_query())
+            return {
+                "per_worker": await time_ms_async(per_worker_queries, repeat),
+                "vectorized": await time_ms_async(batch_query, repeat),
+            }
+        finally:
+            await repository.close()
+
+
+def run(workers: int, days: int, repeat: int, sqlite: bool) -> dict:
+    worker_docs, attendance, advances, (date_from, date_to) = tenant_data(workers, days)
+    attendance_by_worker, advances_by_worker = {}, {}
+    for record in attendance:
+        attendance_by_worker.setdefault(record["worker_id"], []).append(record)
+    for advance in advances:
+        advances_by_worker.setdefault(advance["worker_id"], []).append(advance)
+
+    # Both sides start from what their queries return: per-worker document lists, or the payroll_inputs columns
+    inputs = (
+        [(w["id"], w["daily_rate"]) for w in worker_docs],
+        [(a["worker_id"], a["status"]) for a in attendance],
+        [(a["worker_id"], a["amount"]) for a in advances],
+    )
+    agree(per_worker(worker_docs, attendance_by_worker, advances_by_worker, date_from, date_to),
+          vectorized(inputs, date_from, date_to))
+
+    report = {
+        "workers": workers,
+        "attendance_records": len(attendance),
+        "advances": len(advances),
+        "in_memory": {
+            "per_worker": time_ms(lambda: per_worker(worker_docs, attendance_by_worker, advances_by_worker, date_from, date_to), repeat),
+            "vectorized": time_ms(lambda: vectorized(inputs, date_from, date_to), repeat),
+        },
+    }
+    if sqlite:
+        report["sqlite"] = asyncio.run(run_sqlite(worker_docs, attendance, advances, date_from, date_to, repeat))
+    for name in ("in_memory", "sqlite"):
+        if name in report:
+            result = report[name]
+            result["speedup"] = round(result["per_worker"]["median_ms"] / max(result["vectorized"]["median_ms"], 1e-6), 1)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sqlite", action="store_true", help="also compare end to end on a temporary SQLite database")
+    args = parser.parse_args()
+    print(json.dumps(run(args.workers, args.days, args.repeat, args.sqlite), indent=2))
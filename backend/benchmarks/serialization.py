@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Response serialization micro-benchmark
+
+Times turning a 1,000-worker get_workers result into response bytes:
+
+    before  FastAPI's default path: jsonable_encoder, then JSONResponse (stdlib json)
+    after   FastJSONResponse straight from the documents (orjson, no encoder walk)
+
+Also times the salary response: SalaryRecord.dict() through the encoder
+versus model_response() dumping the model to JSON in one step.
+
+    python benchmarks/serialization.py --workers 1000 --repeat 200
+"""
+import argparse
+import json
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from common import BACKEND_DIR  # noqa: F401 - puts backend/ on sys.path
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from responses import FastJSONResponse, model_response
+from server import build_salary_record
+
+
+def worker_documents(count: int) -> list:
+    """Documents shaped like db.workers rows read with {'_id': 0}"""
+    created = datetime(2024, 1, 1)
+    return [{
+        "id": str(uuid.uuid4()),
+        "name": f"Worker {i}",
+        "phone": f"98{i:08d}",
+        "role": "mason",
+        "daily_rate": 500 + i % 5 * 50,
+        "site_id": "site-1",
+        "user_id": "bench-user",
+        "status": "active",
+        "created_at": created + timedelta(minutes=i),
+    } for i in range(count)]
+
+
+def time_ms(func, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(samples), 3), "min_ms": round(min(samples), 3)}
+
+
+def run(workers: int, repeat: int) -> dict:
+    docs = worker_documents(workers)
+    salary = build_salary_record("bench-worker", 600, {"present": 22, "half": 2, "absent": 4}, 1500.0,
+                                 "2024-05-01", "2024-05-31")
+
+    before = JSONResponse(jsonable_encoder(docs)).body
+    after = FastJSONResponse(docs).body
+    # Same documents either way (datetime formatting included)
+    assert json.loads(before) == json.loads(after)
+
+    report = {
+        "get_workers": {
+            "workers": workers,
+            "bytes": len(after),
+            "before": time_ms(lambda: JSONResponse(jsonable_encoder(docs)), repeat),
+            "after": time_ms(lambda: FastJSONResponse(docs), repeat),
+        },
+        "calculate_salary": {
+            "before": time_ms(lambda: JSONResponse(jsonable_encoder(salary.dict())), repeat),
+            "after": time_ms(lambda: model_response(salary), repeat),
+        },
+    }
+    for result in report.values():
+        result["speedup"] = round(result["before"]["median_ms"] / max(result["after"]["median_ms"], 1e-6), 1)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps(run(args.workers, args.repeat), indent=2))
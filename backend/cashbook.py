@@ -0,0 +1,224 @@
+# Cashbook ledger
+#
+# Entries live in `cashbook_entries`:
+#   {"id", "user_id", "type": "income" | "expense", "amount", "date": "YYYY-MM-DD",
+#    "time": "HH:MM", "description", "created_at"}
+# and every day with entries has a checkpoint in `cashbook_balances`:
+#   {"_id": "<user_id>:YYYY-MM-DD", "user_id", "date", "income", "expense", "closing"}
+# where `closing` is the balance at the end of that day. A page of entries
+# (newest first) gets its running balances from the checkpoint of its first
+# entry's day, less the entries of that day that sort above the page, and then
+# walks down the page; nothing before the page is summed.
+#
+# Writing an entry on day D moves D's income/expense by the entry and every
+# closing from D onwards by its net, so a backdated entry touches one
+# checkpoint per later day instead of rebuilding the ledger. Checkpoint writes
+# for one tenant are serialised within the process.
+#
+# Usage:
+#   python cashbook.py rebuild            # recompute every checkpoint from the entries
+#   python cashbook.py rebuild --verify   # only report checkpoints that disagree with the entries
+import argparse
+import asyncio
+import os
+import weakref
+from datetime import datetime
+from pathlib import Path
+
+from pymongo import ReplaceOne
+
+from pagination import DEFAULT_PAGE_SIZE, fetch_page
+
+CASHBOOK_TYPES = ("income", "expense")
+# Keyset order of a page, newest first; time is zero-padded 24h HH:MM so it sorts as text
+CASHBOOK_ORDER = [("date", -1), ("time", -1), ("id", -1)]
+TIME_FORMATS = ("%H:%M", "%I:%M %p")
+
+_ledger_locks = weakref.WeakValueDictionary()
+
+
+def normalize_time(value: str) -> str:
+    """HH:MM (24h) from "16:54" or "04:54 PM"; raises ValueError"""
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.strptime(value.strip().upper(), time_format).strftime("%H:%M")
+        except ValueError:
+            continue
+    raise ValueError(f"Time must be HH:MM or hh:mm AM/PM, got {value!r}")
+
+
+def signed_amount(entry: dict) -> float:
+    return entry["amount"] if entry["type"] == "income" else -entry["amount"]
+
+
+def checkpoint_id(user_id: str, day: str) -> str:
+    return f"{user_id}:{day}"
+
+
+def _ledger_lock(user_id: str) -> asyncio.Lock:
+    lock = _ledger_locks.get(user_id)
+    if lock is None:
+        lock = _ledger_locks[user_id] = asyncio.Lock()
+    return lock
+
+
+async def apply_entry_delta(db, user_id: str, day: str, income: float, expense: float):
+    """Move day's checkpoint by an income/expense delta and shift every closing from that day on"""
+    async with _ledger_lock(user_id):
+        checkpoint = {"_id": checkpoint_id(user_id, day)}
+        if not await db.cashbook_balances.find_one(checkpoint, {"_id": 1}):
+            # First entry of the day: it opens at the previous day's closing
+            previous = await db.cashbook_balances.find_one(
+                {"user_id": user_id, "date": {"$lt": day}}, {"closing": 1}, sort=[("date", -1)]
+            )
+            await db.cashbook_balances.update_one(checkpoint, {"$setOnInsert": {
+                "user_id": user_id, "date": day, "income": 0.0, "expense": 0.0,
+                "closing": previous["closing"] if previous else 0.0
+            }}, upsert=True)
+        await db.cashbook_balances.update_one(checkpoint, {"$inc": {"income": income, "expense": expense}})
+        if income != expense:
+            await db.cashbook_balances.update_many(
+                {"user_id": user_id, "date": {"$gte": day}}, {"$inc": {"closing": income - expense}}
+            )
+
+
+async def record_entry(db, entry: dict, sign: int = 1):
+    """Apply an entry to the checkpoints; sign=-1 takes it back out"""
+    amount = sign * entry["amount"]
+    income, expense = (amount, 0.0) if entry["type"] == "income" else (0.0, amount)
+    await apply_entry_delta(db, entry["user_id"], entry["date"], income, expense)
+
+
+async def entries_page(db, user_id: str, date_from: str = None, date_to: str = None,
+                       limit: int = None, cursor: str = None) -> dict:
+    """One keyset page of entries, newest first, each with the running `balance` after it"""
+    query = {"user_id": user_id}
+    if date_from or date_to:
+        query["date"] = {k: v for k, v in (("$gte", date_from), ("$lte", date_to)) if v}
+    entries, next_cursor = await fetch_page(
+        db.cashbook_entries, query, CASHBOOK_ORDER, limit or DEFAULT_PAGE_SIZE, cursor, {"_id": 0}
+    )
+    if not entries:
+        return {"items": [], "next_cursor": None}
+
+    top = entries[0]
+    checkpoint = await db.cashbook_balances.find_one({"_id": checkpoint_id(user_id, top["date"])}, {"closing": 1})
+    # Entries of the same day sorting above the page came after it
+    later = await db.cashbook_entries.aggregate([
+        {"$match": {"user_id": user_id, "date": top["date"], "$or": [
+            {"time": {"$gt": top["time"]}}, {"time": top["time"], "id": {"$gt": top["id"]}}
+        ]}},
+        {"$group": {"_id": None, "net": {"$sum": {"$cond": [{"$eq": ["$type", "income"]}, "$amount", {"$multiply": ["$amount", -1]}]}}}}
+    ]).to_list(length=1)
+
+    balance = (checkpoint["closing"] if checkpoint else 0.0) - (later[0]["net"] if later else 0.0)
+    for entry in entries:
+        entry["balance"] = balance
+        balance -= signed_amount(entry)
+    return {"items": entries, "next_cursor": next_cursor}
+
+
+async def ledger_summary(db, user_id: str, date_from: str, date_to: str) -> dict:
+    """Opening balance, income, expense and closing balance for a period, from checkpoints only"""
+    previous = await db.cashbook_balances.find_one(
+        {"user_id": user_id, "date": {"$lt": date_from}}, {"closing": 1}, sort=[("date", -1)]
+    )
+    totals = await db.cashbook_balances.aggregate([
+        {"$match": {"user_id": user_id, "date": {"$gte": date_from, "$lte": date_to}}},
+        {"$group": {"_id": None, "income": {"$sum": "$income"}, "expense": {"$sum": "$expense"}}}
+    ]).to_list(length=1)
+    opening = previous["closing"] if previous else 0.0
+    income = totals[0]["income"] if totals else 0.0
+    expense = totals[0]["expense"] if totals else 0.0
+    return {
+        "date_from": date_from,
+        "date_to": date_to,
+        "opening_balance": opening,
+        "income": income,
+        "expense": expense,
+        "closing_balance": opening + income - expense,
+    }
+
+
+# ==================== MAINTENANCE ====================
+
+async def compute_checkpoints(db, user_id: str = None) -> dict:
+    """Recompute checkpoints from the entries, keyed by _id"""
+    match = {"user_id": user_id} if user_id else {}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "date": "$date"},
+            "income": {"$sum": {"$cond": [{"$eq": ["$type", "income"]}, "$amount", 0]}},
+            "expense": {"$sum": {"$cond": [{"$eq": ["$type", "expense"]}, "$amount", 0]}},
+        }},
+        {"$sort": {"_id.user_id": 1, "_id.date": 1}}
+    ]
+    checkpoints, closing, current_user = {}, 0.0, None
+    async for row in db.cashbook_entries.aggregate(pipeline, allowDiskUse=True):
+        user, day = row["_id"]["user_id"], row["_id"]["date"]
+        if user != current_user:
+            current_user, closing = user, 0.0
+        closing += row["income"] - row["expense"]
+        checkpoints[checkpoint_id(user, day)] = {
+            "_id": checkpoint_id(user, day), "user_id": user, "date": day,
+            "income": float(row["income"]), "expense": float(row["expense"]), "closing": closing
+        }
+    return checkpoints
+
+
+async def rebuild_checkpoints(db, user_id: str = None) -> int:
+    """Replace stored checkpoints with values recomputed from the entries"""
+    checkpoints = await compute_checkpoints(db, user_id)
+    await db.cashbook_balances.delete_many({"user_id": user_id} if user_id else {})
+    if checkpoints:
+        await db.cashbook_balances.bulk_write(
+            [ReplaceOne({"_id": key}, doc, upsert=True) for key, doc in checkpoints.items()], ordered=False
+        )
+    return len(checkpoints)
+
+
+async def verify_checkpoints(db) -> list:
+    """(_id, stored closing, expected closing) for every checkpoint that disagrees with the entries"""
+    expected = await compute_checkpoints(db)
+    mismatches = []
+    async for stored in db.cashbook_balances.find({}):
+        wanted = expected.pop(stored["_id"], None)
+        wanted_closing = wanted["closing"] if wanted else None
+        # Days whose entries were all deleted keep a zero checkpoint, which is harmless
+        if wanted is None and not stored.get("income") and not stored.get("expense"):
+            continue
+        if wanted_closing is None or abs(stored["closing"] - wanted_closing) > 0.005:
+            mismatches.append((stored["_id"], stored["closing"], wanted_closing))
+    mismatches.extend((key, None, wanted["closing"]) for key, wanted in expected.items())
+    return mismatches
+
+
+async def _main(verify: bool) -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ.get('DB_NAME', 'worksite_manager')]
+    try:
+        if verify:
+            mismatches = await verify_checkpoints(db)
+            for key, stored, wanted in mismatches:
+                print(f"{key}: stored={stored} expected={wanted}")
+            print(f"{len(mismatches)} mismatched checkpoints")
+            return 1 if mismatches else 0
+
+        count = await rebuild_checkpoints(db)
+        print(f"Rebuilt {count} checkpoints")
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain cashbook balance checkpoints for the Worksite Manager API")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--verify", action="store_true", help="compare stored checkpoints with the entries without writing")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(_main(args.verify)))
@@ -0,0 +1,65 @@
+# Conditional GETs for list endpoints
+#
+# Every tenant has a monotonically increasing data version per (collection,
+# site), stored by the repository. Write endpoints bump the version of the
+# site they touched and of the tenant-wide "*" scope; list endpoints derive
+# their ETag from the version of the scope they read. A request whose
+# If-None-Match still matches gets a 304 before the collection is queried.
+#
+# Ordering keeps caches correct under concurrent writes: readers load the
+# version before the data, writers bump it after the data. A reader racing a
+# write can at worst pair newer data with the older version, which only costs
+# one extra full response later - never a stale 304.
+import hashlib
+
+from fastapi.responses import Response
+
+ALL_SITES = "*"
+CACHE_CONTROL = "private, no-cache"
+
+
+def version_key(user_id: str, collection: str, site_id: str = None) -> str:
+    return f"{user_id}:{collection}:{site_id or ALL_SITES}"
+
+
+def write_keys(user_id: str, collection: str, site_id: str = None) -> list:
+    """Version keys a write to `site_id` invalidates: the site's and the tenant-wide one"""
+    keys = [version_key(user_id, collection)]
+    if site_id:
+        keys.append(version_key(user_id, collection, site_id))
+    return keys
+
+
+def make_etag(version: int, variant: str) -> str:
+    """ETag for one representation (version key, path, query string, Accept) at a data version"""
+    digest = hashlib.blake2b(variant.encode(), digest_size=6).hexdigest()
+    return f'W/"{version}-{digest}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Compare weakly: W/"x" and "x" name the same representation
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+async def conditional_response(request, repository, key: str, build, extra: str = ""):
+    """304 when the client's copy is current, otherwise build() with the ETag attached.
+
+    `extra` names any other input the response depends on, e.g. today's date.
+    """
+    version = await repository.data_version(key)
+    # The version key names the tenant, so two tenants at the same version of the
+    # same URL never share an ETag (e.g. a client that switches accounts)
+    variant = f"{key}|{request.url.path}?{request.url.query}|{request.headers.get('accept', '')}|{extra}"
+    etag = make_etag(version, variant)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    response = await build()
+    response.headers.update(headers)
+    return response
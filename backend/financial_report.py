@@ -0,0 +1,87 @@
+# Server-side financial report
+#
+# The financial report screen charts money over time. Instead of shipping every
+# payment, advance and attendance day to the phone, the backend turns them into
+# one frame of (date, site, kind, amount) rows and lets pandas group it into
+# day, week or month buckets, overall and per site:
+#   wages     earned from attendance at each worker's daily rate
+#   advances  advance payments recorded against workers
+#   payments  wage payments made to workers
+#   balance   wages - advances - payments, what is still owed for the bucket
+# Series come back as parallel arrays ({"period": [...], "wages": [...], ...})
+# with every bucket in the period present, zero-filled, so they chart directly.
+#
+# pandas is imported on first use, not at startup, to keep cold starts fast.
+from datetime import date
+
+from rollups import status_earning
+
+REPORT_GROUPINGS = {"day": "D", "week": "W-SUN", "month": "M"}  # weeks run Monday to Sunday
+REPORT_KINDS = ("wages", "advances", "payments")
+UNASSIGNED_SITE = "unassigned"
+
+
+def _frame(pd, rows: list, site_of: dict, kind: str):
+    """(worker_id, date, amount) rows as a (date, site_id, kind, amount) frame"""
+    frame = pd.DataFrame(rows, columns=["worker_id", "date", "amount"])
+    frame["date"] = pd.to_datetime(frame["date"].astype(str).str[:10], format="%Y-%m-%d")
+    frame["amount"] = frame["amount"].astype("float64")
+    frame["site_id"] = frame["worker_id"].map(site_of).fillna(UNASSIGNED_SITE)
+    frame["kind"] = kind
+    return frame[["date", "site_id", "kind", "amount"]]
+
+
+def _series(pd, frame, periods) -> dict:
+    """Parallel arrays of per-period amounts for each kind, plus the balance"""
+    table = frame.pivot_table(index="period", columns="kind", values="amount", aggfunc="sum", fill_value=0.0)
+    table = table.reindex(index=periods, columns=list(REPORT_KINDS), fill_value=0.0)
+    table["balance"] = table["wages"] - table["advances"] - table["payments"]
+    series = {"period": [period.start_time.date().isoformat() for period in table.index]}
+    series.update({column: table[column].round(2).tolist() for column in table.columns})
+    return series
+
+
+def _totals(series: dict) -> dict:
+    return {kind: round(sum(series[kind]), 2) for kind in (*REPORT_KINDS, "balance")}
+
+
+def build_financial_report(workers: list, attendance: list, advances: list, payments: list,
+                           date_from: str, date_to: str, group_by: str) -> dict:
+    """Grouped report from [(worker_id, site_id, daily_rate)], [(worker_id, date, status)],
+    [(worker_id, date, amount)] advances and [(worker_id, date, amount)] payments.
+
+    Raises ValueError for an unknown group_by or malformed dates.
+    """
+    if group_by not in REPORT_GROUPINGS:
+        raise ValueError(f"group_by must be one of {', '.join(REPORT_GROUPINGS)}")
+    start, end = date.fromisoformat(date_from), date.fromisoformat(date_to)
+
+    import pandas as pd
+
+    site_of = {worker_id: site_id for worker_id, site_id, _ in workers}
+    rate_of = {worker_id: 500 if rate is None else rate for worker_id, _, rate in workers}
+    wages = [(worker_id, day, status_earning(status, rate_of.get(worker_id, 500))) for worker_id, day, status in attendance]
+
+    frame = pd.concat([
+        _frame(pd, wages, site_of, "wages"),
+        _frame(pd, advances, site_of, "advances"),
+        _frame(pd, payments, site_of, "payments"),
+    ], ignore_index=True)
+    frame = frame[(frame["date"] >= pd.Timestamp(start)) & (frame["date"] <= pd.Timestamp(end))]
+    freq = REPORT_GROUPINGS[group_by]
+    frame = frame.assign(period=frame["date"].dt.to_period(freq))
+    periods = pd.period_range(start=start, end=end, freq=freq)
+
+    overall = _series(pd, frame, periods)
+    sites = []
+    for site_id, site_frame in frame.groupby("site_id", sort=True):
+        series = _series(pd, site_frame, periods)
+        sites.append({"site_id": site_id, "totals": _totals(series), "series": series})
+    return {
+        "date_from": date_from,
+        "date_to": date_to,
+        "group_by": group_by,
+        "totals": _totals(overall),
+        "series": overall,
+        "sites": sites,
+    }
@@ -0,0 +1,281 @@
+# Index management
+#
+# Declares the indexes each endpoint's query shape needs, creates them at app
+# startup and reports any query shape that still plans as a collection scan.
+#
+# Unique indexes are created one at a time, after the others, so data that
+# violates one never keeps the rest from being built. Duplicate attendance
+# records left by the old read-then-insert marking block the unique
+# (worker_id, date) index; startup never deletes them, it logs a warning and
+# skips that index until `dedupe` has kept the most recently marked record of
+# each (worker_id, date).
+#
+# Usage:
+#   python indexes.py ensure   # create missing indexes; warns about duplicate attendance
+#   python indexes.py dedupe   # remove duplicate attendance records, then run ensure
+#   python indexes.py report   # explain() every query shape and flag COLLSCANs
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from batch import IDEMPOTENCY_TTL_HOURS
+from sync import SYNC_LOG_TTL_DAYS
+
+logger = logging.getLogger(__name__)
+
+DEDUPE_CHUNK = 1000
+_EPOCH = datetime.min
+
+
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        IndexModel([("id", ASCENDING)], name="id"),
+    ],
+    "sites": [
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created"),
+    ],
+    "workers": [
+        IndexModel([("user_id", ASCENDING), ("site_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_site"),
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created"),
+        IndexModel([("id", ASCENDING), ("user_id", ASCENDING)], name="id_user"),
+    ],
+    "attendance": [
+        IndexModel([("worker_id", ASCENDING), ("date", ASCENDING)], unique=True, name="worker_date_unique"),
+        IndexModel([("id", ASCENDING)], name="id"),
+    ],
+    "attendance_months": [
+        IndexModel([("worker_id", ASCENDING), ("month", ASCENDING)], name="worker_month"),
+    ],
+    "attendance_rollups": [
+        IndexModel([("worker_id", ASCENDING), ("month", ASCENDING)], unique=True, name="worker_month_unique"),
+    ],
+    "advances": [
+        IndexModel([("worker_id", ASCENDING), ("date", ASCENDING), ("id", ASCENDING)], name="worker_date"),
+        # Unique so racing copies of a batch cannot insert the same advance twice (see batch.py)
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    ],
+    "payments": [
+        IndexModel([("user_id", ASCENDING), ("date", ASCENDING)], name="user_date"),
+        IndexModel([("user_id", ASCENDING), ("worker_id", ASCENDING)], name="user_worker"),
+    ],
+    "cashbook_entries": [
+        IndexModel([("user_id", ASCENDING), ("date", ASCENDING), ("time", ASCENDING), ("id", ASCENDING)], name="user_date_time"),
+        IndexModel([("id", ASCENDING), ("user_id", ASCENDING)], name="id_user"),
+    ],
+    "cashbook_balances": [
+        IndexModel([("user_id", ASCENDING), ("date", ASCENDING)], name="user_date"),
+    ],
+    "notes": [
+        IndexModel([("user_id", ASCENDING), ("due_date", ASCENDING), ("completed", ASCENDING)], name="user_due"),
+        IndexModel([("user_id", ASCENDING), ("category", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_category"),
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created"),
+        IndexModel([("id", ASCENDING), ("user_id", ASCENDING)], name="id_user"),
+        # Only tasks with a reminder still to fire carry remind_at
+        IndexModel([("remind_at", ASCENDING)], partialFilterExpression={"remind_at": {"$exists": True}}, name="remind_at_pending"),
+    ],
+    "sync_log": [
+        IndexModel([("user_id", ASCENDING), ("seq", ASCENDING)], unique=True, name="user_seq_unique"),
+        IndexModel([("at", ASCENDING)], expireAfterSeconds=SYNC_LOG_TTL_DAYS * 86400, name="at_ttl"),
+    ],
+    "idempotency_keys": [
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=IDEMPOTENCY_TTL_HOURS * 3600, name="created_ttl"),
+    ],
+}
+
+
+# (endpoint, collection, filter, sort) for every query the API issues.
+# Values are placeholders - only the shape matters to the query planner.
+QUERY_SHAPES = [
+    ("login", "users", {"email": "x"}, None),
+    ("get_current_user", "users", {"id": "x"}, None),
+    ("get_sites", "sites", {"user_id": "x"}, [("created_at", ASCENDING), ("id", ASCENDING)]),
+    ("get_workers", "workers", {"user_id": "x", "site_id": "x"}, [("created_at", ASCENDING), ("id", ASCENDING)]),
+    ("get_workers", "workers", {"user_id": "x"}, [("created_at", ASCENDING), ("id", ASCENDING)]),
+    ("get_worker", "workers", {"id": "x", "user_id": "x"}, None),
+    ("mark_roll_call", "workers", {"id": {"$in": ["x"]}, "user_id": "x", "site_id": "x"}, None),
+    ("mark_attendance", "attendance", {"worker_id": "x", "date": "x"}, None),
+    ("update_attendance", "attendance", {"id": "x"}, None),
+    ("get_worker_attendance", "attendance", {"worker_id": "x", "date": {"$gte": "x", "$lte": "x"}}, [("date", DESCENDING)]),
+    ("calculate_salary", "attendance", {"worker_id": "x", "date": {"$gte": "x", "$lte": "x"}}, None),
+    ("calculate_salary", "advances", {"worker_id": "x", "date": {"$gte": "x", "$lte": "x"}}, None),
+    ("calculate_salary", "attendance_months", {"_id": {"$gte": "x:2024-01", "$lte": "x:2024-02"}}, [("_id", DESCENDING)]),
+    ("calculate_salary", "attendance_rollups", {"worker_id": "x", "month": {"$in": ["x"]}}, None),
+    ("get_attendance_matrix", "workers", {"user_id": "x", "site_id": "x"}, [("created_at", ASCENDING), ("id", ASCENDING)]),
+    ("get_worker_advances", "advances", {"worker_id": "x", "date": {"$gte": "x", "$lte": "x"}}, [("date", DESCENDING)]),
+    ("get_payments", "payments", {"user_id": "x", "worker_id": "x"}, None),
+    ("get_financial_report", "payments", {"user_id": "x", "date": {"$gte": "x", "$lt": "x"}}, None),
+    ("get_payroll_report", "payments", {"user_id": "x", "date": {"$gte": "x", "$lte": "x"}}, None),
+    ("get_cashbook_entries", "cashbook_entries", {"user_id": "x"}, [("date", DESCENDING), ("time", DESCENDING), ("id", DESCENDING)]),
+    ("get_cashbook_entries", "cashbook_entries", {"user_id": "x", "date": "x", "time": {"$gt": "x"}}, None),
+    ("get_cashbook_entries", "cashbook_balances", {"_id": "x"}, None),
+    ("create_cashbook_entry", "cashbook_balances", {"user_id": "x", "date": {"$lt": "x"}}, [("date", DESCENDING)]),
+    ("create_cashbook_entry", "cashbook_balances", {"user_id": "x", "date": {"$gte": "x"}}, None),
+    ("get_cashbook_summary", "cashbook_balances", {"user_id": "x", "date": {"$gte": "x", "$lte": "x"}}, None),
+    ("update_cashbook_entry", "cashbook_entries", {"id": "x", "user_id": "x"}, None),
+    ("get_notes", "notes", {"user_id": "x"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("get_notes", "notes", {"user_id": "x", "category": "x"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("get_due_tasks", "notes", {"user_id": "x", "due_date": {"$lte": "x"}, "completed": False}, [("due_date", ASCENDING), ("id", ASCENDING)]),
+    ("update_note", "notes", {"id": "x", "user_id": "x"}, None),
+    ("reminder_scheduler", "notes", {"remind_at": {"$lte": "x"}}, [("remind_at", ASCENDING)]),
+    ("sync", "sync_log", {"user_id": "x", "seq": {"$gt": 0}}, [("seq", ASCENDING)]),
+    ("sync", "workers", {"id": {"$in": ["x"]}, "user_id": "x"}, None),
+    ("sync", "attendance", {"id": {"$in": ["x"]}}, None),
+    ("sync", "advances", {"id": {"$in": ["x"]}}, None),
+]
+
+
+def _latest_first(record: dict):
+    """Sort key putting the most recently marked record first"""
+    return (record.get("marked_at") or _EPOCH, record.get("created_at") or _EPOCH, record["_id"])
+
+
+def _duplicate_attendance(db):
+    """Cursor over each (worker_id, date) with more than one attendance record"""
+    pipeline = [
+        {"$group": {
+            "_id": {"worker_id": "$worker_id", "date": "$date"},
+            "count": {"$sum": 1},
+            "records": {"$push": {"_id": "$_id", "marked_at": "$marked_at", "created_at": "$created_at"}},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    return db.attendance.aggregate(pipeline, allowDiskUse=True)
+
+
+async def count_duplicate_attendance(db) -> int:
+    """Number of attendance records dedupe_attendance would delete"""
+    return sum([group["count"] - 1 async for group in _duplicate_attendance(db)])
+
+
+async def dedupe_attendance(db) -> int:
+    """Delete all but the most recently marked record of each duplicated (worker_id, date); returns the number deleted"""
+    stale = []
+    async for group in _duplicate_attendance(db):
+        records = sorted(group["records"], key=_latest_first, reverse=True)
+        stale.extend(record["_id"] for record in records[1:])
+    for start in range(0, len(stale), DEDUPE_CHUNK):
+        await db.attendance.delete_many({"_id": {"$in": stale[start:start + DEDUPE_CHUNK]}})
+    return len(stale)
+
+
+# Indexes dropped by ensure_indexes: {collection: [name]}
+RETIRED_INDEXES = {
+    "advances": ["id"],  # replaced by id_unique
+}
+
+
+async def ensure_indexes(db):
+    """Create every declared index. Failures are logged, not raised, so a bad
+    index (e.g. duplicate emails blocking email_unique) never blocks startup."""
+    unique = []
+    for collection, models in INDEXES.items():
+        for model in models:
+            if model.document.get("unique"):
+                unique.append((collection, model))
+            else:
+                await _create_index(db, collection, model)
+
+    # Replaced indexes on the same keys must go before their successors can be built
+    for collection, names in RETIRED_INDEXES.items():
+        existing = await db[collection].index_information()
+        for name in names:
+            if name in existing:
+                await db[collection].drop_index(name)
+
+    existing = await db.attendance.index_information()
+    if "worker_date_unique" not in existing:
+        duplicates = await count_duplicate_attendance(db)
+        if duplicates:
+            # Deleting records is left to an operator, never done at startup
+            logger.warning(
+                "%d duplicate attendance records block the worker_date_unique index; "
+                "run `python indexes.py dedupe` to remove them", duplicates
+            )
+            unique = [(c, m) for c, m in unique if (c, m.document["name"]) != ("attendance", "worker_date_unique")]
+    for collection, model in unique:
+        await _create_index(db, collection, model)
+
+
+async def _create_index(db, collection: str, model: IndexModel):
+    try:
+        await db[collection].create_indexes([model])
+    except OperationFailure as exc:
+        logger.error("Could not create index %s on %s: %s", model.document["name"], collection, exc)
+
+
+def _plan_stages(plan: dict):
+    """Yield every stage name in an explain() plan tree"""
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+
+async def index_report(db) -> list:
+    """Explain every query shape and return one entry per shape with its winning plan stages"""
+    report = []
+    for endpoint, collection, query, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        stages = list(_plan_stages(winning_plan))
+        report.append({
+            "endpoint": endpoint,
+            "collection": collection,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages
+        })
+    return report
+
+
+def _get_db():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    return client, client[os.environ.get('DB_NAME', 'worksite_manager')]
+
+
+async def _main(command: str) -> int:
+    client, db = _get_db()
+    try:
+        if command == "ensure":
+            await ensure_indexes(db)
+            print("Indexes ensured")
+            return 0
+        if command == "dedupe":
+            removed = await dedupe_attendance(db)
+            print(f"Removed {removed} duplicate attendance records")
+            await ensure_indexes(db)
+            print("Indexes ensured")
+            return 0
+
+        report = await index_report(db)
+        for entry in report:
+            flag = "COLLSCAN" if entry["collscan"] else "ok"
+            print(f"{flag:9} {entry['endpoint']:24} {entry['collection']:12} {' <- '.join(entry['stages'])}")
+        return 1 if any(entry["collscan"] for entry in report) else 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage MongoDB indexes for the Worksite Manager API")
+    parser.add_argument("command", choices=["ensure", "dedupe", "report"])
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(_main(args.command)))
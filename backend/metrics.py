@@ -0,0 +1,219 @@
+# Request and MongoDB metrics in Prometheus text format
+#
+# MetricsMiddleware records, per route template and status, a latency histogram
+# and request/response size histograms, plus the number of requests in flight.
+# CommandMetrics is a pymongo CommandListener; Motor runs pymongo calls with a
+# copy of the caller's contextvars, so every command is attributed to the route
+# of the request that issued it.
+import threading
+import time
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+# Mongo command totals collected for the request being served
+request_commands: ContextVar = ContextVar("request_commands", default=None)
+# ASGI scope of the request being served; the router adds the matched route to it
+request_scope: ContextVar = ContextVar("request_scope", default=None)
+
+
+def current_route() -> str:
+    """Route template of the request being served, "background" outside requests"""
+    scope = request_scope.get()
+    if scope is None:
+        return "background"
+    return getattr(scope.get("route"), "path", None) or "unmatched"
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a label tuple"""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple, buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, labels: tuple, value: float):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            base = _labels(self.label_names, labels)
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-2]}")
+            lines.append(f"{self.name}_count{{{base}}} {series[-1]}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter keyed by a label tuple"""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.series = {}
+
+    def inc(self, labels: tuple, amount: float = 1):
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{{{_labels(self.label_names, labels)}}} {value}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.latency = Histogram(
+            "http_request_duration_seconds", "Request latency by route and status",
+            ("method", "route", "status"), LATENCY_BUCKETS
+        )
+        self.request_size = Histogram(
+            "http_request_size_bytes", "Request body size by route",
+            ("method", "route"), SIZE_BUCKETS
+        )
+        self.response_size = Histogram(
+            "http_response_size_bytes", "Response body size by route and status",
+            ("method", "route", "status"), SIZE_BUCKETS
+        )
+        self.mongo_commands = Counter(
+            "mongo_commands_total", "MongoDB commands by originating route", ("route", "command", "outcome")
+        )
+        self.mongo_seconds = Counter(
+            "mongo_command_seconds_total", "Time spent in MongoDB commands by originating route", ("route", "command")
+        )
+
+    def record_request(self, method: str, route: str, status: int, seconds: float,
+                       request_bytes: int, response_bytes: int, commands: dict):
+        with self._lock:
+            self.latency.observe((method, route, str(status)), seconds)
+            self.request_size.observe((method, route), request_bytes)
+            self.response_size.observe((method, route, str(status)), response_bytes)
+            for (command, outcome), (count, command_seconds) in commands.items():
+                self.mongo_commands.inc((route, command, outcome), count)
+                self.mongo_seconds.inc((route, command), command_seconds)
+
+    def record_command(self, route: str, command: str, outcome: str, seconds: float):
+        with self._lock:
+            self.mongo_commands.inc((route, command, outcome))
+            self.mongo_seconds.inc((route, command), seconds)
+
+    def render(self, extra_gauges: dict = None) -> str:
+        with self._lock:
+            lines = [
+                "# HELP http_requests_in_flight Requests currently being served",
+                "# TYPE http_requests_in_flight gauge",
+                f"http_requests_in_flight {self.in_flight}",
+            ]
+            for metric in (self.latency, self.request_size, self.response_size, self.mongo_commands, self.mongo_seconds):
+                lines.extend(metric.render())
+        for name, (help_text, value) in (extra_gauges or {}).items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Attributes MongoDB command counts and time to the route that issued them"""
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self._lock = threading.Lock()
+
+    def _record(self, event, outcome: str):
+        seconds = event.duration_micros / 1e6
+        commands = request_commands.get()
+        if commands is None:
+            # Not issued from a request (startup, background tasks)
+            self.registry.record_command("background", event.command_name, outcome, seconds)
+            return
+        with self._lock:
+            totals = commands.setdefault((event.command_name, outcome), [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, "success")
+
+    def failed(self, event):
+        self._record(event, "failure")
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, sizes and in-flight requests per route template"""
+
+    def __init__(self, app, registry: MetricsRegistry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        request_bytes = 0
+        response_bytes = 0
+        status = 500
+        commands = {}
+        token = request_commands.set(commands)
+        scope_token = request_scope.set(scope)
+
+        async def counting_receive():
+            nonlocal request_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                request_bytes += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        self.registry.in_flight += 1
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            self.registry.in_flight -= 1
+            # The router stores the matched route in the scope; use its template
+            # so /api/workers/{worker_id} is one series, not one per worker
+            route_path = current_route()
+            request_commands.reset(token)
+            request_scope.reset(scope_token)
+            self.registry.record_request(
+                scope["method"], route_path, status, time.perf_counter() - started,
+                request_bytes, response_bytes, commands
+            )
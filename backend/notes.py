@@ -0,0 +1,143 @@
+# Notes, tasks and reminders
+#
+# Notes and tasks live in `notes`:
+#   {"id", "user_id", "type": "note" | "task", "title", "description", "category",
+#    "priority", "date", "completed", "due_date", "reminder", "remind_at", "reminded_at", "created_at"}
+# `remind_at` is only set on an open task with a pending reminder, so the
+# partial index on it holds just the reminders still to fire, however many
+# years of notes a supervisor keeps. Changing a task's due date or reminder
+# re-arms a reminder that has already fired.
+#
+# ReminderScheduler keeps the next reminders in a heap ordered by remind_at and
+# sleeps until the earliest one instead of polling the collection. It loads
+# at most REMINDER_HEAP_SIZE reminders due within REMINDER_HORIZON_MINUTES and
+# reloads when that window runs out or after invalidate(), which writes call
+# when a task's reminder changes; a burst of writes costs one reload.
+#   REMINDER_TIME               (default 09:00, UTC time of day for date-only due dates)
+#   REMINDER_HORIZON_MINUTES    (default 60)
+#   REMINDER_HEAP_SIZE          (default 1000)
+import asyncio
+import heapq
+import logging
+import os
+from datetime import datetime, time, timedelta
+
+logger = logging.getLogger(__name__)
+
+NOTE_TYPES = ("note", "task")
+NOTE_CATEGORIES = ("Work", "Personal", "Important", "Meeting", "Idea")
+NOTE_PRIORITIES = ("High", "Medium", "Low")
+REMINDER_TIME = time.fromisoformat(os.environ.get("REMINDER_TIME", "09:00"))
+REMINDER_HORIZON_MINUTES = int(os.environ.get("REMINDER_HORIZON_MINUTES", "60"))
+REMINDER_HEAP_SIZE = int(os.environ.get("REMINDER_HEAP_SIZE", "1000"))
+
+
+def due_at(due_date: str) -> datetime:
+    """When a due date falls due: the given time, or REMINDER_TIME on a date-only value; raises ValueError"""
+    if len(due_date) == 10:
+        return datetime.combine(datetime.strptime(due_date, "%Y-%m-%d").date(), REMINDER_TIME)
+    return datetime.fromisoformat(due_date).replace(tzinfo=None)
+
+
+def remind_at(note: dict):
+    """When the note's reminder should fire, or None when it has none pending"""
+    if note.get("type") != "task" or not note.get("reminder") or note.get("completed"):
+        return None
+    if not note.get("due_date") or note.get("reminded_at"):
+        return None
+    return due_at(note["due_date"])
+
+
+class ReminderScheduler:
+    """Fires task reminders from a heap of upcoming remind_at times"""
+
+    def __init__(self, horizon_minutes: int = REMINDER_HORIZON_MINUTES, heap_size: int = REMINDER_HEAP_SIZE):
+        self.horizon = timedelta(minutes=horizon_minutes)
+        self.heap_size = heap_size
+        self._heap = []  # (remind_at, note id)
+        self._loaded_until = None
+        self._dirty = True
+        self._wake = None
+        self._worker = None
+        self._on_fire = None
+        self.db = None
+        self.fired = 0
+        self.reloads = 0
+
+    # ---------- lifecycle ----------
+
+    async def start(self, db, on_fire=None):
+        """Start the scheduler on the running loop; on_fire(note) is awaited after each reminder is marked sent"""
+        self.db = db
+        self._on_fire = on_fire
+        self._wake = asyncio.Event()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def invalidate(self):
+        """Reload the heap before the next reminder; call after a write that changes a remind_at"""
+        self._dirty = True
+        if self._wake:
+            self._wake.set()
+
+    def stats(self) -> dict:
+        return {"pending": len(self._heap), "loaded_until": self._loaded_until, "fired": self.fired, "reloads": self.reloads}
+
+    # ---------- scheduling ----------
+
+    async def _reload(self, now: datetime):
+        horizon = now + self.horizon
+        pending = await self.db.notes.find(
+            {"remind_at": {"$lte": horizon}}, {"_id": 0, "id": 1, "remind_at": 1}
+        ).sort([("remind_at", 1)]).limit(self.heap_size).to_list(length=self.heap_size)
+        self._heap = [(note["remind_at"], note["id"]) for note in pending]
+        heapq.heapify(self._heap)
+        # A full heap covers reminders up to its last one; the rest load once those have fired
+        self._loaded_until = pending[-1]["remind_at"] if len(pending) == self.heap_size else horizon
+        self._dirty = False
+        self.reloads += 1
+
+    async def _fire(self, remind_at_value: datetime, note_id: str):
+        now = datetime.utcnow()
+        # Matching on remind_at skips entries made stale by an edit and reminders another process already sent
+        note = await self.db.notes.find_one_and_update(
+            {"id": note_id, "remind_at": remind_at_value},
+            {"$set": {"reminded_at": now}, "$unset": {"remind_at": ""}},
+            projection={"_id": 0}
+        )
+        if not note:
+            return
+        self.fired += 1
+        if self._on_fire:
+            await self._on_fire(note)
+
+    async def _run(self):
+        while True:
+            try:
+                now = datetime.utcnow()
+                if self._dirty or self._loaded_until is None or now >= self._loaded_until:
+                    await self._reload(now)
+                while self._heap and self._heap[0][0] <= now:
+                    await self._fire(*heapq.heappop(self._heap))
+                wake_at = min(self._heap[0][0], self._loaded_until) if self._heap else self._loaded_until
+                self._wake.clear()
+                if self._dirty:
+                    continue
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=max((wake_at - now).total_seconds(), 0.05))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Reminder scheduler failed; retrying")
+                self._dirty = True
+                await asyncio.sleep(5)
@@ -0,0 +1,88 @@
+# Keyset pagination and NDJSON streaming for list endpoints
+import base64
+
+from bson import json_util
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from responses import FastJSONResponse, dumps
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def encode_cursor(values: list) -> str:
+    """Encode the sort key values of the last returned document as an opaque token"""
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    """Decode a token produced by encode_cursor"""
+    try:
+        return json_util.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_query(query: dict, sort: list, values: list) -> dict:
+    """Restrict query to documents strictly after `values` in `sort` order"""
+    if len(values) != len(sort):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {f: v for (f, _), v in zip(sort[:i], values[:i])}
+        clause[field] = {"$gt" if direction == 1 else "$lt": values[i]}
+        clauses.append(clause)
+    return {"$and": [query, {"$or": clauses}]}
+
+
+def wants_ndjson(accept: str) -> bool:
+    return bool(accept) and NDJSON_MEDIA_TYPE in accept
+
+
+def stream_ndjson(cursor, transform=None) -> StreamingResponse:
+    """Stream documents straight from a Motor cursor, one JSON object per line"""
+    async def lines():
+        async for doc in cursor:
+            if transform:
+                doc = transform(doc)
+            yield dumps(doc) + b"\n"
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
+
+
+async def fetch_page(collection, query: dict, sort: list, limit: int, cursor: str = None, projection: dict = None):
+    """Return (documents, next_cursor) for one keyset page; next_cursor is None on the last page"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if cursor:
+        query = keyset_query(query, sort, decode_cursor(cursor))
+    # Fetch one extra document to know whether another page exists
+    docs = await collection.find(query, projection).sort(sort).limit(limit + 1).to_list(length=limit + 1)
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor([docs[-1].get(field) for field, _ in sort])
+    return docs, next_cursor
+
+
+async def list_response(collection, query: dict, sort: list, *, projection: dict = None, accept: str = None,
+                        limit: int = None, cursor: str = None, legacy_length: int = 1000, transform=None):
+    """Serve a list endpoint as an NDJSON stream, a keyset page or the legacy plain list.
+
+    - `Accept: application/x-ndjson` streams every matching document with constant memory
+    - `limit` and/or `cursor` return {"items": [...], "next_cursor": ...}
+    - otherwise the first `legacy_length` documents are returned as a list
+
+    Documents go straight to orjson, skipping FastAPI's jsonable_encoder.
+    """
+    if wants_ndjson(accept):
+        return stream_ndjson(collection.find(query, projection).sort(sort), transform)
+
+    if limit or cursor:
+        docs, next_cursor = await fetch_page(collection, query, sort, limit or DEFAULT_PAGE_SIZE, cursor, projection)
+        items = [transform(d) for d in docs] if transform else docs
+        return FastJSONResponse({"items": items, "next_cursor": next_cursor})
+
+    docs = await collection.find(query, projection).sort(sort).to_list(length=legacy_length)
+    return FastJSONResponse([transform(d) for d in docs] if transform else docs)
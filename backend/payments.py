@@ -0,0 +1,107 @@
+# Wage payments
+#
+# Payments live in `payments`:
+#   {"_id": ObjectId, "worker_id": "<worker id>", "user_id": "<user id>", "amount",
+#    "date": datetime, "description"}
+# worker_id and user_id hold the same string ids as workers, attendance and
+# every other tenant collection. Payments written by the legacy routes held
+# ObjectIds instead: the worker's and the user's Mongo _id. migrate_payments
+# rewrites those to the string ids; the API runs it once at startup and
+# records that in `migrations`.
+#
+# Usage:
+#   python payments.py migrate   # rewrite ObjectId worker_id / user_id to string ids
+import argparse
+import asyncio
+import os
+from pathlib import Path
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+MIGRATION_ID = "payments_string_ids"
+MIGRATE_BATCH_SIZE = 1000
+# Fields a payment update may not change
+PROTECTED_PAYMENT_FIELDS = ("_id", "user_id")
+
+
+def payment_response(payment: dict) -> dict:
+    """A payment document as the API returns it"""
+    return {**payment, "_id": str(payment["_id"])}
+
+
+def payment_changes(payment_data: dict) -> dict:
+    """$set document for a payment update, without fields that would move it to another tenant"""
+    changes = {k: v for k, v in payment_data.items() if k not in PROTECTED_PAYMENT_FIELDS}
+    if "worker_id" in changes:
+        changes["worker_id"] = str(changes["worker_id"])
+    return changes
+
+
+async def _string_ids(collection, object_ids: set) -> dict:
+    """{ObjectId: string id} for the documents of collection with those _ids"""
+    found = await collection.find(
+        {"_id": {"$in": list(object_ids)}}, {"_id": 1, "id": 1}
+    ).to_list(length=len(object_ids))
+    return {doc["_id"]: doc["id"] for doc in found if doc.get("id")}
+
+
+async def _migrate_batch(db, batch: list) -> int:
+    worker_ids = await _string_ids(db.workers, {p["worker_id"] for p in batch if isinstance(p.get("worker_id"), ObjectId)})
+    user_ids = await _string_ids(db.users, {p["user_id"] for p in batch if isinstance(p.get("user_id"), ObjectId)})
+    operations = []
+    for payment in batch:
+        changes = {}
+        for field, ids in (("worker_id", worker_ids), ("user_id", user_ids)):
+            value = payment.get(field)
+            if isinstance(value, ObjectId):
+                # A payment whose worker or user is gone keeps the hex form of the old reference
+                changes[field] = ids.get(value, str(value))
+        operations.append(UpdateOne({"_id": payment["_id"]}, {"$set": changes}))
+    if operations:
+        await db.payments.bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+async def migrate_payments(db, batch_size: int = MIGRATE_BATCH_SIZE) -> int:
+    """Rewrite ObjectId worker_id / user_id references to string ids; returns the number of payments changed"""
+    stale = {"$or": [{"worker_id": {"$type": "objectId"}}, {"user_id": {"$type": "objectId"}}]}
+    migrated, batch = 0, []
+    async for payment in db.payments.find(stale, {"_id": 1, "worker_id": 1, "user_id": 1}):
+        batch.append(payment)
+        if len(batch) == batch_size:
+            migrated += await _migrate_batch(db, batch)
+            batch = []
+    migrated += await _migrate_batch(db, batch)
+    return migrated
+
+
+async def ensure_payments_migrated(db) -> int:
+    """Run migrate_payments unless it has already completed against this database"""
+    if await db.migrations.find_one({"_id": MIGRATION_ID}):
+        return 0
+    migrated = await migrate_payments(db)
+    await db.migrations.update_one({"_id": MIGRATION_ID}, {"$set": {"done": True, "migrated": migrated}}, upsert=True)
+    return migrated
+
+
+async def _main() -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ.get('DB_NAME', 'worksite_manager')]
+    try:
+        migrated = await migrate_payments(db)
+        print(f"Migrated {migrated} payments")
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain wage payments for the Worksite Manager API")
+    parser.add_argument("command", choices=["migrate"])
+    parser.parse_args()
+    raise SystemExit(asyncio.run(_main()))
@@ -0,0 +1,67 @@
+# Vectorized payroll for many workers at once
+#
+# calculate_salary handles one worker per request. For a contractor with
+# thousands of workers, compute_payroll takes every attendance status, daily
+# rate and advance in a period as flat columns and does the counting and the
+# arithmetic in NumPy: statuses become (worker, status) cells counted by one
+# bincount, advances are summed by another, and earnings and net payable are
+# array expressions. Python only touches each record once, to encode it. The results match build_salary_record worker for worker.
+import numpy as np
+
+# Column order of the per-worker status counts
+PAYROLL_STATUSES = ("present", "half", "absent")
+DEFAULT_DAILY_RATE = 500
+
+
+def compute_payroll(workers: list, attendance: list, advances: list) -> dict:
+    """Salary columns for [(worker_id, daily_rate)] from [(worker_id, status)] and [(worker_id, amount)].
+
+    Returns NumPy arrays aligned with `workers`: present_days, half_days,
+    absent_days, total_days, daily_rate, daily_earnings, total_advances,
+    total_earnings and net_payable. Rows for unknown workers are ignored.
+    """
+    rows = {worker_id: row for row, (worker_id, _) in enumerate(workers)}
+    rates = np.fromiter(
+        (DEFAULT_DAILY_RATE if rate is None else rate for _, rate in workers), dtype=np.float64, count=len(workers)
+    )
+    count = len(workers)
+
+    # Status counts: each record becomes one (worker row, status column) cell, counted by one bincount.
+    # Unknown workers get row -1, so their cells are negative and dropped.
+    columns = len(PAYROLL_STATUSES) + 1  # last column collects holidays and any other status
+    status_columns = {status: column for column, status in enumerate(PAYROLL_STATUSES)}
+    other = columns - 1
+    cells = np.fromiter(
+        (rows.get(worker_id, -1) * columns + status_columns.get(status, other) for worker_id, status in attendance),
+        dtype=np.int64, count=len(attendance)
+    )
+    counts = np.bincount(cells[cells >= 0], minlength=count * columns).reshape(count, columns)
+
+    # Advance totals: one weighted bincount
+    advance_rows = np.fromiter((rows.get(worker_id, -1) for worker_id, _ in advances), dtype=np.int64, count=len(advances))
+    amounts = np.fromiter((amount for _, amount in advances), dtype=np.float64, count=len(advances))
+    known = advance_rows >= 0
+    total_advances = np.bincount(advance_rows[known], weights=amounts[known], minlength=count).astype(np.float64)
+
+    present, half, absent = counts[:, 0], counts[:, 1], counts[:, 2]
+    daily_earnings = present * rates + half * rates * 0.5
+    return {
+        "worker_id": [worker_id for worker_id, _ in workers],
+        "daily_rate": rates,
+        "present_days": present,
+        "half_days": half,
+        "absent_days": absent,
+        "total_days": counts.sum(axis=1),
+        "daily_earnings": daily_earnings,
+        "total_advances": total_advances,
+        "total_earnings": daily_earnings,  # overtime and adjustments are not tracked yet
+        "net_payable": daily_earnings - total_advances,
+    }
+
+
+def payroll_rows(columns: dict, date_from: str, date_to: str) -> list:
+    """Per-worker salary dicts with the SalaryRecord fields, from compute_payroll columns"""
+    names = ("worker_id", "total_days", "present_days", "half_days", "absent_days",
+             "daily_earnings", "total_advances", "total_earnings", "net_payable")
+    values = zip(*(columns["worker_id"], *(columns[name].tolist() for name in names[1:])))
+    return [{"date_from": date_from, "date_to": date_to, **dict(zip(names, row))} for row in values]
@@ -0,0 +1,847 @@
+# Storage repositories for workers, attendance and advances
+#
+# The worker, attendance, advance and salary endpoints go through a repository
+# instead of the Motor database directly, so a deployment can choose where that
+# data lives:
+#   STORAGE_ENGINE=mongo   (default) MongoDB through Motor
+#   STORAGE_ENGINE=sqlite  a local SQLite file, see sqlite_repository.py
+# On MongoDB, ATTENDANCE_LAYOUT picks daily documents or worker-month buckets
+# for attendance, see attendance_buckets.py. The site payroll, attendance
+# summary and attendance/export reports read through the repository as well.
+#
+# Users (login, register, profiles), sites, payments, cashbook entries, notes
+# and the status checks only exist in MongoDB. With STORAGE_ENGINE=sqlite
+# their endpoints answer 501 and MONGO_URL is not needed.
+import asyncio
+import os
+import uuid
+from datetime import date, datetime
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from attendance_buckets import (
+    ATTENDANCE_LAYOUT, ATTENDANCE_LAYOUTS, bucket_days, bucket_id, bucket_range, bucket_records, day_id, parse_day_id,
+    set_day_update
+)
+from pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NDJSON_MEDIA_TYPE, decode_cursor, encode_cursor, list_response, wants_ndjson
+)
+from responses import FastJSONResponse, dumps
+from rollups import apply_rollup_delta, monthly_rollups, rollup_delta, rollup_status_counts
+from batch import idempotency_id
+from sync import sync_key
+
+STORAGE_ENGINE = os.environ.get("STORAGE_ENGINE", "mongo").lower()
+DUPLICATE_KEY = 11000
+
+# Keyset orders, each ending in a unique field so pages never overlap
+WORKER_ORDER = [("created_at", 1), ("id", 1)]
+ATTENDANCE_ORDER = [("date", -1), ("id", -1)]
+ADVANCE_ORDER = [("date", -1), ("id", -1)]
+
+
+async def insert_once_ordered(collection, operations: list) -> dict:
+    """Run insert-only upserts in order, treating a duplicate key as already inserted; {position: error}.
+
+    With a unique key, two copies of a batch racing on the same document make
+    the later upsert fail with a duplicate key error: the document it would
+    have inserted exists, so the write counts as applied and the rest go on.
+    """
+    errors = {}
+    start = 0
+    while start < len(operations):
+        try:
+            await collection.bulk_write(operations[start:], ordered=True)
+            break
+        except BulkWriteError as exc:
+            failed = exc.details["writeErrors"][0]
+            position = start + failed["index"]
+            if failed.get("code") != DUPLICATE_KEY:
+                errors[position] = failed.get("errmsg", "Write failed")
+                for later in range(position + 1, len(operations)):
+                    errors[later] = "Not applied: an earlier operation failed"
+                break
+            start = position + 1
+    return errors
+
+
+class MongoRepository:
+    """Workers, attendance and advances stored in MongoDB"""
+
+    uses_mongo = True
+
+    def __init__(self, db):
+        self.db = db
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    # ---------- data versions (see etags.py) ----------
+
+    async def data_version(self, key: str) -> int:
+        doc = await self.db.data_versions.find_one({"_id": key})
+        return doc["version"] if doc else 0
+
+    async def bump_data_versions(self, keys: list):
+        await self.db.data_versions.bulk_write(
+            [UpdateOne({"_id": key}, {"$inc": {"version": 1}}, upsert=True) for key in keys], ordered=False
+        )
+
+    # ---------- change log (see sync.py) ----------
+
+    async def record_changes(self, user_id: str, changes: list):
+        """Append (collection, doc_id, deleted) entries to the tenant's change log"""
+        if not changes:
+            return
+        # Reserve a block of sequence numbers, then write the entries
+        counter = await self.db.data_versions.find_one_and_update(
+            {"_id": sync_key(user_id)}, {"$inc": {"version": len(changes)}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        first = counter["version"] - len(changes) + 1
+        now = datetime.utcnow()
+        await self.db.sync_log.insert_many([
+            {"user_id": user_id, "seq": first + i, "collection": collection, "doc_id": doc_id, "deleted": deleted, "at": now}
+            for i, (collection, doc_id, deleted) in enumerate(changes)
+        ], ordered=False)
+
+    async def record_write(self, keys: list, user_id: str, changes: list):
+        """Bump the data versions `keys` and log `changes`.
+
+        Logging needs the reserved sequence numbers before it can insert, so it
+        takes two round trips; the version bump runs alongside it.
+        """
+        await asyncio.gather(self.bump_data_versions(keys), self.record_changes(user_id, changes))
+
+    async def changes_since(self, user_id: str, since: int, limit: int) -> list:
+        return await self.db.sync_log.find(
+            {"user_id": user_id, "seq": {"$gt": since}}, {"_id": 0}
+        ).sort("seq", 1).limit(limit).to_list(length=limit)
+
+    # ---------- idempotency keys (see batch.py) ----------
+
+    async def idempotent_results(self, user_id: str, keys: list) -> dict:
+        """Stored results for the keys that were already applied"""
+        docs = await self.db.idempotency_keys.find(
+            {"_id": {"$in": [idempotency_id(user_id, key) for key in keys]}}
+        ).to_list(length=len(keys))
+        return {doc["key"]: doc["result"] for doc in docs}
+
+    async def store_idempotent_results(self, user_id: str, results: dict):
+        if not results:
+            return
+        now = datetime.utcnow()
+        try:
+            await self.db.idempotency_keys.insert_many([
+                {"_id": idempotency_id(user_id, key), "user_id": user_id, "key": key, "result": result, "created_at": now}
+                for key, result in results.items()
+            ], ordered=False)
+        except BulkWriteError as exc:
+            # A concurrent replay of the same batch stored them first
+            if any(error.get("code") != 11000 for error in exc.details.get("writeErrors", [])):
+                raise
+
+    # ---------- workers ----------
+
+    async def create_worker(self, worker: dict):
+        await self.db.workers.insert_one(worker)
+        # Remove MongoDB's _id before returning
+        worker.pop('_id', None)
+
+    async def get_worker(self, user_id: str, worker_id: str):
+        return await self.db.workers.find_one({"id": worker_id, "user_id": user_id}, {'_id': 0})
+
+    async def list_workers(self, user_id: str, site_id: str = None, *, accept=None, limit=None, cursor=None):
+        query = {"user_id": user_id}
+        if site_id:
+            query["site_id"] = site_id
+        return await list_response(
+            self.db.workers, query, WORKER_ORDER,
+            projection={'_id': 0}, accept=accept, limit=limit, cursor=cursor
+        )
+
+    async def update_worker(self, user_id: str, worker_id: str, fields: dict):
+        return await self.db.workers.find_one_and_update(
+            {"id": worker_id, "user_id": user_id},
+            {"$set": fields},
+            projection={'_id': 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def delete_worker(self, user_id: str, worker_id: str):
+        """Delete a worker; returns the deleted worker or None"""
+        return await self.db.workers.find_one_and_delete({"id": worker_id, "user_id": user_id}, {'_id': 0})
+
+    async def workers_by_ids(self, user_id: str, worker_ids: list) -> list:
+        return await self.db.workers.find(
+            {"id": {"$in": worker_ids}, "user_id": user_id}, {'_id': 0}
+        ).to_list(length=len(worker_ids))
+
+    async def worker_rates(self, user_id: str, site_id: str, worker_ids: list) -> dict:
+        """Daily rate of each of worker_ids that belongs to the user and site"""
+        owned = await self.db.workers.find(
+            {"id": {"$in": worker_ids}, "user_id": user_id, "site_id": site_id},
+            {"_id": 0, "id": 1, "daily_rate": 1}
+        ).to_list(length=len(worker_ids))
+        return {w["id"]: w.get("daily_rate", 500) for w in owned}
+
+    # ---------- attendance ----------
+
+    async def upsert_attendance(self, worker_id: str, date: str, status: str, marked_by: str, daily_rate: float) -> dict:
+        """Atomically create or update the single attendance record for (worker_id, date)"""
+        now = datetime.utcnow()
+        query = {"worker_id": worker_id, "date": date}
+        changes = {"status": status, "marked_at": now, "marked_by": marked_by}
+        on_insert = {"id": str(uuid.uuid4()), "created_at": now}
+        update = {"$set": changes, "$setOnInsert": on_insert}
+        # Return the previous record so the monthly rollup can be moved by a delta
+        try:
+            before = await self.db.attendance.find_one_and_update(
+                query, update, projection={'_id': 0}, upsert=True, return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            # A concurrent upsert inserted the record first - the retry matches it
+            before = await self.db.attendance.find_one_and_update(
+                query, update, projection={'_id': 0}, upsert=True, return_document=ReturnDocument.BEFORE
+            )
+
+        old_status = before["status"] if before else None
+        await apply_rollup_delta(self.db, worker_id, date, old_status, status, daily_rate)
+
+        if before:
+            return {**before, **changes}
+        return {**query, **changes, **on_insert}
+
+    async def mark_attendance_many(self, date: str, marks: list, marked_by: str):
+        """Upsert (worker_id, status, daily_rate) marks for one day.
+
+        Returns ({position: error} for failed marks, {worker_id: attendance id}).
+        """
+        # One unordered batch so one bad item does not block the rest
+        errors, attendance_ids = await self._write_marks(
+            [(worker_id, date, status, daily_rate) for worker_id, status, daily_rate in marks], marked_by
+        )
+        return errors, {worker_id: attendance_ids[position] for position, (worker_id, _, _) in enumerate(marks)}
+
+    async def apply_batch(self, marks: list, advances: list, marked_by: str):
+        """Apply attendance marks (worker_id, date, status, daily_rate) and new advances, each list in order.
+
+        This is not one write: each list goes out in its own ordered bulk_write
+        and the two run concurrently, so one can apply while the other fails.
+        Advances are only inserted if their id is new (the id index is unique).
+        Returns ({mark position: error}, {advance position: error}, [attendance id per mark]).
+        """
+        operations = [
+            UpdateOne({"id": advance["id"]}, {"$setOnInsert": {k: v for k, v in advance.items() if k != "id"}}, upsert=True)
+            for advance in advances
+        ]
+        (mark_errors, attendance_ids), advance_errors = await asyncio.gather(
+            self._write_marks_ordered(marks, marked_by), insert_once_ordered(self.db.advances, operations)
+        )
+        return mark_errors, advance_errors, attendance_ids
+
+    async def _write_marks_ordered(self, marks: list, marked_by: str):
+        """One ordered bulk_write of (worker_id, date, status, daily_rate) marks; ({position: error}, [id per mark])"""
+        return await self._write_marks(marks, marked_by, ordered=True)
+
+    async def _write_marks(self, marks: list, marked_by: str, ordered: bool = False):
+        """Write (worker_id, date, status, daily_rate) marks in one bulk_write and move the monthly rollups.
+
+        Each write only applies while its record still has the status read
+        beforehand, so the rollup delta taken from that status is exact. A mark
+        whose record another write changed in between fails with a duplicate
+        key error and is retried on its own with an atomic read-and-set.
+        Returns ({position: error}, [attendance id per mark]).
+        """
+        errors, attendance_ids = {}, []
+        if not marks:
+            return errors, attendance_ids
+        now = datetime.utcnow()
+        previous, ids = await self._marked_days([(worker_id, day) for worker_id, day, _, _ in marks])
+
+        operations, transitions = [], []  # transitions: [worker_id, date, old_status, new_status, daily_rate]
+        for worker_id, day, status, daily_rate in marks:
+            record_key = (worker_id, day)
+            changes = {"status": status, "marked_at": now, "marked_by": marked_by}
+            attendance_ids.append(ids.setdefault(record_key, self._new_attendance_id(worker_id, day)))
+            operations.append(self._guarded_mark(worker_id, day, previous.get(record_key), changes, ids[record_key]))
+            transitions.append([worker_id, day, previous.get(record_key), status, daily_rate])
+            previous[record_key] = status
+
+        contended = []
+        start = 0
+        while start < len(operations):
+            try:
+                await self._marks_collection().bulk_write(operations[start:], ordered=ordered)
+                break
+            except BulkWriteError as exc:
+                write_errors = exc.details.get("writeErrors", [])
+                if not ordered:
+                    for error in write_errors:
+                        if error.get("code") == DUPLICATE_KEY:
+                            contended.append(error["index"])
+                        else:
+                            errors[error["index"]] = error.get("errmsg", "Write failed")
+                    break
+                # Ordered writes stop at the first failure; everything after it was not attempted
+                failed = write_errors[0]
+                position = start + failed["index"]
+                if failed.get("code") != DUPLICATE_KEY:
+                    errors[position] = failed.get("errmsg", "Write failed")
+                    for later in range(position + 1, len(operations)):
+                        errors[later] = "Not applied: an earlier operation failed"
+                    break
+                contended.append(position)
+                await self._retry_mark(position, marks, transitions, ids, now, marked_by)
+                start = position + 1
+
+        if not ordered:
+            for position in sorted(contended):
+                await self._retry_mark(position, marks, transitions, ids, now, marked_by)
+        await self._apply_rollup_deltas([
+            tuple(transition) for position, transition in enumerate(transitions) if position not in errors
+        ])
+        return errors, attendance_ids
+
+    async def _retry_mark(self, position: int, marks: list, transitions: list, ids: dict, now: datetime, marked_by: str):
+        """Write one contended mark with an atomic read-and-set and take its rollup delta from what it replaced"""
+        worker_id, day, status, _ = marks[position]
+        changes = {"status": status, "marked_at": now, "marked_by": marked_by}
+        transitions[position][2] = await self._mark_now(worker_id, day, changes, ids[(worker_id, day)])
+
+    # Storage hooks for _write_marks; BucketedMongoRepository writes buckets instead
+
+    def _marks_collection(self):
+        return self.db.attendance
+
+    def _new_attendance_id(self, worker_id: str, day: str) -> str:
+        return str(uuid.uuid4())
+
+    async def _marked_days(self, pairs: list):
+        """({(worker_id, date): status}, {(worker_id, date): attendance id}) for the marked days among pairs"""
+        wanted = set(pairs)
+        existing = await self.db.attendance.find(
+            {"worker_id": {"$in": list({worker_id for worker_id, _ in pairs})}, "date": {"$in": list({day for _, day in pairs})}},
+            {"_id": 0, "id": 1, "worker_id": 1, "date": 1, "status": 1}
+        ).to_list(length=None)
+        existing = [a for a in existing if (a["worker_id"], a["date"]) in wanted]
+        return {(a["worker_id"], a["date"]): a["status"] for a in existing}, {(a["worker_id"], a["date"]): a["id"] for a in existing}
+
+    def _guarded_mark(self, worker_id: str, day: str, old_status, changes: dict, attendance_id: str) -> UpdateOne:
+        """Upsert that only matches while the record has old_status (None: not marked yet); otherwise the
+        insert it falls back to hits worker_date_unique"""
+        return UpdateOne(
+            {"worker_id": worker_id, "date": day, "status": old_status if old_status else {"$exists": False}},
+            {"$set": changes, "$setOnInsert": {"id": attendance_id, "created_at": changes["marked_at"]}},
+            upsert=True
+        )
+
+    async def _mark_now(self, worker_id: str, day: str, changes: dict, attendance_id: str):
+        """Atomically set one record; returns the status it replaced"""
+        query = {"worker_id": worker_id, "date": day}
+        update = {"$set": changes, "$setOnInsert": {"id": attendance_id, "created_at": changes["marked_at"]}}
+        options = dict(projection={"_id": 0, "status": 1}, upsert=True, return_document=ReturnDocument.BEFORE)
+        try:
+            before = await self.db.attendance.find_one_and_update(query, update, **options)
+        except DuplicateKeyError:
+            # A concurrent upsert inserted the record first - the retry matches it
+            before = await self.db.attendance.find_one_and_update(query, update, **options)
+        return before["status"] if before else None
+
+    async def _apply_rollup_deltas(self, transitions: list):
+        """Move monthly rollups for (worker_id, date, old_status, new_status, daily_rate) transitions"""
+        rollup_ops = []
+        for worker_id, day, old_status, new_status, daily_rate in transitions:
+            inc = rollup_delta(old_status, new_status, daily_rate)
+            if inc:
+                rollup_ops.append(UpdateOne({"worker_id": worker_id, "month": day[:7]}, {"$inc": inc}, upsert=True))
+        if rollup_ops:
+            await self.db.attendance_rollups.bulk_write(rollup_ops, ordered=False)
+
+    async def get_attendance(self, attendance_id: str):
+        return await self.db.attendance.find_one({"id": attendance_id}, {'_id': 0})
+
+    async def attendance_by_ids(self, attendance_ids: list) -> list:
+        return await self.db.attendance.find({"id": {"$in": attendance_ids}}, {'_id': 0}).to_list(length=len(attendance_ids))
+
+    async def update_attendance(self, attendance_id: str, status: str, marked_by: str, daily_rate: float):
+        """Set the status of a record; returns the updated record or None when it does not exist"""
+        changes = {"status": status, "marked_at": datetime.utcnow(), "marked_by": marked_by}
+        # Keep the previous status for the rollup delta
+        before = await self.db.attendance.find_one_and_update(
+            {"id": attendance_id},
+            {"$set": changes},
+            projection={'_id': 0},
+            return_document=ReturnDocument.BEFORE
+        )
+        if not before:
+            return None
+        await apply_rollup_delta(self.db, before["worker_id"], before["date"], before["status"], status, daily_rate)
+        return {**before, **changes}
+
+    async def list_attendance(self, worker_id: str, date_from=None, date_to=None, *, accept=None, limit=None, cursor=None):
+        query = {"worker_id": worker_id}
+        if date_from and date_to:
+            query["date"] = {"$gte": date_from, "$lte": date_to}
+        return await list_response(
+            self.db.attendance, query, ATTENDANCE_ORDER,
+            projection={'_id': 0}, accept=accept, limit=limit, cursor=cursor
+        )
+
+    async def attendance_status_counts(self, worker_id: str, date_from: str, date_to: str) -> dict:
+        """Per-status day counts; raises ValueError for malformed dates"""
+        # Monthly rollups for whole months, raw records only for partial months
+        return await rollup_status_counts(self.db, worker_id, date_from, date_to)
+
+    async def site_attendance_marks(self, user_id: str, site_id: str, date_from: str, date_to: str) -> list:
+        """[(worker_id, [(date, status), ...])] for a site's workers in WORKER_ORDER, from one aggregation"""
+        pipeline = [
+            {"$match": {"user_id": user_id, "site_id": site_id}},
+            {"$sort": dict(WORKER_ORDER)},
+            {"$lookup": {
+                "from": "attendance",
+                "let": {"worker_id": "$id"},
+                "pipeline": [
+                    {"$match": {"date": {"$gte": date_from, "$lte": date_to}, "$expr": {"$eq": ["$worker_id", "$$worker_id"]}}},
+                    {"$project": {"_id": 0, "date": 1, "status": 1}}
+                ],
+                "as": "marks"
+            }},
+            {"$project": {"_id": 0, "id": 1, "marks": 1}}
+        ]
+        rows = await self.db.workers.aggregate(pipeline).to_list(length=None)
+        return [(row["id"], [(m["date"], m["status"]) for m in row["marks"]]) for row in rows]
+
+    async def payroll_inputs(self, user_id: str, site_id: str, date_from: str, date_to: str):
+        """Columns for payroll.compute_payroll over the user's workers (optionally one site's) in a period:
+        ([(worker_id, daily_rate)], [(worker_id, status)], [(worker_id, amount)])"""
+        workers, attendance, advances = await self.period_inputs(user_id, site_id, date_from, date_to)
+        return (
+            [(worker_id, rate) for worker_id, _, rate in workers],
+            [(worker_id, status) for worker_id, _, status in attendance],
+            [(worker_id, amount) for worker_id, _, amount in advances]
+        )
+
+    async def period_inputs(self, user_id: str, site_id: str, date_from: str, date_to: str):
+        """The user's workers (optionally one site's) with their attendance and advances in a period:
+        ([(worker_id, site_id, daily_rate)], [(worker_id, date, status)], [(worker_id, date, amount)])"""
+        query = {"user_id": user_id}
+        if site_id:
+            query["site_id"] = site_id
+        workers = await self.db.workers.find(
+            query, {"_id": 0, "id": 1, "site_id": 1, "daily_rate": 1}
+        ).sort(WORKER_ORDER).to_list(length=None)
+        worker_ids = [w["id"] for w in workers]
+        attendance, advances = await asyncio.gather(
+            self._attendance_days(worker_ids, date_from, date_to),
+            self.db.advances.find(
+                {"worker_id": {"$in": worker_ids}, "date": {"$gte": date_from, "$lte": date_to}},
+                {"_id": 0, "worker_id": 1, "date": 1, "amount": 1}
+            ).to_list(length=None)
+        )
+        return (
+            [(w["id"], w.get("site_id"), w.get("daily_rate")) for w in workers],
+            attendance,
+            [(a["worker_id"], a["date"], a["amount"]) for a in advances]
+        )
+
+    async def _attendance_days(self, worker_ids: list, date_from: str, date_to: str) -> list:
+        """[(worker_id, date, status)] for every marked day of the workers within a period"""
+        records = await self.db.attendance.find(
+            {"worker_id": {"$in": worker_ids}, "date": {"$gte": date_from, "$lte": date_to}},
+            {"_id": 0, "worker_id": 1, "date": 1, "status": 1}
+        ).batch_size(10000).to_list(length=None)
+        return [(r["worker_id"], r["date"], r["status"]) for r in records]
+
+    async def site_workers(self, user_id: str, site_id: str = None) -> list:
+        """A tenant's workers, optionally of one site, in WORKER_ORDER: [{id, name, site_id, daily_rate}]"""
+        query = {"user_id": user_id}
+        if site_id:
+            query["site_id"] = site_id
+        return await self.db.workers.find(
+            query, {"_id": 0, "id": 1, "name": 1, "site_id": 1, "daily_rate": 1}
+        ).sort(WORKER_ORDER).to_list(length=None)
+
+    async def attendance_summary(self, user_id: str, site_id: str, month_from: str, month_to: str) -> list:
+        """Per worker-month {worker_id, month, counts, earned, name} for a tenant's workers, from rollups"""
+        workers = await self.site_workers(user_id, site_id)
+        names = {w["id"]: w.get("name") for w in workers}
+        rollups = await monthly_rollups(self.db, {w["id"]: w.get("daily_rate", 500) for w in workers}, month_from, month_to)
+        for rollup in rollups:
+            rollup["name"] = names.get(rollup["worker_id"])
+        return rollups
+
+    async def site_payroll_rows(self, user_id: str, site_id: str, date_from: str, date_to: str):
+        """(worker, {status: days}, total advances) for each of a site's workers, from one aggregation"""
+        pipeline = [
+            {"$match": {"user_id": user_id, "site_id": site_id}},
+            # Count attendance days per status for each worker
+            self.attendance_counts_lookup(date_from, date_to),
+            # Sum advances for each worker
+            {"$lookup": {
+                "from": "advances",
+                "let": {"worker_id": "$id"},
+                "pipeline": [
+                    {"$match": {"date": {"$gte": date_from, "$lte": date_to}, "$expr": {"$eq": ["$worker_id", "$$worker_id"]}}},
+                    {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
+                ],
+                "as": "advance_totals"
+            }},
+            {"$project": {"_id": 0, "id": 1, "name": 1, "daily_rate": 1, "status_counts": 1, "advance_totals": 1}}
+        ]
+        async for row in self.db.workers.aggregate(pipeline, batchSize=500):
+            status_counts = {c["_id"]: c["count"] for c in row.pop("status_counts")}
+            advance_totals = row.pop("advance_totals")
+            yield row, status_counts, advance_totals[0]["total"] if advance_totals else 0.0
+
+    def attendance_counts_lookup(self, date_from: str, date_to: str) -> dict:
+        """$lookup stage for a workers aggregation adding status_counts: [{"_id": status, "count": n}]"""
+        return {"$lookup": {
+            "from": "attendance",
+            "let": {"worker_id": "$id"},
+            "pipeline": [
+                {"$match": {"date": {"$gte": date_from, "$lte": date_to}, "$expr": {"$eq": ["$worker_id", "$$worker_id"]}}},
+                {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+            ],
+            "as": "status_counts"
+        }}
+
+    async def site_attendance_records(self, worker_ids: list, date_from: str, date_to: str):
+        """Attendance records of the workers within a period, ordered by worker_id then date"""
+        cursor = self.db.attendance.find(
+            {"worker_id": {"$in": worker_ids}, "date": {"$gte": date_from, "$lte": date_to}},
+            {'_id': 0}
+        ).sort([("worker_id", 1), ("date", 1)]).batch_size(1000)  # index order, no in-memory sort
+        async for record in cursor:
+            yield record
+
+    # ---------- advances ----------
+
+    async def create_advance(self, advance: dict):
+        await self.db.advances.insert_one(advance)
+        advance.pop('_id', None)
+
+    async def advances_by_ids(self, advance_ids: list) -> list:
+        return await self.db.advances.find({"id": {"$in": advance_ids}}, {'_id': 0}).to_list(length=len(advance_ids))
+
+    async def total_advances(self, worker_id: str, date_from: str, date_to: str) -> float:
+        advances = await self.db.advances.find({
+            "worker_id": worker_id,
+            "date": {"$gte": date_from, "$lte": date_to}
+        }).to_list(length=1000)
+        return sum(a["amount"] for a in advances)
+
+    async def list_advances(self, worker_id: str, date_from=None, date_to=None, *, accept=None, limit=None, cursor=None):
+        query = {"worker_id": worker_id}
+        if date_from and date_to:
+            query["date"] = {"$gte": date_from, "$lte": date_to}
+        return await list_response(
+            self.db.advances, query, ADVANCE_ORDER,
+            projection={'_id': 0}, accept=accept, limit=limit, cursor=cursor
+        )
+
+
+class BucketedMongoRepository(MongoRepository):
+    """MongoDB storage with attendance in worker-month buckets, see attendance_buckets.py.
+
+    With dual_write, attendance writes go to both layouts and reads stay on the
+    daily documents, so buckets can be backfilled while serving.
+    """
+
+    def __init__(self, db, dual_write: bool = False):
+        super().__init__(db)
+        self.dual_write = dual_write
+
+    async def _set_day(self, worker_id: str, day: str, status: str, marked_at: datetime, marked_by: str, *,
+                       must_exist: bool = False):
+        """Set one day of a bucket; returns the day's previous (status, created_at), or None when
+        must_exist and the day was never marked"""
+        index = int(day[8:10]) - 1
+        query = {"_id": bucket_id(worker_id, day[:7])}
+        if must_exist:
+            query[f"status.{index}"] = {"$ne": None}
+        update = set_day_update(worker_id, day, status, marked_at, marked_by)
+        options = dict(projection={"status": 1, "created_at": 1}, upsert=not must_exist, return_document=ReturnDocument.BEFORE)
+        try:
+            before = await self.db.attendance_months.find_one_and_update(query, update, **options)
+        except DuplicateKeyError:
+            # A concurrent upsert created the bucket first - the retry matches it
+            before = await self.db.attendance_months.find_one_and_update(query, update, **options)
+        if not before:
+            return None if must_exist else (None, None)
+        return before["status"][index], before["created_at"][index]
+
+    async def _mirror_days(self, days: list, marked_by: str):
+        """Dual layout: copy (worker_id, date, status) writes already made to daily documents"""
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne({"_id": bucket_id(worker_id, day[:7])}, set_day_update(worker_id, day, status, now, marked_by), upsert=True)
+            for worker_id, day, status in days
+        ]
+        if operations:
+            await self.db.attendance_months.bulk_write(operations, ordered=False)
+
+    async def _previous_statuses(self, pairs: list) -> dict:
+        """{(worker_id, date): status} for the marked days among (worker_id, date) pairs"""
+        buckets = await self.db.attendance_months.find(
+            {"_id": {"$in": list({bucket_id(worker_id, day[:7]) for worker_id, day in pairs})}},
+            {"worker_id": 1, "month": 1, "status": 1}
+        ).to_list(length=None)
+        return {(bucket["worker_id"], day): status for bucket in buckets for _, day, status in bucket_days(bucket)}
+
+    async def _buckets_by_day_ids(self, attendance_ids: list) -> list:
+        days = [parsed for parsed in map(parse_day_id, attendance_ids) if parsed]
+        if not days:
+            return []
+        wanted = {day_id(worker_id, day) for worker_id, day in days}
+        buckets = await self.db.attendance_months.find(
+            {"_id": {"$in": list({bucket_id(worker_id, day[:7]) for worker_id, day in days})}}
+        ).to_list(length=None)
+        return [record for bucket in buckets for record in bucket_records(bucket) if record["id"] in wanted]
+
+    # ---------- attendance ----------
+
+    async def upsert_attendance(self, worker_id: str, date: str, status: str, marked_by: str, daily_rate: float) -> dict:
+        if self.dual_write:
+            record = await super().upsert_attendance(worker_id, date, status, marked_by, daily_rate)
+            await self._mirror_days([(worker_id, date, status)], marked_by)
+            return record
+
+        now = datetime.utcnow()
+        old_status, created_at = await self._set_day(worker_id, date, status, now, marked_by)
+        await apply_rollup_delta(self.db, worker_id, date, old_status, status, daily_rate)
+        return {
+            "id": day_id(worker_id, date), "worker_id": worker_id, "date": date, "status": status,
+            "marked_at": now, "marked_by": marked_by, "created_at": created_at or now
+        }
+
+    async def mark_attendance_many(self, date: str, marks: list, marked_by: str):
+        errors, ids = await super().mark_attendance_many(date, marks, marked_by)
+        if self.dual_write:
+            await self._mirror_days(
+                [(worker_id, date, status) for position, (worker_id, status, _) in enumerate(marks) if position not in errors],
+                marked_by
+            )
+        return errors, ids
+
+    async def _write_marks_ordered(self, marks: list, marked_by: str):
+        errors, attendance_ids = await super()._write_marks_ordered(marks, marked_by)
+        if self.dual_write:
+            applied = min(errors) if errors else len(marks)
+            await self._mirror_days([(worker_id, day, status) for worker_id, day, status, _ in marks[:applied]], marked_by)
+        return errors, attendance_ids
+
+    # Storage hooks for _write_marks; with dual_write the daily documents are written and then mirrored
+
+    def _marks_collection(self):
+        if self.dual_write:
+            return super()._marks_collection()
+        return self.db.attendance_months
+
+    def _new_attendance_id(self, worker_id: str, day: str) -> str:
+        if self.dual_write:
+            return super()._new_attendance_id(worker_id, day)
+        return day_id(worker_id, day)
+
+    async def _marked_days(self, pairs: list):
+        if self.dual_write:
+            return await super()._marked_days(pairs)
+        return await self._previous_statuses(pairs), {}
+
+    def _guarded_mark(self, worker_id: str, day: str, old_status, changes: dict, attendance_id: str) -> UpdateOne:
+        if self.dual_write:
+            return super()._guarded_mark(worker_id, day, old_status, changes, attendance_id)
+        # $expr keeps the guard out of the document an upsert inserts; a failed guard on an
+        # existing bucket falls back to an insert that hits the _id index
+        current = {"$ifNull": [{"$arrayElemAt": [{"$ifNull": ["$status", []]}, int(day[8:10]) - 1]}, None]}
+        return UpdateOne(
+            {"_id": bucket_id(worker_id, day[:7]), "$expr": {"$eq": [current, old_status]}},
+            set_day_update(worker_id, day, changes["status"], changes["marked_at"], changes["marked_by"]),
+            upsert=True
+        )
+
+    async def _mark_now(self, worker_id: str, day: str, changes: dict, attendance_id: str):
+        if self.dual_write:
+            return await super()._mark_now(worker_id, day, changes, attendance_id)
+        old_status, _ = await self._set_day(worker_id, day, changes["status"], changes["marked_at"], changes["marked_by"])
+        return old_status
+
+    async def get_attendance(self, attendance_id: str):
+        if self.dual_write:
+            return await super().get_attendance(attendance_id)
+        records = await self._buckets_by_day_ids([attendance_id])
+        return records[0] if records else None
+
+    async def attendance_by_ids(self, attendance_ids: list) -> list:
+        if self.dual_write:
+            return await super().attendance_by_ids(attendance_ids)
+        return await self._buckets_by_day_ids(attendance_ids)
+
+    async def update_attendance(self, attendance_id: str, status: str, marked_by: str, daily_rate: float):
+        if self.dual_write:
+            record = await super().update_attendance(attendance_id, status, marked_by, daily_rate)
+            if record:
+                await self._mirror_days([(record["worker_id"], record["date"], status)], marked_by)
+            return record
+
+        parsed = parse_day_id(attendance_id)
+        if not parsed:
+            return None
+        worker_id, day = parsed
+        now = datetime.utcnow()
+        before = await self._set_day(worker_id, day, status, now, marked_by, must_exist=True)
+        if not before:
+            return None
+        old_status, created_at = before
+        await apply_rollup_delta(self.db, worker_id, day, old_status, status, daily_rate)
+        return {
+            "id": attendance_id, "worker_id": worker_id, "date": day, "status": status,
+            "marked_at": now, "marked_by": marked_by, "created_at": created_at
+        }
+
+    async def _worker_days(self, worker_id: str, date_from=None, date_to=None, before: str = None):
+        """A worker's marked days newest first, optionally within a period and before a date"""
+        month_to = min(filter(None, (date_to and date_to[:7], before and before[:7])), default=None)
+        cursor = self.db.attendance_months.find(
+            {"_id": bucket_range(worker_id, date_from and date_from[:7], month_to)}
+        ).sort("_id", -1)
+        async for bucket in cursor:
+            for record in reversed(bucket_records(bucket, date_from, date_to)):
+                if before is None or record["date"] < before:
+                    yield record
+
+    async def list_attendance(self, worker_id: str, date_from=None, date_to=None, *, accept=None, limit=None, cursor=None):
+        if self.dual_write:
+            return await super().list_attendance(worker_id, date_from, date_to, accept=accept, limit=limit, cursor=cursor)
+        if not (date_from and date_to):
+            date_from = date_to = None
+        # Same response shapes as list_response; within one worker the date alone orders the days
+        if wants_ndjson(accept):
+            async def lines():
+                async for record in self._worker_days(worker_id, date_from, date_to):
+                    yield dumps(record) + b"\n"
+            return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
+
+        before = None
+        if cursor:
+            after = decode_cursor(cursor)
+            if len(after) != len(ATTENDANCE_ORDER):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            before = after[0]
+        page_size = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)) if (limit or cursor) else 1000
+
+        records = []
+        async for record in self._worker_days(worker_id, date_from, date_to, before):
+            records.append(record)
+            if len(records) > page_size:
+                break
+        if not (limit or cursor):
+            return FastJSONResponse(records[:page_size])
+        next_cursor = None
+        if len(records) > page_size:
+            records = records[:page_size]
+            next_cursor = encode_cursor([records[-1][field] for field, _ in ATTENDANCE_ORDER])
+        return FastJSONResponse({"items": records, "next_cursor": next_cursor})
+
+    async def attendance_status_counts(self, worker_id: str, date_from: str, date_to: str) -> dict:
+        """Per-status day counts from one bucket per month; raises ValueError for malformed dates"""
+        if self.dual_write:
+            return await super().attendance_status_counts(worker_id, date_from, date_to)
+        date.fromisoformat(date_from)
+        date.fromisoformat(date_to)
+        status_counts = {}
+        async for bucket in self.db.attendance_months.find(
+            {"_id": bucket_range(worker_id, date_from[:7], date_to[:7])}, {"worker_id": 1, "month": 1, "status": 1}
+        ):
+            for _, _, status in bucket_days(bucket, date_from, date_to):
+                status_counts[status] = status_counts.get(status, 0) + 1
+        return status_counts
+
+    async def site_attendance_marks(self, user_id: str, site_id: str, date_from: str, date_to: str) -> list:
+        if self.dual_write:
+            return await super().site_attendance_marks(user_id, site_id, date_from, date_to)
+        pipeline = [
+            {"$match": {"user_id": user_id, "site_id": site_id}},
+            {"$sort": dict(WORKER_ORDER)},
+            self._bucket_lookup(date_from, date_to, "buckets", [{"$project": {"month": 1, "status": 1, "worker_id": 1}}]),
+            {"$project": {"_id": 0, "id": 1, "buckets": 1}}
+        ]
+        rows = await self.db.workers.aggregate(pipeline).to_list(length=None)
+        return [
+            (row["id"], [(day, status) for bucket in row["buckets"] for _, day, status in bucket_days(bucket, date_from, date_to)])
+            for row in rows
+        ]
+
+    @staticmethod
+    def _bucket_lookup(date_from: str, date_to: str, as_field: str, pipeline: list) -> dict:
+        """$lookup of each worker's buckets for the months of a period"""
+        return {"$lookup": {
+            "from": "attendance_months",
+            "let": {"worker_id": "$id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$gte": ["$_id", {"$concat": ["$$worker_id", ":" + date_from[:7]]}]},
+                    {"$lte": ["$_id", {"$concat": ["$$worker_id", ":" + date_to[:7]]}]},
+                ]}}},
+                *pipeline
+            ],
+            "as": as_field
+        }}
+
+    def attendance_counts_lookup(self, date_from: str, date_to: str) -> dict:
+        if self.dual_write:
+            return super().attendance_counts_lookup(date_from, date_to)
+        # Slice each bucket to the days inside the period, then count statuses
+        month_from, month_to = date_from[:7], date_to[:7]
+        first = {"$cond": [{"$eq": ["$month", month_from]}, int(date_from[8:10]) - 1, 0]}
+        last = {"$cond": [{"$eq": ["$month", month_to]}, int(date_to[8:10]), {"$size": "$status"}]}
+        return self._bucket_lookup(date_from, date_to, "status_counts", [
+            {"$project": {"_id": 0, "status": {"$slice": ["$status", first, {"$max": [{"$subtract": [last, first]}, 1]}]}}},
+            {"$unwind": "$status"},
+            {"$match": {"status": {"$ne": None}}},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ])
+
+    async def _attendance_days(self, worker_ids: list, date_from: str, date_to: str) -> list:
+        if self.dual_write:
+            return await super()._attendance_days(worker_ids, date_from, date_to)
+        buckets = await self.db.attendance_months.find(
+            {"worker_id": {"$in": worker_ids}, "month": {"$gte": date_from[:7], "$lte": date_to[:7]}},
+            {"worker_id": 1, "month": 1, "status": 1}
+        ).to_list(length=None)
+        return [
+            (bucket["worker_id"], day, status) for bucket in buckets for _, day, status in bucket_days(bucket, date_from, date_to)
+        ]
+
+    async def site_attendance_records(self, worker_ids: list, date_from: str, date_to: str):
+        if self.dual_write:
+            async for record in super().site_attendance_records(worker_ids, date_from, date_to):
+                yield record
+            return
+        cursor = self.db.attendance_months.find(
+            {"worker_id": {"$in": worker_ids}, "month": {"$gte": date_from[:7], "$lte": date_to[:7]}}
+        ).sort([("worker_id", 1), ("month", 1)]).batch_size(200)
+        async for bucket in cursor:
+            for record in bucket_records(bucket, date_from, date_to):
+                yield record
+
+
+def create_repository(db):
+    """Repository for the configured STORAGE_ENGINE and, on MongoDB, ATTENDANCE_LAYOUT"""
+    if STORAGE_ENGINE == "sqlite":
+        from sqlite_repository import SQLiteRepository
+        return SQLiteRepository()
+    if STORAGE_ENGINE != "mongo":
+        raise ValueError(f"Unknown STORAGE_ENGINE {STORAGE_ENGINE!r}; expected mongo or sqlite")
+    if ATTENDANCE_LAYOUT not in ATTENDANCE_LAYOUTS:
+        raise ValueError(f"Unknown ATTENDANCE_LAYOUT {ATTENDANCE_LAYOUT!r}; expected one of {', '.join(ATTENDANCE_LAYOUTS)}")
+    if ATTENDANCE_LAYOUT == "daily":
+        return MongoRepository(db)
+    return BucketedMongoRepository(db, dual_write=ATTENDANCE_LAYOUT == "dual")
@@ -0,0 +1,273 @@
+# Attendance rollups
+#
+# One document per worker per month in `attendance_rollups`:
+#   {"worker_id": ..., "month": "YYYY-MM", "counts": {"present": 20, "half": 2, ...}, "earned": 11000.0}
+# Attendance writes keep it current with $inc deltas, so salary and report
+# endpoints read O(months) rollups instead of O(days) raw attendance records.
+# `earned` uses the daily rate in effect when each day was marked. Rebuilds read
+# whichever attendance layout ATTENDANCE_LAYOUT selects (see attendance_buckets.py).
+#
+# A rollup is only trusted once it has seen every write of its month: months
+# from `live_since` on (the first month starting after the API first ran with
+# rollups, kept in `migrations`) and months a rebuild has written, which are
+# marked "complete". Any other whole month is counted from raw attendance, so
+# a deployment that has never been rebuilt still reads correct totals.
+#
+# Rebuilds replace each worker-month's rollup on its own and never delete one.
+# A live delta landing between a rebuild's read of raw attendance and its
+# replace is lost, so rebuild while attendance writes are paused and check
+# the result with --verify.
+#
+# Usage:
+#   python rollups.py rebuild            # recompute every rollup from raw attendance
+#   python rollups.py rebuild --verify   # only report rollups that disagree with raw data
+import argparse
+import asyncio
+import os
+from calendar import monthrange
+from datetime import date, timedelta
+from pathlib import Path
+
+from pymongo import ReplaceOne, ReturnDocument
+
+from attendance_buckets import ATTENDANCE_LAYOUT, status_counts_pipeline
+
+ROLLUP_STATE_ID = "attendance_rollups"
+REBUILD_CHUNK = 1000
+
+_live_since = {}  # database name -> first month maintained by live deltas alone
+
+
+def status_earning(status: str, daily_rate: float) -> float:
+    """Amount earned for one day with the given status"""
+    if status == "present":
+        return daily_rate
+    if status == "half":
+        return daily_rate * 0.5
+    return 0.0
+
+
+def rollup_delta(old_status, new_status, daily_rate: float) -> dict:
+    """$inc document moving one day from old_status to new_status (either may be None)"""
+    inc = {}
+    if old_status == new_status:
+        return inc
+    earned = 0.0
+    if old_status:
+        inc[f"counts.{old_status}"] = -1
+        earned -= status_earning(old_status, daily_rate)
+    if new_status:
+        inc[f"counts.{new_status}"] = 1
+        earned += status_earning(new_status, daily_rate)
+    if earned:
+        inc["earned"] = earned
+    return inc
+
+
+async def apply_rollup_delta(db, worker_id: str, day: str, old_status, new_status, daily_rate: float):
+    """Atomically move one attendance day between status counters in its month rollup"""
+    inc = rollup_delta(old_status, new_status, daily_rate)
+    if inc:
+        await db.attendance_rollups.update_one(
+            {"worker_id": worker_id, "month": day[:7]},
+            {"$inc": inc},
+            upsert=True
+        )
+
+
+def split_period(date_from: str, date_to: str):
+    """Split an inclusive YYYY-MM-DD period into whole months and partial (from, to) ranges"""
+    start = date.fromisoformat(date_from)
+    end = date.fromisoformat(date_to)
+    full_months, partial_ranges = [], []
+    current = start
+    while current <= end:
+        month_end = date(current.year, current.month, monthrange(current.year, current.month)[1])
+        segment_end = min(month_end, end)
+        if current.day == 1 and segment_end == month_end:
+            full_months.append(current.strftime("%Y-%m"))
+        else:
+            partial_ranges.append((current.isoformat(), segment_end.isoformat()))
+        current = month_end + timedelta(days=1)
+    return full_months, partial_ranges
+
+
+def _month_after(day: date) -> str:
+    return (date(day.year, day.month, monthrange(day.year, day.month)[1]) + timedelta(days=1)).strftime("%Y-%m")
+
+
+def _month_before(month: str) -> str:
+    return (date.fromisoformat(f"{month}-01") - timedelta(days=1)).strftime("%Y-%m")
+
+
+async def start_rollups(db) -> str:
+    """Record the first month live deltas cover from its first day (the month after the first start); returns it"""
+    state = await db.migrations.find_one_and_update(
+        {"_id": ROLLUP_STATE_ID},
+        {"$setOnInsert": {"live_since": _month_after(date.today())}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    _live_since[db.name] = state["live_since"]
+    return state["live_since"]
+
+
+def _trusted(db, month: str, rollup: dict = None) -> bool:
+    """Whether a month's rollup (None: no rollup stored) holds every day of it"""
+    live_since = _live_since.get(db.name)
+    if live_since and month >= live_since:
+        return True
+    return bool(rollup and rollup.get("complete"))
+
+
+async def rollup_status_counts(db, worker_id: str, date_from: str, date_to: str) -> dict:
+    """Per-status day counts for a period: rollups for whole months, raw records for the edges and for
+    months whose rollup cannot be trusted"""
+    full_months, partial_ranges = split_period(date_from, date_to)
+    status_counts = {}
+
+    if full_months:
+        trusted = set()
+        async for rollup in db.attendance_rollups.find(
+            {"worker_id": worker_id, "month": {"$in": full_months}}, {"_id": 0, "month": 1, "counts": 1, "complete": 1}
+        ):
+            if not _trusted(db, rollup["month"], rollup):
+                continue
+            trusted.add(rollup["month"])
+            for status, count in rollup.get("counts", {}).items():
+                status_counts[status] = status_counts.get(status, 0) + count
+        for month in full_months:
+            if month not in trusted and not _trusted(db, month):
+                partial_ranges.append((f"{month}-01", f"{month}-{monthrange(int(month[:4]), int(month[5:]))[1]:02d}"))
+
+    if partial_ranges:
+        query = {
+            "worker_id": worker_id,
+            "$or": [{"date": {"$gte": start, "$lte": end}} for start, end in partial_ranges]
+        }
+        async for record in db.attendance.find(query, {"_id": 0, "status": 1}):
+            status_counts[record["status"]] = status_counts.get(record["status"], 0) + 1
+
+    return status_counts
+
+
+async def monthly_rollups(db, rates: dict, month_from: str, month_to: str) -> list:
+    """[{worker_id, month, counts, earned}] per worker-month for the workers in {worker_id: daily_rate}, sorted
+    by worker and month; raw attendance stands in for rollups that cannot be trusted"""
+    rollups = {}
+    async for rollup in db.attendance_rollups.find(
+        {"worker_id": {"$in": list(rates)}, "month": {"$gte": month_from, "$lte": month_to}}, {"_id": 0}
+    ):
+        if _trusted(db, rollup["month"], rollup):
+            rollup.pop("complete", None)
+            rollups[(rollup["worker_id"], rollup["month"])] = rollup
+
+    live_since = _live_since.get(db.name)
+    raw_to = min(month_to, _month_before(live_since)) if live_since else month_to
+    if rates and month_from <= raw_to:
+        raw = await compute_rollups(db, list(rates), month_from, raw_to, rates)
+        for key, rollup in raw.items():
+            rollups.setdefault(key, rollup)
+    return [rollups[key] for key in sorted(rollups)]
+
+
+async def compute_rollups(db, worker_ids=None, month_from: str = None, month_to: str = None, rates: dict = None) -> dict:
+    """Recompute rollups from raw attendance, keyed by (worker_id, month), optionally for a range of months"""
+    match = {"worker_id": {"$in": worker_ids}} if worker_ids else {}
+    if rates is None:
+        worker_query = {"id": {"$in": worker_ids}} if worker_ids else {}
+        rates = {}
+        async for worker in db.workers.find(worker_query, {"_id": 0, "id": 1, "daily_rate": 1}):
+            rates[worker["id"]] = worker.get("daily_rate", 500)
+
+    if ATTENDANCE_LAYOUT == "bucketed":
+        if month_from and month_to:
+            match["month"] = {"$gte": month_from, "$lte": month_to}
+        source, pipeline = db.attendance_months, status_counts_pipeline(match)
+    else:
+        if month_from and month_to:
+            match["date"] = {"$gte": f"{month_from}-01", "$lte": f"{month_to}-31"}
+        source, pipeline = db.attendance, [
+            {"$match": match},
+            {"$group": {
+                "_id": {"worker_id": "$worker_id", "month": {"$substrCP": ["$date", 0, 7]}, "status": "$status"},
+                "count": {"$sum": 1}
+            }}
+        ]
+    rollups = {}
+    async for row in source.aggregate(pipeline):
+        key = (row["_id"]["worker_id"], row["_id"]["month"])
+        rollup = rollups.setdefault(key, {"worker_id": key[0], "month": key[1], "counts": {}, "earned": 0.0})
+        status = row["_id"]["status"]
+        rollup["counts"][status] = row["count"]
+        rollup["earned"] += row["count"] * status_earning(status, rates.get(key[0], 500))
+    return rollups
+
+
+async def rebuild_rollups(db, worker_ids=None) -> int:
+    """Replace each stored worker-month rollup with values recomputed from raw attendance and mark it complete.
+
+    Run it while attendance writes are paused: a delta applied between the
+    recompute and the replace of its worker-month is lost.
+    """
+    rollups = await compute_rollups(db, worker_ids)
+    scope = {"worker_id": {"$in": worker_ids}} if worker_ids else {}
+    async for stored in db.attendance_rollups.find(scope, {"_id": 0, "worker_id": 1, "month": 1}):
+        # Months whose attendance is all gone are zeroed rather than deleted
+        key = (stored["worker_id"], stored["month"])
+        rollups.setdefault(key, {"worker_id": key[0], "month": key[1], "counts": {}, "earned": 0.0})
+    operations = [
+        ReplaceOne({"worker_id": r["worker_id"], "month": r["month"]}, {**r, "complete": True}, upsert=True)
+        for r in rollups.values()
+    ]
+    for start in range(0, len(operations), REBUILD_CHUNK):
+        await db.attendance_rollups.bulk_write(operations[start:start + REBUILD_CHUNK], ordered=False)
+    return len(rollups)
+
+
+async def verify_rollups(db) -> list:
+    """Return (worker_id, month, stored, expected) for every rollup that disagrees with raw data"""
+    expected = await compute_rollups(db)
+    mismatches = []
+    seen = set()
+    async for stored in db.attendance_rollups.find({}, {"_id": 0}):
+        key = (stored["worker_id"], stored["month"])
+        seen.add(key)
+        stored_counts = {s: c for s, c in stored.get("counts", {}).items() if c}
+        wanted = expected.get(key, {"counts": {}})
+        if stored_counts != wanted["counts"]:
+            mismatches.append((key[0], key[1], stored_counts, wanted["counts"]))
+    for key, wanted in expected.items():
+        if key not in seen:
+            mismatches.append((key[0], key[1], {}, wanted["counts"]))
+    return mismatches
+
+
+async def _main(verify: bool) -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ.get('DB_NAME', 'worksite_manager')]
+    try:
+        if verify:
+            mismatches = await verify_rollups(db)
+            for worker_id, month, stored, wanted in mismatches:
+                print(f"{worker_id} {month}: stored={stored} expected={wanted}")
+            print(f"{len(mismatches)} mismatched rollups")
+            return 1 if mismatches else 0
+
+        count = await rebuild_rollups(db)
+        print(f"Rebuilt {count} rollups")
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain attendance rollups for the Worksite Manager API")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--verify", action="store_true", help="compare stored rollups with raw data without writing")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(_main(args.verify)))
@@ -1,35 +1,90 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from bson import ObjectId
+import asyncio
 import os
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional
 import uuid
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import jwt
 import hashlib
-from auth import get_current_user, get_current_user_optional, hash_password, verify_password, create_access_token
+from auth import get_current_user, get_current_user_optional, hash_password, verify_password, password_needs_rehash, create_access_token, invalidate_user, auth_cache_stats, load_user_profile
+from indexes import ensure_indexes
+from repository import STORAGE_ENGINE, create_repository, insert_once_ordered
+from pagination import list_response
+from payroll import compute_payroll, payroll_rows
+from financial_report import REPORT_GROUPINGS, build_financial_report
+from exports import export_response
+from responses import FastJSONResponse, model_response
+from attendance_matrix import matrix_response, month_range
+from rollups import start_rollups
+from notes import NOTE_CATEGORIES, NOTE_PRIORITIES, NOTE_TYPES, ReminderScheduler, due_at, remind_at
+from payments import ensure_payments_migrated, payment_changes, payment_response
+from cashbook import CASHBOOK_TYPES, entries_page, ledger_summary, normalize_time, record_entry
+from batch import BATCH_MAX_OPERATIONS, BATCH_OPERATION_TYPES, advance_id, payment_object_id
+from etags import conditional_response, version_key, write_keys
+from sync import SYNC_COLLECTIONS, SYNC_PAGE_SIZE, collapse, contiguous, decode_token, encode_token, next_token, sync_key, token_expired
+from database import PoolStats, create_client, warm_up, db_health
+from metrics import MetricsRegistry, MetricsMiddleware, CommandMetrics
+from slow_queries import SlowQueryRecorder, find_slow_queries
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# MongoDB connection; MONGO_URL may be left unset when STORAGE_ENGINE=sqlite
+mongo_url = os.environ['MONGO_URL'] if STORAGE_ENGINE != "sqlite" else os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+pool_stats = PoolStats()
+metrics_registry = MetricsRegistry()
+slow_query_recorder = SlowQueryRecorder()
+reminder_scheduler = ReminderScheduler()
+client = create_client(mongo_url, pool_stats, CommandMetrics(metrics_registry), slow_query_recorder)
 db = client[os.environ.get('DB_NAME', 'worksite_manager')]
+# Workers, attendance and advances live in the configured storage engine (STORAGE_ENGINE)
+repository = create_repository(db)
+
+
+def require_mongo():
+    """Reject endpoints whose data only exists in MongoDB when STORAGE_ENGINE=sqlite"""
+    if not repository.uses_mongo:
+        raise HTTPException(status_code=501, detail=f"Not available with STORAGE_ENGINE={STORAGE_ENGINE}")
+
 
 # JWT Configuration
 SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-change-in-production')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24 * 30  # 30 days
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the pool before the first request and provision indexes,
+    # including the unique (worker_id, date) index that keeps attendance upserts race-free
+    await repository.open()
+    if repository.uses_mongo:
+        await warm_up(client)
+        await ensure_indexes(db)
+        await start_rollups(db)
+        await ensure_payments_migrated(db)
+        await slow_query_recorder.start(db)
+        await reminder_scheduler.start(db, on_fire=reminder_fired)
+    yield
+    await reminder_scheduler.stop()
+    await slow_query_recorder.stop()
+    await repository.close()
+    client.close()
+
+
 # Create the main app without a prefix
-app = FastAPI(title="Worksite Manager API", version="1.0.0")
+# orjson renders every response; see responses.py
+app = FastAPI(title="Worksite Manager API", version="1.0.0", lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # Add CORS middleware
 app.add_middleware(
@@ -40,6 +95,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency, size and Mongo command metrics, served at /metrics
+app.add_middleware(MetricsMiddleware, registry=metrics_registry)
+
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
@@ -92,6 +150,15 @@ class AttendanceCreate(BaseModel):
 class AttendanceUpdate(BaseModel):
     status: str
 
+class RollCallEntry(BaseModel):
+    worker_id: str
+    status: str
+
+class AttendanceRollCall(BaseModel):
+    site_id: str
+    date: str  # YYYY-MM-DD format
+    entries: List[RollCallEntry]
+
 
 # ==================== SALARY MODELS ====================
 
@@ -128,6 +195,89 @@ class AdvanceCreate(BaseModel):
     date: str
 
 
+# ==================== BATCH MODELS ====================
+
+class BatchOperation(BaseModel):
+    key: str  # client-generated idempotency key
+    type: str  # mark_attendance, record_advance, record_payment
+    data: dict
+
+class BatchPayment(BaseModel):
+    worker_id: str
+    amount: float
+    description: str = ""
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
+
+
+# ==================== CASHBOOK MODELS ====================
+
+class CashbookEntry(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    type: str  # income or expense
+    amount: float
+    date: str  # YYYY-MM-DD
+    time: str  # HH:MM, 24h
+    description: str = ""
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class CashbookEntryCreate(BaseModel):
+    type: str
+    amount: float
+    date: str
+    time: str
+    description: str = ""
+
+class CashbookEntryUpdate(BaseModel):
+    type: Optional[str] = None
+    amount: Optional[float] = None
+    date: Optional[str] = None
+    time: Optional[str] = None
+    description: Optional[str] = None
+
+
+# ==================== NOTE MODELS ====================
+
+class Note(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    type: str = "note"  # note or task
+    title: str
+    description: str = ""
+    category: str = "Work"
+    priority: str = "Medium"
+    date: Optional[str] = None
+    # Task fields
+    completed: bool = False
+    due_date: Optional[str] = None  # YYYY-MM-DD or an ISO datetime
+    reminder: bool = False
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class NoteCreate(BaseModel):
+    type: str = "note"
+    title: str
+    description: str = ""
+    category: str = "Work"
+    priority: str = "Medium"
+    date: Optional[str] = None
+    completed: bool = False
+    due_date: Optional[str] = None
+    reminder: bool = False
+
+class NoteUpdate(BaseModel):
+    type: Optional[str] = None
+    title: Optional[str] = None
+    description: Optional[str] = None
+    category: Optional[str] = None
+    priority: Optional[str] = None
+    date: Optional[str] = None
+    completed: Optional[bool] = None
+    due_date: Optional[str] = None
+    reminder: Optional[bool] = None
+
+
 # ==================== WORKER MODELS ====================
 
 class Site(BaseModel):
@@ -153,7 +303,16 @@ class StatusCheckCreate(BaseModel):
 
 # ==================== AUTHENTICATION ENDPOINTS ====================
 
-@api_router.post("/auth/register", response_model=Token)
+async def upgrade_password_hash(user_doc: dict, password: str):
+    """Replace a legacy SHA256 hash with bcrypt after a successful login"""
+    if password_needs_rehash(user_doc["password_hash"]):
+        new_hash = await hash_password(password)
+        await db.users.update_one(
+            {"_id": user_doc["_id"], "password_hash": user_doc["password_hash"]},
+            {"$set": {"password_hash": new_hash}}
+        )
+
+@api_router.post("/auth/register", response_model=Token, dependencies=[Depends(require_mongo)])
 async def register(user_data: UserCreate):
     """Register a new user"""
     # Check if user already exists
@@ -169,7 +328,7 @@ async def register(user_data: UserCreate):
     )
 
     # Hash password
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await hash_password(user_data.password)
 
     user_dict = user.dict()
     user_dict["password_hash"] = hashed_password
@@ -181,14 +340,15 @@ async def register(user_data: UserCreate):
     # Create access token
     access_token = create_access_token({"user_id": user.id, "email": user.email})
 
-    return Token(
+    # Already a validated model - serialise it directly instead of dumping and re-validating it
+    return model_response(Token(
         access_token=access_token,
         token_type="bearer",
         user=user
-    )
+    ))
 
 
-@api_router.post("/auth/login", response_model=Token)
+@api_router.post("/auth/login", response_model=Token, dependencies=[Depends(require_mongo)])
 async def login(credentials: UserLogin):
     """Login existing user"""
     # Find user by email
@@ -197,8 +357,9 @@ async def login(credentials: UserLogin):
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
     # Verify password
-    if not verify_password(credentials.password, user_doc["password_hash"]):
+    if not await verify_password(credentials.password, user_doc["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid email or password")
+    await upgrade_password_hash(user_doc, credentials.password)
 
     # Create user object from database document
     user = User(**{k: v for k, v in user_doc.items() if k != "_id" and k != "password_hash"})
@@ -213,9 +374,22 @@ async def login(credentials: UserLogin):
     )
 
 
+# ==================== CHANGE TRACKING ====================
+
+async def record_write(user_id: str, collection: str, site_id: Optional[str], doc_ids: list, deleted: bool = False):
+    """Invalidate the ETags a write affects and log it for delta sync; call after the write"""
+    await repository.record_write(
+        write_keys(user_id, collection, site_id), user_id, [(collection, doc_id, deleted) for doc_id in doc_ids]
+    )
+
+
 # ==================== SITE ENDPOINTS ====================
 
-@api_router.post("/sites")
+# Keyset orders for paginated list endpoints - the last field makes each key unique
+SITE_ORDER = [("created_at", 1), ("id", 1)]
+PAYMENT_ORDER = [("_id", -1)]
+
+@api_router.post("/sites", dependencies=[Depends(require_mongo)])
 async def create_site(site: SiteCreate, current_user: dict = Depends(get_current_user_optional)):
     """Create a new site"""
     site_data = {
@@ -226,22 +400,34 @@ async def create_site(site: SiteCreate, current_user: dict = Depends(get_current
         "created_at": datetime.utcnow().isoformat()
     }
     await db.sites.insert_one(site_data)
+    await record_write(current_user["id"], "sites", None, [site_data["id"]])
     site_data.pop('_id', None)
     return site_data
 
 
-@api_router.get("/sites")
-async def get_sites(current_user: dict = Depends(get_current_user_optional)):
+@api_router.get("/sites", dependencies=[Depends(require_mongo)])
+async def get_sites(
+    request: Request,
+    limit: int = None,
+    cursor: str = None,
+    accept: str = Header(None),
+    current_user: dict = Depends(get_current_user_optional)
+):
     """Get all sites for current user"""
-    sites = await db.sites.find({"user_id": current_user["id"]}, {'_id': 0}).to_list(length=100)
-    return sites
+    return await conditional_response(
+        request, repository, version_key(current_user["id"], "sites"),
+        lambda: list_response(
+            db.sites, {"user_id": current_user["id"]}, SITE_ORDER,
+            projection={'_id': 0}, accept=accept, limit=limit, cursor=cursor, legacy_length=100
+        )
+    )
 
 
 # ==================== WORKER ENDPOINTS ====================
 
 # Add your routes to the router instead of directly to app
 # Authentication Endpoints
-@api_router.post("/auth/register")
+@api_router.post("/auth/register", dependencies=[Depends(require_mongo)])
 async def register(user_data: dict):
     """Register a new user"""
     # Check if user exists
@@ -253,7 +439,7 @@ async def register(user_data: dict):
     from auth import hash_password, create_access_token
     
     user_id = str(uuid.uuid4())
-    hashed_pw = hash_password(user_data.get("password"))
+    hashed_pw = await hash_password(user_data.get("password"))
     
     new_user = {
         "id": user_id,
@@ -280,7 +466,7 @@ async def register(user_data: dict):
         "user": new_user
     }
 
-@api_router.post("/auth/login")
+@api_router.post("/auth/login", dependencies=[Depends(require_mongo)])
 async def login(credentials: dict):
     """Login user"""
     from auth import verify_password, create_access_token
@@ -291,8 +477,9 @@ async def login(credentials: dict):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     # Verify password
-    if not verify_password(credentials.get("password"), user["password_hash"]):
+    if not await verify_password(credentials.get("password"), user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    await upgrade_password_hash(user, credentials.get("password"))
     
     # Create token
     token = create_access_token({"user_id": user["id"], "email": user["email"]})
@@ -311,6 +498,44 @@ async def login(credentials: dict):
 async def root():
     return {"message": "Attendance Management API", "status": "active"}
 
+@api_router.get("/health/db")
+async def get_db_health():
+    """Ping latency, connection pool usage and checkout wait times"""
+    if not repository.uses_mongo:
+        return {"status": "ok", "engine": STORAGE_ENGINE}
+    health = await db_health(client, pool_stats)
+    if health["status"] != "ok":
+        return JSONResponse(status_code=503, content=health)
+    return health
+
+@api_router.get("/health/auth-cache")
+async def get_auth_cache_stats():
+    """Hit/miss counters for the verified-token and user-profile caches"""
+    return auth_cache_stats()
+
+@api_router.get("/health/reminders")
+async def get_reminder_stats():
+    """Reminders waiting in the scheduler heap, how far ahead it is loaded, fired and reload counts"""
+    return reminder_scheduler.stats()
+
+async def require_admin(current_user: dict = Depends(get_current_user)):
+    """Allow only users whose stored role is admin"""
+    user = await load_user_profile(db, current_user["id"])
+    if not user or user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user
+
+@api_router.get("/admin/slow-queries", dependencies=[Depends(require_mongo)])
+async def get_slow_queries(
+    route: str = None,
+    collection: str = None,
+    min_ms: float = None,
+    limit: int = 50,
+    admin_user: dict = Depends(require_admin)
+):
+    """Recent slow MongoDB commands with their redacted filter shape and explain plan"""
+    return await find_slow_queries(db, route, collection, min_ms, max(1, min(limit, 500)))
+
 # Worker Endpoints
 @api_router.post("/workers")
 async def create_worker(worker: dict, current_user: dict = Depends(get_current_user_optional)):
@@ -327,24 +552,29 @@ async def create_worker(worker: dict, current_user: dict = Depends(get_current_u
         "status": "active",
         "created_at": datetime.utcnow().isoformat()
     }
-    await db.workers.insert_one(worker_data)
-    # Remove MongoDB's _id before returning
-    worker_data.pop('_id', None)
+    await repository.create_worker(worker_data)
+    await record_write(current_user["id"], "workers", worker_data["site_id"], [worker_id])
     return worker_data
 
 @api_router.get("/workers")
-async def get_workers(site_id: str = None, current_user: dict = Depends(get_current_user_optional)):
+async def get_workers(
+    request: Request,
+    site_id: str = None,
+    limit: int = None,
+    cursor: str = None,
+    accept: str = Header(None),
+    current_user: dict = Depends(get_current_user_optional)
+):
     """Get all workers or filter by site"""
-    query = {"user_id": current_user["id"]}
-    if site_id:
-        query["site_id"] = site_id
-    workers = await db.workers.find(query, {'_id': 0}).to_list(length=1000)
-    return workers
+    return await conditional_response(
+        request, repository, version_key(current_user["id"], "workers", site_id),
+        lambda: repository.list_workers(current_user["id"], site_id, accept=accept, limit=limit, cursor=cursor)
+    )
 
 @api_router.get("/workers/{worker_id}")
 async def get_worker(worker_id: str, current_user: dict = Depends(get_current_user_optional)):
     """Get worker by ID"""
-    worker = await db.workers.find_one({"id": worker_id, "user_id": current_user["id"]}, {'_id': 0})
+    worker = await repository.get_worker(current_user["id"], worker_id)
     if not worker:
         raise HTTPException(status_code=404, detail="Worker not found")
     return worker
@@ -365,25 +595,23 @@ async def update_worker(worker_id: str, worker_data: dict, current_user: dict =
     if not update_fields:
         raise HTTPException(status_code=400, detail="No fields to update")
     
-    result = await db.workers.update_one(
-        {"id": worker_id, "user_id": current_user["id"]},
-        {"$set": update_fields}
-    )
+    updated_worker = await repository.update_worker(current_user["id"], worker_id, update_fields)
     
-    if result.matched_count == 0:
+    if not updated_worker:
         raise HTTPException(status_code=404, detail="Worker not found")
     
-    updated_worker = await db.workers.find_one({"id": worker_id, "user_id": current_user["id"]}, {'_id': 0})
+    await record_write(current_user["id"], "workers", updated_worker.get("site_id"), [worker_id])
     return updated_worker
 
 @api_router.delete("/workers/{worker_id}")
 async def delete_worker(worker_id: str, current_user: dict = Depends(get_current_user_optional)):
     """Delete worker"""
-    result = await db.workers.delete_one({"id": worker_id, "user_id": current_user["id"]})
+    deleted = await repository.delete_worker(current_user["id"], worker_id)
     
-    if result.deleted_count == 0:
+    if not deleted:
         raise HTTPException(status_code=404, detail="Worker not found")
     
+    await record_write(current_user["id"], "workers", deleted.get("site_id"), [worker_id], deleted=True)
     return {"message": "Worker deleted successfully"}
 
 # ==================== ATTENDANCE ENDPOINTS ====================
@@ -392,62 +620,90 @@ async def delete_worker(worker_id: str, current_user: dict = Depends(get_current
 async def mark_attendance(attendance_data: AttendanceCreate, current_user: dict = Depends(get_current_user_optional)):
     """Mark or update attendance for a worker"""
     # Check if worker exists and belongs to user
-    worker = await db.workers.find_one({"id": attendance_data.worker_id, "user_id": current_user["id"]})
+    worker = await repository.get_worker(current_user["id"], attendance_data.worker_id)
     if not worker:
         raise HTTPException(status_code=404, detail="Worker not found")
 
-    # Check if attendance already exists for this date
-    existing = await db.attendance.find_one({
-        "worker_id": attendance_data.worker_id,
-        "date": attendance_data.date
-    })
-
-    if existing:
-        # Update existing attendance
-        await db.attendance.update_one(
-            {"_id": existing["_id"]},
-            {"$set": {
-                "status": attendance_data.status,
-                "marked_at": datetime.utcnow(),
-                "marked_by": current_user["id"]
-            }}
-        )
-        # Fetch updated record
-        updated = await db.attendance.find_one({"_id": existing["_id"]}, {'_id': 0})
-        return updated
-    else:
-        # Create new attendance record
-        attendance = Attendance(
-            worker_id=attendance_data.worker_id,
-            date=attendance_data.date,
-            status=attendance_data.status,
-            marked_by=current_user["id"]
+    # Create or update the record for this date in one round trip
+    try:
+        date.fromisoformat(attendance_data.date)
+        attendance = await repository.upsert_attendance(
+            attendance_data.worker_id,
+            attendance_data.date,
+            attendance_data.status,
+            current_user["id"],
+            worker.get("daily_rate", 500)
         )
-        attendance_dict = attendance.dict()
-        await db.attendance.insert_one(attendance_dict)
-        attendance_dict.pop('_id', None)
-        return attendance_dict
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be in YYYY-MM-DD format")
+    await record_write(current_user["id"], "attendance", worker.get("site_id"), [attendance["id"]])
+    return attendance
+
+
+@api_router.post("/attendance/roll-call")
+async def mark_roll_call(roll_call: AttendanceRollCall, current_user: dict = Depends(get_current_user_optional)):
+    """Mark attendance for many workers of a site in one request"""
+    worker_ids = list({entry.worker_id for entry in roll_call.entries})
+
+    # Check ownership of every worker with a single query
+    rates = await repository.worker_rates(current_user["id"], roll_call.site_id, worker_ids)
+
+    results = []
+    marks = []  # (worker_id, status, daily_rate) for each owned entry
+    positions = []  # index into results for each mark
+    for entry in roll_call.entries:
+        if entry.worker_id not in rates:
+            results.append({"worker_id": entry.worker_id, "status": entry.status, "ok": False, "error": "Worker not found"})
+            continue
+        positions.append(len(results))
+        marks.append((entry.worker_id, entry.status, rates[entry.worker_id]))
+        results.append({"worker_id": entry.worker_id, "status": entry.status, "ok": True})
+
+    # One batch write; a failed item does not block the rest
+    try:
+        date.fromisoformat(roll_call.date)
+        errors, attendance_ids = await repository.mark_attendance_many(roll_call.date, marks, current_user["id"])
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be in YYYY-MM-DD format")
+    for index, error in errors.items():
+        result = results[positions[index]]
+        result["ok"] = False
+        result["error"] = error
+
+    marked = sum(1 for r in results if r["ok"])
+    if marked:
+        marked_ids = [attendance_ids[r["worker_id"]] for r in results if r["ok"] and r["worker_id"] in attendance_ids]
+        await record_write(current_user["id"], "attendance", roll_call.site_id, marked_ids)
+    return {
+        "site_id": roll_call.site_id,
+        "date": roll_call.date,
+        "marked": marked,
+        "failed": len(results) - marked,
+        "results": results
+    }
 
 
 @api_router.get("/attendance/{worker_id}")
 async def get_worker_attendance(
+    request: Request,
     worker_id: str,
     date_from: str = None,
     date_to: str = None,
+    limit: int = None,
+    cursor: str = None,
+    accept: str = Header(None),
     current_user: dict = Depends(get_current_user_optional)
 ):
     """Get attendance records for a worker"""
     # Check if worker exists and belongs to user
-    worker = await db.workers.find_one({"id": worker_id, "user_id": current_user["id"]})
+    worker = await repository.get_worker(current_user["id"], worker_id)
     if not worker:
         raise HTTPException(status_code=404, detail="Worker not found")
 
-    query = {"worker_id": worker_id}
-    if date_from and date_to:
-        query["date"] = {"$gte": date_from, "$lte": date_to}
-
-    attendance_records = await db.attendance.find(query, {'_id': 0}).sort("date", -1).to_list(length=1000)
-    return attendance_records
+    return await conditional_response(
+        request, repository, version_key(current_user["id"], "attendance", worker.get("site_id")),
+        lambda: repository.list_attendance(worker_id, date_from, date_to, accept=accept, limit=limit, cursor=cursor)
+    )
 
 
 @api_router.put("/attendance/{attendance_id}")
@@ -458,73 +714,42 @@ async def update_attendance(
 ):
     """Update attendance status"""
     # Find attendance record
-    attendance = await db.attendance.find_one({"id": attendance_id})
+    attendance = await repository.get_attendance(attendance_id)
     if not attendance:
         raise HTTPException(status_code=404, detail="Attendance record not found")
 
     # Check if worker belongs to user
-    worker = await db.workers.find_one({"id": attendance["worker_id"], "user_id": current_user["id"]})
+    worker = await repository.get_worker(current_user["id"], attendance["worker_id"])
     if not worker:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    # Update attendance
-    await db.attendance.update_one(
-        {"id": attendance_id},
-        {"$set": {
-            "status": update_data.status,
-            "marked_at": datetime.utcnow(),
-            "marked_by": current_user["id"]
-        }}
+    updated = await repository.update_attendance(
+        attendance_id, update_data.status, current_user["id"], worker.get("daily_rate", 500)
     )
-
-    # Return updated record
-    updated = await db.attendance.find_one({"id": attendance_id}, {'_id': 0})
+    if not updated:
+        raise HTTPException(status_code=404, detail="Attendance record not found")
+    await record_write(current_user["id"], "attendance", worker.get("site_id"), [attendance_id])
     return updated
 
 
 # ==================== SALARY ENDPOINTS ====================
 
-@api_router.get("/salary/{worker_id}")
-async def calculate_salary(
-    worker_id: str,
-    date_from: str,
-    date_to: str,
-    current_user: dict = Depends(get_current_user_optional)
-):
-    """Calculate salary for a worker over a period"""
-    # Check if worker exists and belongs to user
-    worker = await db.workers.find_one({"id": worker_id, "user_id": current_user["id"]})
-    if not worker:
-        raise HTTPException(status_code=404, detail="Worker not found")
-
-    # Get attendance records for the period
-    attendance_records = await db.attendance.find({
-        "worker_id": worker_id,
-        "date": {"$gte": date_from, "$lte": date_to}
-    }).to_list(length=1000)
-
+def build_salary_record(worker_id: str, daily_rate: float, status_counts: dict, total_advances: float, date_from: str, date_to: str) -> SalaryRecord:
+    """Build a salary record from per-status day counts and the advance total"""
     # Calculate days
-    present_days = sum(1 for a in attendance_records if a["status"] == "present")
-    half_days = sum(1 for a in attendance_records if a["status"] == "half")
-    absent_days = sum(1 for a in attendance_records if a["status"] == "absent")
-    total_days = len(attendance_records)
+    present_days = status_counts.get("present", 0)
+    half_days = status_counts.get("half", 0)
+    absent_days = status_counts.get("absent", 0)
+    total_days = sum(status_counts.values())
 
     # Calculate earnings
-    daily_rate = worker.get("daily_rate", 500)
     daily_earnings = (present_days * daily_rate) + (half_days * daily_rate * 0.5)
 
-    # Get advances for the period
-    advances = await db.advances.find({
-        "worker_id": worker_id,
-        "date": {"$gte": date_from, "$lte": date_to}
-    }).to_list(length=1000)
-    total_advances = sum(a["amount"] for a in advances)
-
     # Calculate totals
     total_earnings = daily_earnings  # Add overtime and adjustments later if needed
     net_payable = total_earnings - total_advances
 
-    salary_record = SalaryRecord(
+    return SalaryRecord(
         worker_id=worker_id,
         date_from=date_from,
         date_to=date_to,
@@ -538,7 +763,175 @@ async def calculate_salary(
         net_payable=net_payable
     )
 
-    return salary_record.dict()
+
+@api_router.get("/salary/{worker_id}")
+async def calculate_salary(
+    worker_id: str,
+    date_from: str,
+    date_to: str,
+    current_user: dict = Depends(get_current_user_optional)
+):
+    """Calculate salary for a worker over a period"""
+    # Check if worker exists and belongs to user
+    worker = await repository.get_worker(current_user["id"], worker_id)
+    if not worker:
+        raise HTTPException(status_code=404, detail="Worker not found")
+
+    # Count attendance days per status
+    try:
+        status_counts = await repository.attendance_status_counts(worker_id, date_from, date_to)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be in YYYY-MM-DD format")
+
+    # Get advances for the period
+    total_advances = await repository.total_advances(worker_id, date_from, date_to)
+
+    salary_record = build_salary_record(
+        worker_id, worker.get("daily_rate", 500), status_counts, total_advances, date_from, date_to
+    )
+    return model_response(salary_record)
+
+
+@api_router.get("/payroll/run")
+async def run_site_payroll(
+    site_id: str,
+    date_from: str,
+    date_to: str,
+    current_user: dict = Depends(get_current_user_optional)
+):
+    """Calculate salaries for every worker of a site in one repository read"""
+    salaries = []
+    async for worker, status_counts, total_advances in repository.site_payroll_rows(current_user["id"], site_id, date_from, date_to):
+        salaries.append(build_salary_record(
+            worker["id"], worker.get("daily_rate", 500), status_counts, total_advances, date_from, date_to
+        ).dict())
+
+    return {
+        "site_id": site_id,
+        "date_from": date_from,
+        "date_to": date_to,
+        "total_workers": len(salaries),
+        "total_net_payable": sum(s["net_payable"] for s in salaries),
+        "salaries": salaries
+    }
+
+
+@api_router.get("/payroll/batch")
+async def run_batch_payroll(
+    date_from: str,
+    date_to: str,
+    site_id: str = None,
+    current_user: dict = Depends(get_current_user_optional)
+):
+    """Calculate salaries for every worker (optionally of one site) with the vectorized payroll engine"""
+    workers, attendance, advances = await repository.payroll_inputs(current_user["id"], site_id, date_from, date_to)
+    columns = compute_payroll(workers, attendance, advances)
+    return FastJSONResponse({
+        "site_id": site_id,
+        "date_from": date_from,
+        "date_to": date_to,
+        "total_workers": len(workers),
+        "total_net_payable": float(columns["net_payable"].sum()),
+        "salaries": payroll_rows(columns, date_from, date_to)
+    })
+
+
+@api_router.get("/reports/attendance/summary")
+async def get_attendance_summary(
+    month_from: str,
+    month_to: str,
+    site_id: str = None,
+    current_user: dict = Depends(get_current_user_optional)
+):
+    """Per-worker monthly attendance counts and earnings"""
+    return await repository.attendance_summary(current_user["id"], site_id, month_from, month_to)
+
+
+@api_router.get("/reports/attendance/matrix")
+async def get_attendance_matrix(
+    site_id: str,
+    month: str,
+    current_user: dict = Depends(get_current_user_optional)
+):
+    """A site's worker x day attendance grid for one month, one status code per day"""
+    try:
+        date_from, date_to, days = month_range(month)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Month must be in YYYY-MM format")
+    workers = await repository.site_attendance_marks(current_user["id"], site_id, date_from, date_to)
+    return FastJSONResponse(matrix_response(site_id, month, days, workers))
+
+
+@api_router.get("/reports/financial")
+async def get_financial_report(
+    date_from: str,
+    date_to: str,
+    group_by: str = "day",
+    site_id: str = None,
+    current_user: dict = Depends(get_current_user_optional)
+):
+    """Wages, advances and payments for a period grouped by day, week or month, overall and per site"""
+    if group_by not in REPORT_GROUPINGS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(REPORT_GROUPINGS)}")
+    try:
+        start, end = datetime.fromisoformat(date_from), datetime.fromisoformat(date_to)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be in YYYY-MM-DD format")
+    workers, attendance, advances = await repository.period_inputs(current_user["id"], site_id, date_from, date_to)
+
+    payment_query = {"user_id": current_user["id"], "date": {"$gte": start, "$lt": end + timedelta(days=1)}}
+    if site_id:
+        payment_query["worker_id"] = {"$in": [worker_id for worker_id, _, _ in workers]}
+    # Payments only exist in MongoDB; under SQLite the report has wages and advances only
+    payments = await db.payments.find(
+        payment_query, {"_id": 0, "worker_id": 1, "date": 1, "amount": 1}
+    ).to_list(length=None) if repository.uses_mongo else []
+
+    # pandas work is CPU-bound; keep it off the event loop
+    try:
+        report = await asyncio.to_thread(
+            build_financial_report, workers, attendance, advances,
+            [(p["worker_id"], p["date"], p.get("amount", 0)) for p in payments],
+            date_from, date_to, group_by
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return FastJSONResponse(report)
+
+
+ATTENDANCE_EXPORT_COLUMNS = ["worker_id", "name", "site_id", "date", "status", "marked_at", "marked_by"]
+PAYROLL_EXPORT_COLUMNS = ["_id", "worker_id", "amount", "date", "description"]
+
+
+@api_router.get("/reports/attendance/export")
+async def export_attendance_report(
+    format: str = "csv",
+    site_id: str = None,
+    start_date: str = None,
+    end_date: str = None,
+    current_user: dict = Depends(get_current_user_optional)
+):
+    """Stream the attendance report as CSV or XLSX"""
+    if format not in ("csv", "xlsx"):
+        raise HTTPException(status_code=400, detail="Format must be csv or xlsx")
+    date_from, date_to = report_period(start_date, end_date)
+    rows = attendance_report_rows(current_user["id"], site_id, date_from, date_to)
+    return export_response(format, ATTENDANCE_EXPORT_COLUMNS, rows, "attendance-report")
+
+
+@api_router.get("/reports/payroll/export", dependencies=[Depends(require_mongo)])
+async def export_payroll_report(
+    format: str = "csv",
+    start_date: str = None,
+    end_date: str = None,
+    current_user: dict = Depends(get_current_user_optional)
+):
+    """Stream the payroll report's payments as CSV or XLSX"""
+    if format not in ("csv", "xlsx"):
+        raise HTTPException(status_code=400, detail="Format must be csv or xlsx")
+    query = payroll_report_query(current_user["id"], start_date, end_date)
+    cursor = db.payments.find(query).sort("date", 1).batch_size(1000)
+    return export_response(format, PAYROLL_EXPORT_COLUMNS, cursor, "payroll-report")
 
 
 # ==================== ADVANCE ENDPOINTS ====================
@@ -547,7 +940,7 @@ async def calculate_salary(
 async def record_advance(advance_data: AdvanceCreate, current_user: dict = Depends(get_current_user_optional)):
     """Record an advance payment"""
     # Check if worker exists and belongs to user
-    worker = await db.workers.find_one({"id": advance_data.worker_id, "user_id": current_user["id"]})
+    worker = await repository.get_worker(current_user["id"], advance_data.worker_id)
     if not worker:
         raise HTTPException(status_code=404, detail="Worker not found")
 
@@ -558,41 +951,436 @@ async def record_advance(advance_data: AdvanceCreate, current_user: dict = Depen
     )
 
     advance_dict = advance.dict()
-    await db.advances.insert_one(advance_dict)
-    advance_dict.pop('_id', None)
+    await repository.create_advance(advance_dict)
+    await record_write(current_user["id"], "advances", worker.get("site_id"), [advance_dict["id"]])
     return advance_dict
 
 
 @api_router.get("/advances/{worker_id}")
 async def get_worker_advances(
+    request: Request,
     worker_id: str,
     date_from: str = None,
     date_to: str = None,
+    limit: int = None,
+    cursor: str = None,
+    accept: str = Header(None),
     current_user: dict = Depends(get_current_user_optional)
 ):
     """Get advance payments for a worker"""
     # Check if worker exists and belongs to user
-    worker = await db.workers.find_one({"id": worker_id, "user_id": current_user["id"]})
+    worker = await repository.get_worker(current_user["id"], worker_id)
     if not worker:
         raise HTTPException(status_code=404, detail="Worker not found")
 
-    query = {"worker_id": worker_id}
-    if date_from and date_to:
-        query["date"] = {"$gte": date_from, "$lte": date_to}
+    return await conditional_response(
+        request, repository, version_key(current_user["id"], "advances", worker.get("site_id")),
+        lambda: repository.list_advances(worker_id, date_from, date_to, accept=accept, limit=limit, cursor=cursor)
+    )
+
+
+# ==================== CASHBOOK ENDPOINTS ====================
+
+def validate_cashbook_entry(entry: dict) -> dict:
+    """Check type, amount and date and normalise time to HH:MM; raises HTTPException 400"""
+    if entry["type"] not in CASHBOOK_TYPES:
+        raise HTTPException(status_code=400, detail=f"type must be one of {', '.join(CASHBOOK_TYPES)}")
+    if entry["amount"] <= 0:
+        raise HTTPException(status_code=400, detail="amount must be positive")
+    try:
+        date.fromisoformat(entry["date"])
+        entry["time"] = normalize_time(entry["time"])
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return entry
+
+
+@api_router.post("/cashbook", dependencies=[Depends(require_mongo)])
+async def create_cashbook_entry(entry_data: CashbookEntryCreate, current_user: dict = Depends(get_current_user_optional)):
+    """Record an income or expense and move the balance checkpoints from its day on"""
+    entry = validate_cashbook_entry(CashbookEntry(user_id=current_user["id"], **entry_data.dict()).dict())
+    await db.cashbook_entries.insert_one(entry)
+    await record_entry(db, entry)
+    await record_write(current_user["id"], "cashbook", None, [entry["id"]])
+    entry.pop('_id', None)
+    return entry
+
+
+@api_router.get("/cashbook", dependencies=[Depends(require_mongo)])
+async def get_cashbook_entries(
+    request: Request,
+    date_from: str = None,
+    date_to: str = None,
+    limit: int = None,
+    cursor: str = None,
+    current_user: dict = Depends(get_current_user_optional)
+):
+    """Cashbook entries newest first, one keyset page at a time, each with the running balance after it"""
+    async def build():
+        return FastJSONResponse(await entries_page(db, current_user["id"], date_from, date_to, limit, cursor))
+
+    return await conditional_response(request, repository, version_key(current_user["id"], "cashbook"), build)
+
 
-    advances = await db.advances.find(query, {'_id': 0}).sort("date", -1).to_list(length=1000)
-    return advances
+@api_router.get("/cashbook/summary", dependencies=[Depends(require_mongo)])
+async def get_cashbook_summary(date_from: str, date_to: str, current_user: dict = Depends(get_current_user_optional)):
+    """Opening balance, income, expense and closing balance for a period"""
+    return await ledger_summary(db, current_user["id"], date_from, date_to)
+
+
+@api_router.put("/cashbook/{entry_id}", dependencies=[Depends(require_mongo)])
+async def update_cashbook_entry(entry_id: str, entry_data: CashbookEntryUpdate, current_user: dict = Depends(get_current_user_optional)):
+    """Update an entry; its old amount comes out of the checkpoints and the new one goes in"""
+    changes = {k: v for k, v in entry_data.dict().items() if v is not None}
+    if not changes:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    query = {"id": entry_id, "user_id": current_user["id"]}
+    old = await db.cashbook_entries.find_one(query, {'_id': 0})
+    if not old:
+        raise HTTPException(status_code=404, detail="Entry not found")
+    entry = validate_cashbook_entry({**old, **changes})
+
+    await db.cashbook_entries.update_one(query, {"$set": {k: entry[k] for k in changes}})
+    if any(entry[k] != old[k] for k in ("type", "amount", "date")):
+        await record_entry(db, old, sign=-1)
+        await record_entry(db, entry)
+    await record_write(current_user["id"], "cashbook", None, [entry_id])
+    return entry
+
+
+@api_router.delete("/cashbook/{entry_id}", dependencies=[Depends(require_mongo)])
+async def delete_cashbook_entry(entry_id: str, current_user: dict = Depends(get_current_user_optional)):
+    """Delete an entry and take it back out of the checkpoints"""
+    entry = await db.cashbook_entries.find_one_and_delete({"id": entry_id, "user_id": current_user["id"]}, {'_id': 0})
+    if not entry:
+        raise HTTPException(status_code=404, detail="Entry not found")
+    await record_entry(db, entry, sign=-1)
+    await record_write(current_user["id"], "cashbook", None, [entry_id], deleted=True)
+    return {"deleted": True}
+
+
+# ==================== NOTE ENDPOINTS ====================
+
+NOTE_ORDER = [("created_at", -1), ("id", -1)]
+DUE_ORDER = [("due_date", 1), ("id", 1)]
+
+def validate_note(note: dict) -> dict:
+    """Check type, category, priority and due date; raises HTTPException 400"""
+    for field, allowed in (("type", NOTE_TYPES), ("category", NOTE_CATEGORIES), ("priority", NOTE_PRIORITIES)):
+        if note[field] not in allowed:
+            raise HTTPException(status_code=400, detail=f"{field} must be one of {', '.join(allowed)}")
+    if note.get("due_date"):
+        try:
+            due_at(note["due_date"])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="due_date must be YYYY-MM-DD or an ISO datetime")
+    return note
+
+
+async def reminder_fired(note: dict):
+    """Called by the reminder scheduler once a reminder is marked sent; clients see reminded_at on sync"""
+    logger.info("Reminder due for task %s", note["id"])
+    await record_write(note["user_id"], "notes", None, [note["id"]])
+
+
+@api_router.post("/notes", dependencies=[Depends(require_mongo)])
+async def create_note(note_data: NoteCreate, current_user: dict = Depends(get_current_user_optional)):
+    """Create a note or task"""
+    note = validate_note(Note(user_id=current_user["id"], **note_data.dict()).dict())
+    note["remind_at"] = remind_at(note)
+    if note["remind_at"] is None:
+        del note["remind_at"]  # only pending reminders are kept in the remind_at index
+    await db.notes.insert_one(note)
+    await record_write(current_user["id"], "notes", None, [note["id"]])
+    if "remind_at" in note:
+        reminder_scheduler.invalidate()
+    note.pop('_id', None)
+    return note
+
+
+@api_router.get("/notes", dependencies=[Depends(require_mongo)])
+async def get_notes(
+    request: Request,
+    type: str = None,
+    category: str = None,
+    completed: bool = None,
+    limit: int = None,
+    cursor: str = None,
+    accept: str = Header(None),
+    current_user: dict = Depends(get_current_user_optional)
+):
+    """Notes and tasks newest first, optionally filtered by type, category and completion"""
+    query = {"user_id": current_user["id"]}
+    for field, value in (("type", type), ("category", category), ("completed", completed)):
+        if value is not None:
+            query[field] = value
+    return await conditional_response(
+        request, repository, version_key(current_user["id"], "notes"),
+        lambda: list_response(
+            db.notes, query, NOTE_ORDER,
+            projection={'_id': 0}, accept=accept, limit=limit, cursor=cursor
+        )
+    )
+
+
+@api_router.get("/notes/due", dependencies=[Depends(require_mongo)])
+async def get_due_tasks(
+    request: Request,
+    days: int = 7,
+    limit: int = None,
+    cursor: str = None,
+    current_user: dict = Depends(get_current_user_optional)
+):
+    """Open tasks due within `days` days, overdue ones included, soonest first"""
+    # "~" sorts after any time suffix, so datetime due dates on the last day are included
+    until = (datetime.utcnow().date() + timedelta(days=days)).isoformat() + "~"
+    query = {"user_id": current_user["id"], "due_date": {"$lte": until}, "completed": False}
+    # The cutoff moves with the clock, not with the notes version, so it is part of the ETag
+    return await conditional_response(
+        request, repository, version_key(current_user["id"], "notes"),
+        lambda: list_response(db.notes, query, DUE_ORDER, projection={'_id': 0}, limit=limit, cursor=cursor),
+        extra=f"days={days}|until={until}"
+    )
+
+
+@api_router.put("/notes/{note_id}", dependencies=[Depends(require_mongo)])
+async def update_note(note_id: str, note_data: NoteUpdate, current_user: dict = Depends(get_current_user_optional)):
+    """Update a note or task; changing a task's due date or reminder re-arms its reminder"""
+    query = {"id": note_id, "user_id": current_user["id"]}
+    old = await db.notes.find_one(query, {'_id': 0})
+    if not old:
+        raise HTTPException(status_code=404, detail="Note not found")
+    changes = {k: v for k, v in note_data.dict().items() if v is not None}
+    note = validate_note({**old, **changes})
+
+    if any(note.get(k) != old.get(k) for k in ("type", "due_date", "reminder")):
+        note["reminded_at"] = None
+    pending = remind_at(note)
+    update = {"$set": {**changes, "reminded_at": note.get("reminded_at")}}
+    if pending:
+        update["$set"]["remind_at"] = note["remind_at"] = pending
+    else:
+        update["$unset"] = {"remind_at": ""}
+        note.pop("remind_at", None)
+    await db.notes.update_one(query, update)
+    await record_write(current_user["id"], "notes", None, [note_id])
+    if pending != old.get("remind_at"):
+        reminder_scheduler.invalidate()
+    return note
+
+
+@api_router.delete("/notes/{note_id}", dependencies=[Depends(require_mongo)])
+async def delete_note(note_id: str, current_user: dict = Depends(get_current_user_optional)):
+    """Delete a note or task"""
+    note = await db.notes.find_one_and_delete({"id": note_id, "user_id": current_user["id"]}, {'_id': 0})
+    if not note:
+        raise HTTPException(status_code=404, detail="Note not found")
+    await record_write(current_user["id"], "notes", None, [note_id], deleted=True)
+    if note.get("remind_at"):
+        reminder_scheduler.invalidate()
+    return {"deleted": True}
+
+
+# ==================== BATCH ENDPOINT ====================
+
+def parse_batch_operation(op: BatchOperation):
+    """Validated payload for one queued operation; raises ValueError with the reason"""
+    if op.type not in BATCH_OPERATION_TYPES:
+        raise ValueError(f"Unknown operation type: {op.type}")
+    if op.type == "mark_attendance":
+        mark = AttendanceCreate(**op.data)
+        date.fromisoformat(mark.date)
+        return mark
+    if op.type == "record_advance":
+        return AdvanceCreate(**op.data)
+    if not repository.uses_mongo:
+        raise ValueError(f"Payments are not available with STORAGE_ENGINE={STORAGE_ENGINE}")
+    return BatchPayment(**op.data)
+
+
+async def write_batch_payments(payments: list) -> dict:
+    """Insert payments with deterministic _ids in one ordered bulk_write; {position: error}"""
+    operations = [UpdateOne({"_id": p["_id"]}, {"$setOnInsert": p}, upsert=True) for p in payments]
+    return await insert_once_ordered(db.payments, operations)
+
+
+@api_router.post("/batch")
+async def apply_batch(batch: BatchRequest, current_user: dict = Depends(get_current_user_optional)):
+    """Apply queued offline mutations; operations whose key was already applied are replayed from stored results"""
+    user_id = current_user["id"]
+    if len(batch.operations) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_OPERATIONS} operations per batch")
+
+    stored = await repository.idempotent_results(user_id, list({op.key for op in batch.operations}))
+
+    results = [None] * len(batch.operations)
+    pending = {}  # key -> (position, parsed payload) of its first occurrence
+    for position, op in enumerate(batch.operations):
+        if op.key in stored:
+            results[position] = {**stored[op.key], "replayed": True}
+        elif op.key in pending:
+            continue  # same key queued twice; answered from its first occurrence below
+        else:
+            try:
+                pending[op.key] = (position, parse_batch_operation(op))
+            except (ValueError, TypeError) as exc:
+                results[position] = {"key": op.key, "type": op.type, "ok": False, "error": str(exc)}
+
+    # Check ownership of every referenced worker with a single query
+    worker_ids = list({payload.worker_id for _, payload in pending.values()})
+    workers = {w["id"]: w for w in await repository.workers_by_ids(user_id, worker_ids)} if worker_ids else {}
+
+    marks, advances, payments = [], [], []
+    mark_positions, advance_positions, payment_positions = [], [], []
+    now = datetime.utcnow()
+    for key, (position, payload) in pending.items():
+        op = batch.operations[position]
+        worker_id = payload.worker_id
+        worker = workers.get(worker_id)
+        if not worker:
+            results[position] = {"key": key, "type": op.type, "ok": False, "error": "Worker not found"}
+            continue
+        results[position] = {"key": key, "type": op.type, "ok": True}
+        if op.type == "mark_attendance":
+            marks.append((worker_id, payload.date, payload.status, worker.get("daily_rate", 500)))
+            mark_positions.append(position)
+        elif op.type == "record_advance":
+            advance = Advance(id=advance_id(user_id, key), worker_id=worker_id, amount=payload.amount, date=payload.date)
+            advances.append(advance.dict())
+            advance_positions.append(position)
+            results[position]["id"] = advance.id
+        else:
+            payment_id = payment_object_id(user_id, key)
+            payments.append({"_id": payment_id, "worker_id": worker_id, "amount": payload.amount, "date": now,
+                             "user_id": user_id, "description": payload.description})
+            payment_positions.append(position)
+            results[position]["id"] = str(payment_id)
+
+    (mark_errors, advance_errors, attendance_ids), payment_errors = await asyncio.gather(
+        repository.apply_batch(marks, advances, user_id),
+        write_batch_payments(payments),
+    )
+    for index, position in enumerate(mark_positions):
+        results[position]["id"] = attendance_ids[index]
+    for errors, positions in ((mark_errors, mark_positions), (advance_errors, advance_positions), (payment_errors, payment_positions)):
+        for index, error in errors.items():
+            results[positions[index]].update({"ok": False, "error": error})
+            results[positions[index]].pop("id", None)
+
+    # Only successes are remembered, so a failed operation can be retried under the same key
+    applied = {}
+    for key, (position, _) in pending.items():
+        if results[position]["ok"]:
+            applied[key] = results[position]
+    await repository.store_idempotent_results(user_id, applied)
+
+    changed = {}  # (collection, site_id) -> doc ids
+    for key, (position, _) in pending.items():
+        result = results[position]
+        if result["ok"]:
+            collection = {"mark_attendance": "attendance", "record_advance": "advances", "record_payment": "payments"}[result["type"]]
+            site_id = None if collection == "payments" else workers[pending[key][1].worker_id].get("site_id")
+            changed.setdefault((collection, site_id), []).append(result["id"])
+    for (collection, site_id), doc_ids in changed.items():
+        await record_write(user_id, collection, site_id, doc_ids)
+
+    # Repeated keys get the answer of their first occurrence
+    for position, op in enumerate(batch.operations):
+        if results[position] is None:
+            results[position] = {**results[pending[op.key][0]], "replayed": True}
+        results[position].setdefault("replayed", False)
+
+    replayed = sum(1 for r in results if r["replayed"])
+    applied_count = sum(1 for r in results if r["ok"] and not r["replayed"])
+    return {
+        "applied": applied_count,
+        "replayed": replayed,
+        "failed": len(results) - applied_count - replayed,
+        "results": results,
+    }
+
+
+# ==================== SYNC ENDPOINT ====================
+
+def sync_fetchers(user_id: str) -> dict:
+    """Per collection: (id field, coroutine function loading current documents by id)"""
+    async def sites_by_ids(ids):
+        return await db.sites.find({"user_id": user_id, "id": {"$in": ids}}, {'_id': 0}).to_list(length=len(ids))
+
+    async def cashbook_by_ids(ids):
+        return await db.cashbook_entries.find({"user_id": user_id, "id": {"$in": ids}}, {'_id': 0}).to_list(length=len(ids))
+
+    async def notes_by_ids(ids):
+        return await db.notes.find({"user_id": user_id, "id": {"$in": ids}}, {'_id': 0}).to_list(length=len(ids))
+
+    async def payments_by_ids(ids):
+        object_ids = [ObjectId(i) for i in ids if ObjectId.is_valid(i)]
+        payments = await db.payments.find({"user_id": user_id, "_id": {"$in": object_ids}}).to_list(length=len(ids))
+        return [payment_response(p) for p in payments]
+
+    return {
+        "sites": ("id", sites_by_ids),
+        "workers": ("id", lambda ids: repository.workers_by_ids(user_id, ids)),
+        "attendance": ("id", repository.attendance_by_ids),
+        "advances": ("id", repository.advances_by_ids),
+        "payments": ("_id", payments_by_ids),
+        "cashbook": ("id", cashbook_by_ids),
+        "notes": ("id", notes_by_ids),
+    }
+
+
+@api_router.get("/sync")
+async def sync_changes(since: str = None, current_user: dict = Depends(get_current_user_optional)):
+    """Sites, workers, attendance, advances, payments, cashbook entries and notes changed since a sync token, with tombstones for deletes"""
+    user_id = current_user["id"]
+    head = await repository.data_version(sync_key(user_id))
+
+    seq = None
+    if since:
+        seq, logged_at = decode_token(since)
+        if token_expired(logged_at) or seq > head:
+            seq = None
+    if seq is None:
+        # No usable token: the client reloads through the list endpoints, then syncs from this token
+        return {"token": encode_token(head), "full_sync_required": True, "has_more": False, "changes": {}}
+
+    entries = await repository.changes_since(user_id, seq, SYNC_PAGE_SIZE)
+    ready = contiguous(entries, seq)
+    changed = collapse(ready)
+
+    fetchers = sync_fetchers(user_id)
+
+    async def load(collection: str) -> dict:
+        doc_ids = changed[collection]
+        live_ids = [doc_id for doc_id, deleted in doc_ids.items() if not deleted]
+        id_field, fetch = fetchers[collection]
+        docs = await fetch(live_ids) if live_ids else []
+        found = {doc[id_field] for doc in docs}
+        # Changed documents that no longer exist are reported as deleted too
+        return {"upserted": docs, "deleted": [doc_id for doc_id in doc_ids if doc_id not in found]}
+
+    loaded = await asyncio.gather(*[load(collection) for collection in SYNC_COLLECTIONS])
+    return FastJSONResponse({
+        "token": next_token(seq, logged_at, entries, ready),
+        "full_sync_required": False,
+        # Only a full page means more is waiting; a page stopped at an in-flight write is picked up next sync
+        "has_more": len(ready) == SYNC_PAGE_SIZE,
+        "changes": {
+            collection: result for collection, result in zip(SYNC_COLLECTIONS, loaded)
+            if result["upserted"] or result["deleted"]
+        },
+    })
 
 
 # Old status endpoints (keep for compatibility)
-@api_router.post("/status", response_model=StatusCheck)
+@api_router.post("/status", response_model=StatusCheck, dependencies=[Depends(require_mongo)])
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.dict()
     status_obj = StatusCheck(**status_dict)
     _ = await db.status_checks.insert_one(status_obj.dict())
     return status_obj
 
-@api_router.get("/status", response_model=List[StatusCheck])
+@api_router.get("/status", response_model=List[StatusCheck], dependencies=[Depends(require_mongo)])
 async def get_status_checks():
     status_checks = await db.status_checks.find().to_list(1000)
     return [StatusCheck(**status_check) for status_check in status_checks]
@@ -607,24 +1395,33 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics for every route plus connection pool gauges"""
+    pool = pool_stats.snapshot()
+    gauges = {
+        "mongo_pool_open_connections": ("Open connections in the Mongo pool", pool["open_connections"]),
+        "mongo_pool_in_use_connections": ("Mongo connections checked out", pool["in_use"]),
+        "mongo_pool_checkout_wait_seconds_max": ("Longest Mongo pool checkout wait", pool["max_wait_ms"] / 1000),
+    }
+    return PlainTextResponse(metrics_registry.render(gauges), media_type="text/plain; version=0.0.4")
 
 
 # ==================== ADDITIONAL AUTH ENDPOINTS ====================
 # These are already implemented: /auth/register (POST)
 # Need to add: /auth/login, /auth/refresh, /auth/logout
 
-@app.post("/auth/login")
+@app.post("/auth/login", dependencies=[Depends(require_mongo)])
 async def login(user_credentials: dict):
     """Login endpoint - authenticates user and returns JWT token"""
     email = user_credentials.get("email")
     password = user_credentials.get("password")
     
     user = await db.users.find_one({"email": email})
-    if not user or not verify_password(user.get("password"), password):
+    if not user or not await verify_password(password, user.get("password_hash")):
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    await upgrade_password_hash(user, password)
     
     access_token = create_access_token(data={"sub": str(user["_id"])})
     return {"access_token": access_token, "token_type": "bearer", "user_id": str(user["_id"])}
@@ -642,67 +1439,89 @@ async def logout(current_user: dict = Depends(get_current_user)):
 
 # ==================== USER ENDPOINTS ====================
 
-@app.get("/users/me")
+# Fields a user may not set on their own profile
+PROTECTED_USER_FIELDS = ("_id", "id", "role", "password", "password_hash")
+
+@app.get("/users/me", dependencies=[Depends(require_mongo)])
 async def get_current_user_profile(current_user: dict = Depends(get_current_user)):
     """Get current user profile"""
-    return {"_id": str(current_user["_id"]), "email": current_user["email"], "name": current_user.get("name")}
+    user = await load_user_profile(db, current_user["id"])
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"id": user["id"], "email": user.get("email"), "name": user.get("name")}
 
-@app.put("/users/me")
+@app.put("/users/me", dependencies=[Depends(require_mongo)])
 async def update_current_user(user_data: dict, current_user: dict = Depends(get_current_user)):
     """Update current user profile"""
-    await db.users.update_one({"_id": current_user["_id"]}, {"$set": user_data})
-    updated_user = await db.users.find_one({"_id": current_user["_id"]})
-    updated_user.pop("_id", None)
+    changes = {k: v for k, v in user_data.items() if k not in PROTECTED_USER_FIELDS}
+    updated_user = await db.users.find_one_and_update(
+        {"id": current_user["id"]}, {"$set": changes}, projection={"_id": 0, "password_hash": 0},
+        return_document=ReturnDocument.AFTER
+    ) if changes else await db.users.find_one({"id": current_user["id"]}, {"_id": 0, "password_hash": 0})
+    if not updated_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    invalidate_user(current_user["id"])
     return updated_user
 
-@app.get("/users")
-async def list_all_users(current_user: dict = Depends(get_current_user)):
+@app.get("/users", dependencies=[Depends(require_mongo)])
+async def list_all_users(admin: dict = Depends(require_admin)):
     """Get all users (admin only)"""
-    if current_user.get("role") != "admin":
-        raise HTTPException(status_code=403, detail="Admin access required")
     users = await db.users.find().to_list(length=1000)
-    return [{"_id": str(u["_id"]), **{k: v for k, v in u.items() if k != "_id" and k != "password"}} for u in users]
+    return [{"_id": str(u["_id"]), **{k: v for k, v in u.items() if k not in ("_id", "password", "password_hash")}} for u in users]
 
-@app.delete("/users/{user_id}")
-async def delete_user(user_id: str, current_user: dict = Depends(get_current_user)):
+@app.delete("/users/{user_id}", dependencies=[Depends(require_mongo)])
+async def delete_user(user_id: str, admin: dict = Depends(require_admin)):
     """Delete a user (admin only)"""
-    if current_user.get("role") != "admin":
-        raise HTTPException(status_code=403, detail="Admin access required")
-    result = await db.users.delete_one({"_id": ObjectId(user_id)})
-    return {"deleted": result.deleted_count > 0}
+    deleted_user = await db.users.find_one_and_delete({"id": user_id})
+    if deleted_user:
+        invalidate_user(user_id)
+    return {"deleted": deleted_user is not None}
 
 # ==================== SITES CRUD ENDPOINTS ====================
 # GET /sites is already implemented
 
-@app.post("/sites")
+# Fields a site update may not change
+PROTECTED_SITE_FIELDS = ("_id", "id", "user_id", "created_at")
+
+@app.post("/sites", dependencies=[Depends(require_mongo)])
 async def create_site(site_data: dict, current_user: dict = Depends(get_current_user)):
     """Create a new worksite"""
-    site_obj = {"name": site_data["name"], "location": site_data.get("location"), "user_id": current_user["_id"], "created_at": datetime.utcnow()}
-    result = await db.sites.insert_one(site_obj)
-    return {"_id": str(result.inserted_id), **site_obj}
+    site_obj = {"id": str(uuid.uuid4()), "name": site_data["name"], "location": site_data.get("location"), "user_id": current_user["id"], "created_at": datetime.utcnow().isoformat()}
+    await db.sites.insert_one(site_obj)
+    await record_write(current_user["id"], "sites", None, [site_obj["id"]])
+    site_obj.pop('_id', None)
+    return site_obj
 
-@app.get("/sites/{site_id}")
+@app.get("/sites/{site_id}", dependencies=[Depends(require_mongo)])
 async def get_site_detail(site_id: str, current_user: dict = Depends(get_current_user)):
     """Get details of a specific worksite"""
-    site = await db.sites.find_one({"_id": ObjectId(site_id), "user_id": current_user["_id"]})
+    site = await db.sites.find_one({"id": site_id, "user_id": current_user["id"]}, {'_id': 0})
     if not site:
         raise HTTPException(status_code=404, detail="Site not found")
-    site["_id"] = str(site["_id"])
     return site
 
-@app.put("/sites/{site_id}")
+@app.put("/sites/{site_id}", dependencies=[Depends(require_mongo)])
 async def update_site(site_id: str, site_data: dict, current_user: dict = Depends(get_current_user)):
     """Update a worksite"""
-    await db.sites.update_one({"_id": ObjectId(site_id), "user_id": current_user["_id"]}, {"$set": site_data})
-    updated_site = await db.sites.find_one({"_id": ObjectId(site_id)})
-    updated_site["_id"] = str(updated_site["_id"])
+    changes = {k: v for k, v in site_data.items() if k not in PROTECTED_SITE_FIELDS}
+    if not changes:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    updated_site = await db.sites.find_one_and_update(
+        {"id": site_id, "user_id": current_user["id"]}, {"$set": changes},
+        projection={'_id': 0}, return_document=ReturnDocument.AFTER
+    )
+    if not updated_site:
+        raise HTTPException(status_code=404, detail="Site not found")
+    await record_write(current_user["id"], "sites", None, [site_id])
     return updated_site
 
-@app.delete("/sites/{site_id}")
+@app.delete("/sites/{site_id}", dependencies=[Depends(require_mongo)])
 async def delete_site(site_id: str, current_user: dict = Depends(get_current_user)):
     """Delete a worksite"""
-    result = await db.sites.delete_one({"_id": ObjectId(site_id), "user_id": current_user["_id"]})
-    return {"deleted": result.deleted_count > 0}
+    deleted = await db.sites.find_one_and_delete({"id": site_id, "user_id": current_user["id"]}, {'_id': 0})
+    if deleted:
+        await record_write(current_user["id"], "sites", None, [site_id], deleted=True)
+    return {"deleted": deleted is not None}
 
 # ==================== WORKERS CRUD ENDPOINTS ====================
 # POST, GET, GET/{id}, PUT/{id} are already implemented
@@ -710,64 +1529,99 @@ async def delete_site(site_id: str, current_user: dict = Depends(get_current_use
 @app.delete("/workers/{worker_id}")
 async def delete_worker(worker_id: str, current_user: dict = Depends(get_current_user)):
     """Delete a worker"""
-    result = await db.workers.delete_one({"_id": ObjectId(worker_id), "user_id": current_user["_id"]})
-    return {"deleted": result.deleted_count > 0}
+    deleted = await repository.delete_worker(current_user["id"], worker_id)
+    if deleted:
+        await record_write(current_user["id"], "workers", deleted.get("site_id"), [worker_id], deleted=True)
+    return {"deleted": deleted is not None}
 
 # ==================== PAYMENTS ENDPOINTS ====================
 
-@app.post("/payments")
+@app.post("/payments", dependencies=[Depends(require_mongo)])
 async def record_payment(payment_data: dict, current_user: dict = Depends(get_current_user)):
     """Record a payment for a worker"""
-    payment = {"worker_id": ObjectId(payment_data["worker_id"]), "amount": payment_data["amount"], "date": datetime.utcnow(), "user_id": current_user["_id"], "description": payment_data.get("description", "")}
+    payment = {"worker_id": str(payment_data["worker_id"]), "amount": payment_data["amount"], "date": datetime.utcnow(), "user_id": current_user["id"], "description": payment_data.get("description", "")}
     result = await db.payments.insert_one(payment)
-    return {"_id": str(result.inserted_id), **payment}
+    await record_write(current_user["id"], "payments", None, [str(result.inserted_id)])
+    return {**payment, "_id": str(result.inserted_id)}
 
-@app.get("/payments")
-async def get_payments(worker_id: str = None, current_user: dict = Depends(get_current_user)):
+@app.get("/payments", dependencies=[Depends(require_mongo)])
+async def get_payments(worker_id: str = None, limit: int = None, cursor: str = None, accept: str = Header(None), current_user: dict = Depends(get_current_user)):
     """Get all payments (filtered by worker if specified)"""
-    query = {"user_id": current_user["_id"]}
+    query = {"user_id": current_user["id"]}
     if worker_id:
-        query["worker_id"] = ObjectId(worker_id)
-    payments = await db.payments.find(query).to_list(length=1000)
-    return [{"_id": str(p["_id"]), "worker_id": str(p["worker_id"]), **{k: v for k, v in p.items() if k not in ["_id", "worker_id"]}} for p in payments]
+        query["worker_id"] = worker_id
+    return await list_response(
+        db.payments, query, PAYMENT_ORDER,
+        accept=accept, limit=limit, cursor=cursor,
+        transform=payment_response
+    )
 
-@app.put("/payments/{payment_id}")
+@app.put("/payments/{payment_id}", dependencies=[Depends(require_mongo)])
 async def update_payment(payment_id: str, payment_data: dict, current_user: dict = Depends(get_current_user)):
     """Update a payment record"""
-    await db.payments.update_one({"_id": ObjectId(payment_id), "user_id": current_user["_id"]}, {"$set": payment_data})
-    updated = await db.payments.find_one({"_id": ObjectId(payment_id)})
-    return {"_id": str(updated["_id"]), **{k: v for k, v in updated.items() if k != "_id"}}
+    changes = payment_changes(payment_data)
+    if not changes:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    if not ObjectId.is_valid(payment_id):
+        raise HTTPException(status_code=404, detail="Payment not found")
+    updated = await db.payments.find_one_and_update(
+        {"_id": ObjectId(payment_id), "user_id": current_user["id"]}, {"$set": changes},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    await record_write(current_user["id"], "payments", None, [payment_id])
+    return payment_response(updated)
 
 # ==================== REPORTS ENDPOINTS ====================
 
+def report_day(value: str, default: str) -> str:
+    """YYYY-MM-DD bound of a report period from a date or datetime, or default when not given"""
+    if not value:
+        return default
+    try:
+        return date.fromisoformat(value[:10]).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be in ISO format")
+
+
+def report_period(start_date: str = None, end_date: str = None):
+    """(date_from, date_to) of a report, open-ended where not given; 400 on a malformed date"""
+    return report_day(start_date, "0001-01-01"), report_day(end_date, "9999-12-31")
+
+
+async def attendance_report_rows(user_id: str, site_id: str, date_from: str, date_to: str):
+    """Attendance records of the user's workers, optionally of one site, ordered by worker then date;
+    shared by the attendance report and its export. Check the dates with report_period first: a
+    streamed export has sent its headers by the time this runs"""
+    by_id = {w["id"]: w for w in await repository.site_workers(user_id, site_id)}
+    async for record in repository.site_attendance_records(list(by_id), date_from, date_to):
+        worker = by_id[record["worker_id"]]
+        yield {**record, "name": worker.get("name"), "site_id": worker.get("site_id")}
+
+
+def payroll_report_query(user_id: str, start_date: str = None, end_date: str = None) -> dict:
+    """Payments filter shared by the payroll report and its export"""
+    query = {"user_id": user_id}
+    try:
+        if start_date:
+            query["date"] = {"$gte": datetime.fromisoformat(start_date)}
+        if end_date:
+            query.setdefault("date", {})["$lte"] = datetime.fromisoformat(end_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be in ISO format")
+    return query
+
+
 @app.get("/reports/attendance")
 async def get_attendance_report(site_id: str = None, start_date: str = None, end_date: str = None, current_user: dict = Depends(get_current_user)):
     """Get attendance report"""
-    query = {"user_id": current_user["_id"]}
-    if site_id:
-        query["site_id"] = ObjectId(site_id)
-    if start_date:
-        query["marked_at"] = {"$gte": datetime.fromisoformat(start_date)}
-    if end_date:
-        if "marked_at" in query:
-            query["marked_at"]["$lte"] = datetime.fromisoformat(end_date)
-        else:
-            query["marked_at"] = {"$lte": datetime.fromisoformat(end_date)}
-    
-    attendance_records = await db.attendance.find(query).to_list(length=5000)
-    return [{"_id": str(a["_id"]), **{k: v for k, v in a.items() if k != "_id"}} for a in attendance_records]
+    date_from, date_to = report_period(start_date, end_date)
+    return [record async for record in attendance_report_rows(current_user["id"], site_id, date_from, date_to)]
 
-@app.get("/reports/payroll")
+@app.get("/reports/payroll", dependencies=[Depends(require_mongo)])
 async def get_payroll_report(start_date: str = None, end_date: str = None, current_user: dict = Depends(get_current_user)):
     """Get payroll report with salary calculations"""
-    query = {"user_id": current_user["_id"]}
-    if start_date:
-        query["date"] = {"$gte": datetime.fromisoformat(start_date)}
-    if end_date:
-        if "date" in query:
-            query["date"]["$lte"] = datetime.fromisoformat(end_date)
-        else:
-            query["date"] = {"$lte": datetime.fromisoformat(end_date)}
-    
+    query = payroll_report_query(current_user["id"], start_date, end_date)
     payments = await db.payments.find(query).to_list(length=5000)
-    return {"total_payments": len(payments), "total_amount": sum([p["amount"] for p in payments]), "payments": [{"_id": str(p["_id"]), "worker_id": str(p["worker_id"]), **{k: v for k, v in p.items() if k not in ["_id", "worker_id"]}} for p in payments]}
+    return {"total_payments": len(payments), "total_amount": sum([p["amount"] for p in payments]), "payments": [payment_response(p) for p in payments]}
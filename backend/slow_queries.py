@@ -0,0 +1,185 @@
+# Slow query recorder
+#
+# A pymongo CommandListener that captures commands slower than SLOW_QUERY_MS,
+# together with their filter shape (values redacted), the route that issued
+# them and a queryPlanner explain() fetched in the background. Entries are kept
+# in the capped `slow_queries` collection.
+#
+#   SLOW_QUERY_MS                (default 100)
+#   SLOW_QUERY_COLLECTION_BYTES  (default 16 MB)
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime
+
+from pymongo import monitoring
+from pymongo.errors import CollectionInvalid
+
+from metrics import current_route
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_COLLECTION = "slow_queries"
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_COLLECTION_BYTES = int(os.environ.get("SLOW_QUERY_COLLECTION_BYTES", str(16 * 1024 * 1024)))
+
+# Commands that explain() understands
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+# Driver-added fields that must not be sent back inside an explain
+DRIVER_FIELDS = {"lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "$readConcern", "readConcern"}
+# Top-level fields whose values describe the query shape and are kept (redacted)
+SHAPE_FIELDS = ("filter", "query", "sort", "projection", "pipeline", "updates", "deletes", "update", "key")
+
+
+def redact(value):
+    """Replace every literal in a query with its type name, keeping field names and operators"""
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # One example element is enough to show the shape
+        return [redact(value[0])] if value else []
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value if value in (1, -1) else "<number>"
+    return f"<{type(value).__name__}>"
+
+
+def _explain_target(command: dict) -> dict:
+    return {key: value for key, value in command.items() if key not in DRIVER_FIELDS}
+
+
+class SlowQueryRecorder(monitoring.CommandListener):
+    """Records slow commands and explains them off the request path"""
+
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, queue_size: int = 100):
+        self.threshold_ms = threshold_ms
+        self._pending = {}  # (request_id, connection_id) -> started command info
+        self._lock = threading.Lock()
+        self._queue = None
+        self._loop = None
+        self._worker = None
+        self._queue_size = queue_size
+        self.db = None
+        self.dropped = 0
+
+    # ---------- lifecycle ----------
+
+    async def start(self, db):
+        """Create the capped collection and start the explain worker on the running loop"""
+        self.db = db
+        try:
+            await db.create_collection(SLOW_QUERY_COLLECTION, capped=True, size=SLOW_QUERY_COLLECTION_BYTES)
+        except CollectionInvalid:
+            pass  # already exists
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._worker = asyncio.create_task(self._explain_worker())
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    # ---------- CommandListener ----------
+
+    def started(self, event):
+        if self._loop is None or event.command_name not in EXPLAINABLE_COMMANDS:
+            return
+        command = event.command
+        collection = command.get(event.command_name)
+        if collection == SLOW_QUERY_COLLECTION:
+            return
+        with self._lock:
+            self._pending[(event.request_id, event.connection_id)] = {
+                "command": command,
+                "database": event.database_name,
+                "collection": collection,
+                "route": current_route(),
+            }
+
+    def succeeded(self, event):
+        self._finish(event, "success")
+
+    def failed(self, event):
+        self._finish(event, "failure")
+
+    def _finish(self, event, outcome: str):
+        with self._lock:
+            info = self._pending.pop((event.request_id, event.connection_id), None)
+        if info is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        if duration_ms < self.threshold_ms:
+            return
+        info.update({"command_name": event.command_name, "duration_ms": duration_ms, "outcome": outcome})
+        # Listener callbacks run on driver threads; hand the entry to the loop
+        self._loop.call_soon_threadsafe(self._enqueue, info)
+
+    def _enqueue(self, info: dict):
+        try:
+            self._queue.put_nowait(info)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    # ---------- explain worker ----------
+
+    async def _explain_worker(self):
+        while True:
+            info = await self._queue.get()
+            try:
+                await self._record(info)
+            except Exception:
+                logger.exception("Failed to record slow query")
+
+    async def _record(self, info: dict):
+        command = info["command"]
+        plan = None
+        try:
+            explain = await self.db.client[info["database"]].command(
+                {"explain": _explain_target(command), "verbosity": "queryPlanner"}
+            )
+            plan = explain.get("queryPlanner", {}).get("winningPlan") or explain.get("stages")
+        except Exception as exc:
+            plan = {"error": str(exc)}
+
+        await self.db[SLOW_QUERY_COLLECTION].insert_one({
+            "recorded_at": datetime.utcnow(),
+            "route": info["route"],
+            "database": info["database"],
+            "collection": info["collection"],
+            "command": info["command_name"],
+            "outcome": info["outcome"],
+            "duration_ms": info["duration_ms"],
+            "shape": {field: redact(command[field]) for field in SHAPE_FIELDS if field in command},
+            # The plan is kept with its literal bounds stripped too
+            "plan": redact_plan(plan),
+        })
+
+
+def redact_plan(plan):
+    """Drop literal index bounds and filters from an explain plan, keeping stages and index names"""
+    if isinstance(plan, dict):
+        return {
+            key: (redact(value) if key in ("indexBounds", "filter", "parsedQuery") else redact_plan(value))
+            for key, value in plan.items()
+        }
+    if isinstance(plan, list):
+        return [redact_plan(item) for item in plan]
+    return plan
+
+
+async def find_slow_queries(db, route: str = None, collection: str = None, min_ms: float = None, limit: int = 50) -> list:
+    """Most recent slow queries, newest first"""
+    query = {}
+    if route:
+        query["route"] = route
+    if collection:
+        query["collection"] = collection
+    if min_ms is not None:
+        query["duration_ms"] = {"$gte": min_ms}
+    cursor = db[SLOW_QUERY_COLLECTION].find(query, {"_id": 0}).sort("$natural", -1).limit(limit)
+    return await cursor.to_list(length=limit)
@@ -0,0 +1,604 @@
+# SQLite storage engine
+#
+# Serves workers, attendance and advances from a local SQLite file for
+# single-box site deployments where running mongod is too heavy:
+#   SQLITE_PATH          (default worksite.db next to this file)
+#   SQLITE_READ_THREADS  (default 4)
+#
+# Users, sites, payments, cashbook entries and notes have no SQLite tables:
+# their endpoints answer 501 under this engine (see repository.py).
+#
+# The database runs in WAL mode so readers never wait for the writer. Reads run
+# on a small thread pool and writes on a single writer thread, each thread with
+# its own connection. Statements are fixed, parameterised SQL strings, so
+# sqlite3's per-connection statement cache prepares each one once.
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from batch import IDEMPOTENCY_TTL_HOURS, idempotency_id
+from pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NDJSON_MEDIA_TYPE, decode_cursor, encode_cursor, wants_ndjson
+)
+from repository import ADVANCE_ORDER, ATTENDANCE_ORDER, WORKER_ORDER
+from responses import FastJSONResponse, dumps
+from rollups import status_earning
+from sync import SYNC_LOG_TTL_DAYS, sync_key
+
+SQLITE_PATH = os.environ.get("SQLITE_PATH", str(Path(__file__).parent / "worksite.db"))
+SQLITE_READ_THREADS = int(os.environ.get("SQLITE_READ_THREADS", "4"))
+STATEMENT_CACHE_SIZE = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    site_id TEXT,
+    name TEXT,
+    phone TEXT,
+    role TEXT,
+    daily_rate NUMERIC NOT NULL DEFAULT 500,
+    status TEXT,
+    created_at TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS workers_user_site ON workers (user_id, site_id, created_at, id);
+CREATE INDEX IF NOT EXISTS workers_user_created ON workers (user_id, created_at, id);
+
+CREATE TABLE IF NOT EXISTS attendance (
+    id TEXT PRIMARY KEY,
+    worker_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    status TEXT NOT NULL,
+    marked_at TEXT,
+    marked_by TEXT,
+    created_at TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS attendance_worker_date ON attendance (worker_id, date);
+
+CREATE TABLE IF NOT EXISTS advances (
+    id TEXT PRIMARY KEY,
+    worker_id TEXT NOT NULL,
+    amount REAL NOT NULL,
+    date TEXT NOT NULL,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS advances_worker_date ON advances (worker_id, date, id);
+
+CREATE TABLE IF NOT EXISTS data_versions (
+    key TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS sync_log (
+    user_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    collection TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    deleted INTEGER NOT NULL,
+    at TEXT NOT NULL,
+    PRIMARY KEY (user_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sync_log_at ON sync_log (at);
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    id TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    created_at TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idempotency_keys_created ON idempotency_keys (created_at);
+"""
+
+WORKER_COLUMNS = ("id", "user_id", "site_id", "name", "phone", "role", "daily_rate", "status", "created_at")
+INSERT_WORKER = f"INSERT INTO workers ({', '.join(WORKER_COLUMNS)}) VALUES ({', '.join('?' * len(WORKER_COLUMNS))})"
+SELECT_WORKER = "SELECT * FROM workers WHERE id = ? AND user_id = ?"
+DELETE_WORKER = "DELETE FROM workers WHERE id = ? AND user_id = ? RETURNING *"
+SELECT_WORKERS_BY_IDS = "SELECT * FROM workers WHERE user_id = ? AND id IN (SELECT value FROM json_each(?))"
+SELECT_WORKER_RATES = "SELECT id, daily_rate FROM workers WHERE user_id = ? AND site_id = ? AND id IN (SELECT value FROM json_each(?))"
+
+SELECT_ATTENDANCE = "SELECT * FROM attendance WHERE id = ?"
+SELECT_ATTENDANCE_BY_IDS = "SELECT * FROM attendance WHERE id IN (SELECT value FROM json_each(?))"
+SELECT_ATTENDANCE_DAY_IDS = "SELECT worker_id, id FROM attendance WHERE date = ? AND worker_id IN (SELECT value FROM json_each(?))"
+SELECT_ATTENDANCE_DAY = "SELECT * FROM attendance WHERE worker_id = ? AND date = ?"
+UPSERT_ATTENDANCE = """
+INSERT INTO attendance (id, worker_id, date, status, marked_at, marked_by, created_at)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (worker_id, date) DO UPDATE SET
+    status = excluded.status,
+    marked_at = excluded.marked_at,
+    marked_by = excluded.marked_by
+"""
+UPDATE_ATTENDANCE = "UPDATE attendance SET status = ?, marked_at = ?, marked_by = ? WHERE id = ?"
+COUNT_ATTENDANCE = (
+    "SELECT status, count(*) AS days FROM attendance "
+    "WHERE worker_id = ? AND date BETWEEN ? AND ? GROUP BY status"
+)
+
+SELECT_PERIOD_WORKERS = (
+    "SELECT id, site_id, daily_rate FROM workers WHERE user_id = ? AND (? IS NULL OR site_id = ?) ORDER BY created_at, id"
+)
+SELECT_PERIOD_ATTENDANCE = (
+    "SELECT a.worker_id, a.date, a.status FROM workers w JOIN attendance a ON a.worker_id = w.id AND a.date BETWEEN ? AND ? "
+    "WHERE w.user_id = ? AND (? IS NULL OR w.site_id = ?)"
+)
+SELECT_PERIOD_ADVANCES = (
+    "SELECT v.worker_id, v.date, v.amount FROM workers w JOIN advances v ON v.worker_id = w.id AND v.date BETWEEN ? AND ? "
+    "WHERE w.user_id = ? AND (? IS NULL OR w.site_id = ?)"
+)
+SELECT_SITE_MARKS = (
+    "SELECT w.id AS worker_id, a.date, a.status FROM workers w "
+    "LEFT JOIN attendance a ON a.worker_id = w.id AND a.date BETWEEN ? AND ? "
+    "WHERE w.user_id = ? AND w.site_id = ? ORDER BY w.created_at, w.id"
+)
+SELECT_SITE_WORKERS = (
+    "SELECT id, name, site_id, daily_rate FROM workers WHERE user_id = ? AND (? IS NULL OR site_id = ?) ORDER BY created_at, id"
+)
+SELECT_SITE_RECORDS = (
+    "SELECT * FROM attendance WHERE worker_id IN (SELECT value FROM json_each(?)) AND date BETWEEN ? AND ? "
+    "AND (worker_id, date) > (?, ?) ORDER BY worker_id, date LIMIT ?"
+)
+SELECT_SITE_PAYROLL_COUNTS = (
+    "SELECT w.id, w.name, w.daily_rate, a.status, count(a.id) AS days FROM workers w "
+    "LEFT JOIN attendance a ON a.worker_id = w.id AND a.date BETWEEN ? AND ? "
+    "WHERE w.user_id = ? AND w.site_id = ? GROUP BY w.id, a.status ORDER BY w.created_at, w.id"
+)
+SELECT_SITE_PAYROLL_ADVANCES = (
+    "SELECT v.worker_id, sum(v.amount) FROM workers w JOIN advances v ON v.worker_id = w.id AND v.date BETWEEN ? AND ? "
+    "WHERE w.user_id = ? AND w.site_id = ? GROUP BY v.worker_id"
+)
+SELECT_MONTHLY_COUNTS = (
+    "SELECT a.worker_id, w.name, w.daily_rate, substr(a.date, 1, 7) AS month, a.status, count(*) AS days "
+    "FROM workers w JOIN attendance a ON a.worker_id = w.id AND a.date BETWEEN ? AND ? "
+    "WHERE w.user_id = ? AND (? IS NULL OR w.site_id = ?) GROUP BY a.worker_id, month, a.status ORDER BY a.worker_id, month"
+)
+
+INSERT_ADVANCE = "INSERT INTO advances (id, worker_id, amount, date, created_at) VALUES (?, ?, ?, ?, ?)"
+INSERT_ADVANCE_ONCE = "INSERT INTO advances (id, worker_id, amount, date, created_at) VALUES (?, ?, ?, ?, ?) ON CONFLICT (id) DO NOTHING"
+SELECT_ADVANCES_BY_IDS = "SELECT * FROM advances WHERE id IN (SELECT value FROM json_each(?))"
+SUM_ADVANCES = "SELECT coalesce(sum(amount), 0.0) FROM advances WHERE worker_id = ? AND date BETWEEN ? AND ?"
+
+SELECT_VERSION = "SELECT version FROM data_versions WHERE key = ?"
+BUMP_VERSION = (
+    "INSERT INTO data_versions (key, version) VALUES (?, 1) "
+    "ON CONFLICT (key) DO UPDATE SET version = data_versions.version + 1"
+)
+ADVANCE_VERSION = (
+    "INSERT INTO data_versions (key, version) VALUES (?, ?) "
+    "ON CONFLICT (key) DO UPDATE SET version = data_versions.version + excluded.version RETURNING version"
+)
+
+INSERT_CHANGE = "INSERT INTO sync_log (user_id, seq, collection, doc_id, deleted, at) VALUES (?, ?, ?, ?, ?, ?)"
+SELECT_CHANGES = "SELECT * FROM sync_log WHERE user_id = ? AND seq > ? ORDER BY seq LIMIT ?"
+PRUNE_CHANGES = "DELETE FROM sync_log WHERE at < ?"
+PRUNE_EVERY = 1000  # change log writes between TTL prunes
+
+SELECT_IDEMPOTENT = "SELECT id, result FROM idempotency_keys WHERE id IN (SELECT value FROM json_each(?))"
+INSERT_IDEMPOTENT = "INSERT INTO idempotency_keys (id, result, created_at) VALUES (?, ?, ?) ON CONFLICT (id) DO NOTHING"
+PRUNE_IDEMPOTENT = "DELETE FROM idempotency_keys WHERE created_at < ?"
+
+NDJSON_BATCH = 500
+
+
+def _text(value):
+    """Store datetimes as ISO strings, the form they are serialised to in responses"""
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _page_sql(table: str, where: str, sort: list, after: list = None, limit: int = None):
+    """SELECT for one keyset page: rows strictly after `after` in `sort` order"""
+    directions = {direction for _, direction in sort}
+    if len(directions) != 1:
+        raise ValueError("Keyset order must use a single direction")
+    descending = directions.pop() == -1
+    columns = ", ".join(field for field, _ in sort)
+    sql = f"SELECT * FROM {table} WHERE {where}"
+    if after is not None:
+        placeholders = ", ".join("?" * len(sort))
+        sql += f" AND ({columns}) {'<' if descending else '>'} ({placeholders})"
+    sql += " ORDER BY " + ", ".join(f"{field} {'DESC' if descending else 'ASC'}" for field, _ in sort)
+    if limit is not None:
+        sql += f" LIMIT {int(limit)}"
+    return sql
+
+
+class SQLiteRepository:
+    """Workers, attendance and advances stored in a local SQLite file"""
+
+    uses_mongo = False
+
+    def __init__(self, path: str = SQLITE_PATH, read_threads: int = SQLITE_READ_THREADS):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._readers = ThreadPoolExecutor(max_workers=read_threads, thread_name_prefix="sqlite-read")
+        # SQLite allows one writer at a time; a single thread serialises writes without lock waits
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-write")
+        self._writes_since_prune = 0
+
+    # ---------- connections ----------
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, isolation_level=None, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    async def _read(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._readers, lambda: func(self._connection(), *args))
+
+    async def _write(self, func, *args):
+        """Run func(conn, *args) in one IMMEDIATE transaction on the writer thread"""
+        def run():
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(conn, *args)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+        return await asyncio.get_running_loop().run_in_executor(self._writer, run)
+
+    async def open(self):
+        def create_schema(conn):
+            conn.executescript(SCHEMA)
+        await asyncio.get_running_loop().run_in_executor(self._writer, lambda: create_schema(self._connection()))
+        await self._write(self._prune)
+
+    async def close(self):
+        self._readers.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+    # ---------- data versions (see etags.py) ----------
+
+    async def data_version(self, key: str) -> int:
+        row = await self._read(lambda conn: conn.execute(SELECT_VERSION, (key,)).fetchone())
+        return row[0] if row else 0
+
+    async def bump_data_versions(self, keys: list):
+        await self._write(lambda conn: conn.executemany(BUMP_VERSION, [(key,) for key in keys]))
+
+    # ---------- change log (see sync.py) ----------
+
+    @staticmethod
+    def _prune(conn):
+        """Expire change log entries and idempotency keys, which MongoDB does with TTL indexes"""
+        now = datetime.utcnow()
+        conn.execute(PRUNE_CHANGES, ((now - timedelta(days=SYNC_LOG_TTL_DAYS)).isoformat(),))
+        conn.execute(PRUNE_IDEMPOTENT, ((now - timedelta(hours=IDEMPOTENCY_TTL_HOURS)).isoformat(),))
+
+    async def record_changes(self, user_id: str, changes: list):
+        """Append (collection, doc_id, deleted) entries to the tenant's change log"""
+        if changes:
+            await self._write(self._log_changes, user_id, changes)
+
+    async def record_write(self, keys: list, user_id: str, changes: list):
+        """Bump the data versions `keys` and log `changes` in one transaction"""
+        def record(conn):
+            conn.executemany(BUMP_VERSION, [(key,) for key in keys])
+            if changes:
+                self._log_changes(conn, user_id, changes)
+        await self._write(record)
+
+    def _log_changes(self, conn, user_id: str, changes: list):
+        # Sequence numbers and entries commit together, so readers never see a gap
+        now = datetime.utcnow().isoformat()
+        last = conn.execute(ADVANCE_VERSION, (sync_key(user_id), len(changes))).fetchone()[0]
+        first = last - len(changes) + 1
+        conn.executemany(INSERT_CHANGE, [
+            (user_id, first + i, collection, doc_id, int(deleted), now)
+            for i, (collection, doc_id, deleted) in enumerate(changes)
+        ])
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= PRUNE_EVERY:
+            self._writes_since_prune = 0
+            self._prune(conn)
+
+    async def changes_since(self, user_id: str, since: int, limit: int) -> list:
+        rows = await self._read(lambda conn: conn.execute(SELECT_CHANGES, (user_id, since, limit)).fetchall())
+        return [
+            {**dict(row), "deleted": bool(row["deleted"]), "at": datetime.fromisoformat(row["at"])}
+            for row in rows
+        ]
+
+    # ---------- idempotency keys (see batch.py) ----------
+
+    async def idempotent_results(self, user_id: str, keys: list) -> dict:
+        ids = {idempotency_id(user_id, key): key for key in keys}
+        rows = await self._read(lambda conn: conn.execute(SELECT_IDEMPOTENT, (json.dumps(list(ids)),)).fetchall())
+        return {ids[row["id"]]: json.loads(row["result"]) for row in rows}
+
+    async def store_idempotent_results(self, user_id: str, results: dict):
+        if not results:
+            return
+        now = datetime.utcnow().isoformat()
+        rows = [(idempotency_id(user_id, key), dumps(result).decode(), now) for key, result in results.items()]
+        await self._write(lambda conn: conn.executemany(INSERT_IDEMPOTENT, rows))
+
+    # ---------- lists ----------
+
+    async def _list_response(self, table: str, where: str, params: tuple, sort: list, *,
+                             accept=None, limit=None, cursor=None, legacy_length: int = 1000):
+        """Same response shapes as pagination.list_response: NDJSON stream, keyset page or plain list"""
+        if wants_ndjson(accept):
+            return StreamingResponse(self._ndjson_lines(table, where, params, sort), media_type=NDJSON_MEDIA_TYPE)
+
+        if limit or cursor:
+            limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+            after = decode_cursor(cursor) if cursor else None
+            if after is not None and len(after) != len(sort):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            rows = await self._fetch(table, where, params, sort, after, limit + 1)
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor([rows[-1][field] for field, _ in sort])
+            return FastJSONResponse({"items": rows, "next_cursor": next_cursor})
+
+        return FastJSONResponse(await self._fetch(table, where, params, sort, None, legacy_length))
+
+    async def _fetch(self, table, where, params, sort, after, limit) -> list:
+        sql = _page_sql(table, where, sort, after, limit)
+        args = params + tuple(after or ())
+        return await self._read(lambda conn: [dict(row) for row in conn.execute(sql, args)])
+
+    async def _ndjson_lines(self, table, where, params, sort):
+        # Walk the result in keyset batches so no read transaction stays open across awaits
+        after = None
+        while True:
+            rows = await self._fetch(table, where, params, sort, after, NDJSON_BATCH)
+            for row in rows:
+                yield dumps(row) + b"\n"
+            if len(rows) < NDJSON_BATCH:
+                return
+            after = [rows[-1][field] for field, _ in sort]
+
+    # ---------- workers ----------
+
+    async def create_worker(self, worker: dict):
+        values = tuple(_text(worker.get(column)) for column in WORKER_COLUMNS)
+        await self._write(lambda conn: conn.execute(INSERT_WORKER, values))
+
+    async def get_worker(self, user_id: str, worker_id: str):
+        row = await self._read(lambda conn: conn.execute(SELECT_WORKER, (worker_id, user_id)).fetchone())
+        return dict(row) if row else None
+
+    async def list_workers(self, user_id: str, site_id: str = None, *, accept=None, limit=None, cursor=None):
+        if site_id:
+            where, params = "user_id = ? AND site_id = ?", (user_id, site_id)
+        else:
+            where, params = "user_id = ?", (user_id,)
+        return await self._list_response("workers", where, params, WORKER_ORDER, accept=accept, limit=limit, cursor=cursor)
+
+    async def update_worker(self, user_id: str, worker_id: str, fields: dict):
+        # Field names come from the endpoint's fixed allow-list, never from the client
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        sql = f"UPDATE workers SET {assignments} WHERE id = ? AND user_id = ?"
+
+        def update(conn):
+            conn.execute(sql, (*fields.values(), worker_id, user_id))
+            return conn.execute(SELECT_WORKER, (worker_id, user_id)).fetchone()
+        row = await self._write(update)
+        return dict(row) if row else None
+
+    async def delete_worker(self, user_id: str, worker_id: str):
+        row = await self._write(lambda conn: conn.execute(DELETE_WORKER, (worker_id, user_id)).fetchone())
+        return dict(row) if row else None
+
+    async def workers_by_ids(self, user_id: str, worker_ids: list) -> list:
+        rows = await self._read(lambda conn: conn.execute(SELECT_WORKERS_BY_IDS, (user_id, json.dumps(worker_ids))).fetchall())
+        return [dict(row) for row in rows]
+
+    async def worker_rates(self, user_id: str, site_id: str, worker_ids: list) -> dict:
+        rows = await self._read(
+            lambda conn: conn.execute(SELECT_WORKER_RATES, (user_id, site_id, json.dumps(worker_ids))).fetchall()
+        )
+        return {row["id"]: row["daily_rate"] for row in rows}
+
+    # ---------- attendance ----------
+
+    @staticmethod
+    def _upsert_day(conn, worker_id, date, status, marked_at, marked_by) -> dict:
+        conn.execute(UPSERT_ATTENDANCE, (str(uuid.uuid4()), worker_id, date, status, marked_at, marked_by, marked_at))
+        return dict(conn.execute(SELECT_ATTENDANCE_DAY, (worker_id, date)).fetchone())
+
+    async def upsert_attendance(self, worker_id: str, date: str, status: str, marked_by: str, daily_rate: float) -> dict:
+        """Create or update the single attendance record for (worker_id, date)"""
+        now = datetime.utcnow().isoformat()
+        return await self._write(self._upsert_day, worker_id, date, status, now, marked_by)
+
+    async def mark_attendance_many(self, date: str, marks: list, marked_by: str):
+        """Upsert (worker_id, status, daily_rate) marks for one day in one transaction.
+
+        Returns ({position: error} for failed marks, {worker_id: attendance id}).
+        """
+        now = datetime.utcnow().isoformat()
+
+        def mark(conn):
+            conn.executemany(UPSERT_ATTENDANCE, [
+                (str(uuid.uuid4()), worker_id, date, status, now, marked_by, now)
+                for worker_id, status, _ in marks
+            ])
+            worker_ids = json.dumps([worker_id for worker_id, _, _ in marks])
+            return {row["worker_id"]: row["id"] for row in conn.execute(SELECT_ATTENDANCE_DAY_IDS, (date, worker_ids))}
+        if not marks:
+            return {}, {}
+        return {}, await self._write(mark)
+
+    async def apply_batch(self, marks: list, advances: list, marked_by: str):
+        """Apply attendance marks and new advances in one transaction; see MongoRepository.apply_batch"""
+        if not marks and not advances:
+            return {}, {}, []
+        now = datetime.utcnow().isoformat()
+
+        def apply(conn):
+            attendance_ids = []
+            for worker_id, day, status, _ in marks:
+                attendance_ids.append(self._upsert_day(conn, worker_id, day, status, now, marked_by)["id"])
+            conn.executemany(INSERT_ADVANCE_ONCE, [
+                (a["id"], a["worker_id"], a["amount"], a["date"], _text(a.get("created_at"))) for a in advances
+            ])
+            return attendance_ids
+        # All or nothing: a failure rolls the whole batch back and surfaces as an error response
+        return {}, {}, await self._write(apply)
+
+    async def get_attendance(self, attendance_id: str):
+        row = await self._read(lambda conn: conn.execute(SELECT_ATTENDANCE, (attendance_id,)).fetchone())
+        return dict(row) if row else None
+
+    async def attendance_by_ids(self, attendance_ids: list) -> list:
+        rows = await self._read(lambda conn: conn.execute(SELECT_ATTENDANCE_BY_IDS, (json.dumps(attendance_ids),)).fetchall())
+        return [dict(row) for row in rows]
+
+    async def update_attendance(self, attendance_id: str, status: str, marked_by: str, daily_rate: float):
+        now = datetime.utcnow().isoformat()
+
+        def update(conn):
+            conn.execute(UPDATE_ATTENDANCE, (status, now, marked_by, attendance_id))
+            return conn.execute(SELECT_ATTENDANCE, (attendance_id,)).fetchone()
+        row = await self._write(update)
+        return dict(row) if row else None
+
+    async def list_attendance(self, worker_id: str, date_from=None, date_to=None, *, accept=None, limit=None, cursor=None):
+        where, params = "worker_id = ?", (worker_id,)
+        if date_from and date_to:
+            where, params = where + " AND date BETWEEN ? AND ?", params + (date_from, date_to)
+        return await self._list_response("attendance", where, params, ATTENDANCE_ORDER, accept=accept, limit=limit, cursor=cursor)
+
+    async def attendance_status_counts(self, worker_id: str, date_from: str, date_to: str) -> dict:
+        """Per-status day counts; the (worker_id, date) index makes this a range scan, no rollups needed"""
+        # Same validation as the rollup path
+        date.fromisoformat(date_from)
+        date.fromisoformat(date_to)
+        rows = await self._read(lambda conn: conn.execute(COUNT_ATTENDANCE, (worker_id, date_from, date_to)).fetchall())
+        return {row["status"]: row["days"] for row in rows}
+
+    async def site_attendance_marks(self, user_id: str, site_id: str, date_from: str, date_to: str) -> list:
+        rows = await self._read(lambda conn: conn.execute(SELECT_SITE_MARKS, (date_from, date_to, user_id, site_id)).fetchall())
+        workers = {}  # insertion order keeps the query's worker order
+        for row in rows:
+            marks = workers.setdefault(row["worker_id"], [])
+            if row["date"]:
+                marks.append((row["date"], row["status"]))
+        return list(workers.items())
+
+    async def payroll_inputs(self, user_id: str, site_id: str, date_from: str, date_to: str):
+        workers, attendance, advances = await self.period_inputs(user_id, site_id, date_from, date_to)
+        return (
+            [(worker_id, rate) for worker_id, _, rate in workers],
+            [(worker_id, status) for worker_id, _, status in attendance],
+            [(worker_id, amount) for worker_id, _, amount in advances]
+        )
+
+    async def period_inputs(self, user_id: str, site_id: str, date_from: str, date_to: str):
+        """Same rows as MongoRepository.period_inputs, read in one snapshot"""
+        def read(conn):
+            scope = (user_id, site_id, site_id)
+            cursor = conn.cursor()
+            cursor.row_factory = None  # plain tuples, which is all the callers need
+            cursor.execute("BEGIN")
+            try:
+                return (
+                    cursor.execute(SELECT_PERIOD_WORKERS, scope).fetchall(),
+                    cursor.execute(SELECT_PERIOD_ATTENDANCE, (date_from, date_to) + scope).fetchall(),
+                    cursor.execute(SELECT_PERIOD_ADVANCES, (date_from, date_to) + scope).fetchall(),
+                )
+            finally:
+                cursor.execute("COMMIT")
+        return await self._read(read)
+
+    async def site_workers(self, user_id: str, site_id: str = None) -> list:
+        rows = await self._read(lambda conn: conn.execute(SELECT_SITE_WORKERS, (user_id, site_id, site_id)).fetchall())
+        return [dict(row) for row in rows]
+
+    async def site_attendance_records(self, worker_ids: list, date_from: str, date_to: str):
+        """Attendance records of the workers within a period, ordered by worker_id then date"""
+        # Keyset batches, so no read transaction stays open while the caller streams
+        after, ids = ("", ""), json.dumps(worker_ids)
+        while True:
+            rows = await self._read(lambda conn: conn.execute(
+                SELECT_SITE_RECORDS, (ids, date_from, date_to, *after, NDJSON_BATCH)
+            ).fetchall())
+            for row in rows:
+                yield dict(row)
+            if len(rows) < NDJSON_BATCH:
+                return
+            after = (rows[-1]["worker_id"], rows[-1]["date"])
+
+    async def site_payroll_rows(self, user_id: str, site_id: str, date_from: str, date_to: str):
+        """(worker, {status: days}, total advances) for each of a site's workers, read in one snapshot"""
+        def read(conn):
+            params = (date_from, date_to, user_id, site_id)
+            cursor = conn.cursor()
+            cursor.execute("BEGIN")
+            try:
+                return cursor.execute(SELECT_SITE_PAYROLL_COUNTS, params).fetchall(), dict(
+                    cursor.execute(SELECT_SITE_PAYROLL_ADVANCES, params).fetchall()
+                )
+            finally:
+                cursor.execute("COMMIT")
+        counts, advances = await self._read(read)
+        workers = {}  # insertion order keeps the query's worker order
+        for row in counts:
+            worker, status_counts = workers.setdefault(
+                row["id"], ({"id": row["id"], "name": row["name"], "daily_rate": row["daily_rate"]}, {})
+            )
+            if row["status"]:
+                status_counts[row["status"]] = row["days"]
+        for worker, status_counts in workers.values():
+            yield worker, status_counts, advances.get(worker["id"], 0.0)
+
+    async def attendance_summary(self, user_id: str, site_id: str, month_from: str, month_to: str) -> list:
+        """Per worker-month {worker_id, month, counts, earned, name}, counted from raw attendance"""
+        params = (f"{month_from}-01", f"{month_to}-31", user_id, site_id, site_id)
+        rows = await self._read(lambda conn: conn.execute(SELECT_MONTHLY_COUNTS, params).fetchall())
+        summary = {}
+        for row in rows:
+            entry = summary.setdefault((row["worker_id"], row["month"]), {
+                "worker_id": row["worker_id"], "month": row["month"], "counts": {}, "earned": 0.0, "name": row["name"]
+            })
+            entry["counts"][row["status"]] = row["days"]
+            entry["earned"] += row["days"] * status_earning(row["status"], row["daily_rate"])
+        return list(summary.values())
+
+    # ---------- advances ----------
+
+    async def create_advance(self, advance: dict):
+        values = (advance["id"], advance["worker_id"], advance["amount"], advance["date"], _text(advance.get("created_at")))
+        await self._write(lambda conn: conn.execute(INSERT_ADVANCE, values))
+
+    async def advances_by_ids(self, advance_ids: list) -> list:
+        rows = await self._read(lambda conn: conn.execute(SELECT_ADVANCES_BY_IDS, (json.dumps(advance_ids),)).fetchall())
+        return [dict(row) for row in rows]
+
+    async def total_advances(self, worker_id: str, date_from: str, date_to: str) -> float:
+        return await self._read(lambda conn: conn.execute(SUM_ADVANCES, (worker_id, date_from, date_to)).fetchone()[0])
+
+    async def list_advances(self, worker_id: str, date_from=None, date_to=None, *, accept=None, limit=None, cursor=None):
+        where, params = "worker_id = ?", (worker_id,)
+        if date_from and date_to:
+            where, params = where + " AND date BETWEEN ? AND ?", params + (date_from, date_to)
+        return await self._list_response("advances", where, params, ADVANCE_ORDER, accept=accept, limit=limit, cursor=cursor)
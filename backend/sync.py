@@ -0,0 +1,88 @@
+# Delta sync for offline-first clients
+#
+# Every write endpoint appends (collection, doc id, deleted?) entries to a
+# per-tenant change log with a gap-free sequence number. GET /api/sync?since=
+# returns the current state of each document changed after the client's token,
+# or a tombstone for each deleted one, plus a new token.
+#
+# The first sync (no token) only returns a token: the client takes it, then
+# loads its data through the regular list endpoints. Anything written in
+# between is replayed by the next sync, and replaying an upsert is harmless.
+#
+# Log entries expire SYNC_LOG_TTL_DAYS after they were written. A token carries
+# the time of the last entry it consumed (or when it was issued, if there was
+# nothing to consume), so it expires with the first entry it has not seen yet;
+# an expired token gets full_sync_required instead of a page with a hole in it.
+#   SYNC_LOG_TTL_DAYS   (default 30)
+#   SYNC_PAGE_SIZE      (default 1000 log entries per response)
+#   SYNC_GAP_GRACE_MS   (default 10000)
+import os
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+
+from pagination import decode_cursor, encode_cursor
+
+SYNC_COLLECTIONS = ("sites", "workers", "attendance", "advances", "payments", "cashbook", "notes")
+SYNC_LOG_TTL_DAYS = int(os.environ.get("SYNC_LOG_TTL_DAYS", "30"))
+SYNC_PAGE_SIZE = int(os.environ.get("SYNC_PAGE_SIZE", "1000"))
+# On MongoDB a sequence number is reserved before its log entry is written, so a
+# reader can briefly see a gap. Gaps are waited out for this long, after which
+# the writer is assumed to have failed and the gap is skipped.
+SYNC_GAP_GRACE_MS = int(os.environ.get("SYNC_GAP_GRACE_MS", "10000"))
+# Tokens expire this long before their next entry would, for clock skew between servers
+SYNC_EXPIRY_MARGIN = timedelta(hours=1)
+
+
+def sync_key(user_id: str) -> str:
+    """Data version key holding a tenant's latest change sequence number"""
+    return f"{user_id}:sync"
+
+
+def encode_token(seq: int, logged_at: datetime = None) -> str:
+    """Token resuming after `seq`; logged_at is when entry `seq` was written, default now"""
+    return encode_cursor([seq, logged_at or datetime.utcnow()])
+
+
+def decode_token(token: str):
+    """(seq, logged_at) from a sync token"""
+    values = decode_cursor(token)
+    if (not isinstance(values, list) or len(values) != 2 or not isinstance(values[0], int) or isinstance(values[0], bool)
+            or not isinstance(values[1], datetime)):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    return values[0], values[1].replace(tzinfo=None)
+
+
+def token_expired(logged_at: datetime) -> bool:
+    """True when log entries after the token may already have expired"""
+    return logged_at < datetime.utcnow() - timedelta(days=SYNC_LOG_TTL_DAYS) + SYNC_EXPIRY_MARGIN
+
+
+def next_token(seq: int, logged_at: datetime, entries: list, ready: list) -> str:
+    """Token after a sync page: entries were read after `seq`, ready is their contiguous head"""
+    if ready:
+        return encode_token(ready[-1]["seq"], ready[-1]["at"])
+    if not entries:
+        return encode_token(seq)  # nothing logged after seq yet, so its next entry is newer than now
+    return encode_token(seq, logged_at)  # waiting on an in-flight write; the token ages as before
+
+
+def contiguous(entries: list, since: int) -> list:
+    """Leading entries (sorted by seq) without gaps after `since`; stale gaps are skipped"""
+    grace_cutoff = datetime.utcnow() - timedelta(milliseconds=SYNC_GAP_GRACE_MS)
+    result = []
+    expected = since + 1
+    for entry in entries:
+        if entry["seq"] != expected and entry["at"] > grace_cutoff:
+            break  # a write in flight; pick it up on the next sync
+        result.append(entry)
+        expected = entry["seq"] + 1
+    return result
+
+
+def collapse(entries: list) -> dict:
+    """{collection: {doc_id: deleted}} keeping each document's latest change"""
+    changes = {collection: {} for collection in SYNC_COLLECTIONS}
+    for entry in entries:
+        changes[entry["collection"]][entry["doc_id"]] = entry["deleted"]
+    return changes
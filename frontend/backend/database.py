@@ -0,0 +1,157 @@
+# MongoDB client setup and connection pool statistics
+#
+# Pool sizes and timeouts come from the environment so each deployment can
+# size its pool per uvicorn worker:
+#   MONGO_MAX_POOL_SIZE                (default 100)
+#   MONGO_MIN_POOL_SIZE                (default 0)
+#   MONGO_MAX_IDLE_TIME_MS             (default 0 = no limit)
+#   MONGO_CONNECT_TIMEOUT_MS           (default 10000)
+#   MONGO_SERVER_SELECTION_TIMEOUT_MS  (default 10000)
+#   MONGO_WAIT_QUEUE_TIMEOUT_MS        (default 0 = wait forever)
+#   MONGO_WARMUP                       (default "true") - ping at startup
+#
+# The same file ships in backend/, api/ and frontend/backend/: each of those
+# is deployed on its own (Docker image, serverless function, standalone app)
+# and only bundles its own directory, so they cannot import a shared module.
+# Edit backend/database.py and copy it over; tests/test_database_copies.py
+# fails when the copies drift.
+import os
+import threading
+import time
+from collections import deque
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Counts pool connections and measures how long checkouts wait.
+
+    pymongo fires checkout events on the thread doing the checkout, so the start
+    time is kept in a thread-local and matched with the checked-out event.
+    """
+
+    def __init__(self, samples: int = 1000):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.open_connections = 0
+        self.in_use = 0
+        self.checkouts = 0
+        self.failed_checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent_waits = deque(maxlen=samples)
+
+    def _record_wait(self):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        if started is None:
+            return None
+        return time.perf_counter() - started
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections -= 1
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._record_wait()
+        with self._lock:
+            self.failed_checkouts += 1
+
+    def connection_checked_out(self, event):
+        wait = self._record_wait()
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            if wait is not None:
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                self.recent_waits.append(wait)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            waits = sorted(self.recent_waits)
+            checkouts = self.checkouts
+            snapshot = {
+                "open_connections": self.open_connections,
+                "in_use": self.in_use,
+                "checkouts": checkouts,
+                "failed_checkouts": self.failed_checkouts,
+                "avg_wait_ms": round(self.total_wait / checkouts * 1000, 3) if checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+            }
+
+        def pct(p):
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))] * 1000, 3) if waits else 0.0
+
+        snapshot["recent_wait_ms"] = {"p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99), "samples": len(waits)}
+        return snapshot
+
+
+def pool_options() -> dict:
+    """Client keyword arguments for pool sizing and timeouts"""
+    return {
+        "maxPoolSize": _env_int("MONGO_MAX_POOL_SIZE", 100),
+        "minPoolSize": _env_int("MONGO_MIN_POOL_SIZE", 0),
+        "maxIdleTimeMS": _env_int("MONGO_MAX_IDLE_TIME_MS", 0) or None,
+        "connectTimeoutMS": _env_int("MONGO_CONNECT_TIMEOUT_MS", 10000),
+        "serverSelectionTimeoutMS": _env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000),
+        "waitQueueTimeoutMS": _env_int("MONGO_WAIT_QUEUE_TIMEOUT_MS", 0) or None,
+    }
+
+
+def create_client(mongo_url: str, pool_stats: PoolStats, *listeners) -> AsyncIOMotorClient:
+    """Create a Motor client with the configured pool and the stats listener attached"""
+    return AsyncIOMotorClient(mongo_url, event_listeners=[pool_stats, *listeners], **pool_options())
+
+
+async def warm_up(client: AsyncIOMotorClient):
+    """Ping the server so the first request does not pay for server selection and the handshake"""
+    if os.environ.get("MONGO_WARMUP", "true").lower() in ("1", "true", "yes"):
+        await client.admin.command("ping")
+
+
+async def db_health(client: AsyncIOMotorClient, pool_stats: PoolStats) -> dict:
+    """Ping latency plus pool statistics for the /health/db endpoint"""
+    started = time.perf_counter()
+    try:
+        await client.admin.command("ping")
+        status = "ok"
+    except Exception as exc:
+        status = f"error: {exc}"
+    return {
+        "status": status,
+        "ping_ms": round((time.perf_counter() - started) * 1000, 3),
+        "pool_options": {k: v for k, v in pool_options().items() if v is not None},
+        "pool": pool_stats.snapshot(),
+    }
@@ -1,14 +1,16 @@
 from fastapi import FastAPI, APIRouter
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List
 import uuid
 from datetime import datetime
+from database import PoolStats, create_client, warm_up, db_health
 
 
 ROOT_DIR = Path(__file__).parent
@@ -16,11 +18,20 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+pool_stats = PoolStats()
+client = create_client(mongo_url, pool_stats)
 db = client[os.environ['DB_NAME']]
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await warm_up(client)
+    yield
+    client.close()
+
+
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -40,6 +51,14 @@ class StatusCheckCreate(BaseModel):
 async def root():
     return {"message": "Hello World"}
 
+@api_router.get("/health/db")
+async def get_db_health():
+    """Ping latency, connection pool usage and checkout wait times"""
+    health = await db_health(client, pool_stats)
+    if health["status"] != "ok":
+        return JSONResponse(status_code=503, content=health)
+    return health
+
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.dict()
@@ -69,7 +88,3 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
@@ -0,0 +1,30 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# The backend modules import each other as top-level modules, the way uvicorn runs them
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "worksite_manager_test")
+
+from sqlite_repository import SQLiteRepository  # noqa: E402
+
+
+@pytest.fixture
+def sqlite_repository(tmp_path):
+    """SQLiteRepository on a fresh file; drive it with asyncio.run"""
+    repository = SQLiteRepository(str(tmp_path / "worksite.db"), read_threads=2)
+    asyncio.run(repository.open())
+    yield repository
+    asyncio.run(repository.close())
+
+
+@pytest.fixture
+def sqlite_server(sqlite_repository, monkeypatch):
+    """The server module with its repository swapped for sqlite_repository; call handlers directly"""
+    import server
+    monkeypatch.setattr(server, "repository", sqlite_repository)
+    return server
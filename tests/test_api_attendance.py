@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+import rollups
+from api import index
+
+USER = {"id": "u1"}
+
+
+class Collection:
+    def __init__(self, docs=None):
+        self.docs = docs or []
+        self.calls = []
+
+    def _match(self, query):
+        return next((d for d in self.docs if all(d.get(k) == v for k, v in query.items())), None)
+
+    async def find_one(self, query, projection=None):
+        return self._match(query)
+
+    async def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=None):
+        doc = self._match(query)
+        before = dict(doc) if doc else None
+        if doc is None:
+            doc = {**query, **update.get("$setOnInsert", {})}
+            self.docs.append(doc)
+        doc.update(update.get("$set", {}))
+        for field, amount in update.get("$inc", {}).items():
+            doc[field] = doc.get(field, 0) + amount
+        return dict(doc) if return_document else before
+
+    async def update_one(self, query, update, upsert=False):
+        self.calls.append((query, update))
+
+    async def bulk_write(self, operations, ordered):
+        self.calls.extend(op._filter["_id"] for op in operations)
+
+    async def insert_many(self, docs, ordered):
+        self.docs.extend(docs)
+
+
+class Db:
+    def __init__(self):
+        self.workers = Collection([{"id": "w1", "user_id": "u1", "site_id": "s1", "daily_rate": 400}])
+        self.attendance = Collection()
+        self.attendance_rollups = Collection()
+        self.data_versions = Collection()
+        self.sync_log = Collection()
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = Db()
+    monkeypatch.setattr(index, "db", fake)
+    return fake
+
+
+@pytest.mark.parametrize("old, new", [(None, "present"), ("present", "half"), ("half", "absent"), ("absent", "absent")])
+def test_rollup_delta_matches_the_backend(old, new):
+    assert index.rollup_delta(old, new, 400) == rollups.rollup_delta(old, new, 400)
+
+
+def test_marking_moves_the_rollup_bumps_versions_and_logs_the_record(db):
+    mark = index.AttendanceCreate(worker_id="w1", date="2024-01-02", status="present")
+    first = asyncio.run(index.mark_attendance(mark, current_user=USER))
+    asyncio.run(index.mark_attendance(mark.model_copy(update={"status": "half"}), current_user=USER))
+
+    assert db.attendance_rollups.calls == [
+        ({"worker_id": "w1", "month": "2024-01"}, {"$inc": {"counts.present": 1, "earned": 400}}),
+        ({"worker_id": "w1", "month": "2024-01"}, {"$inc": {"counts.present": -1, "counts.half": 1, "earned": -200}}),
+    ]
+    assert db.data_versions.calls == ["u1:attendance:*", "u1:attendance:s1"] * 2
+    assert [(e["seq"], e["doc_id"]) for e in db.sync_log.docs] == [(1, first["id"]), (2, first["id"])]
+
+
+def test_updating_a_record_moves_the_rollup_from_its_old_status(db):
+    marked = asyncio.run(index.mark_attendance(
+        index.AttendanceCreate(worker_id="w1", date="2024-01-02", status="present"), current_user=USER
+    ))
+    updated = asyncio.run(index.update_attendance(marked["id"], index.AttendanceUpdate(status="absent"), current_user=USER))
+
+    assert updated["status"] == "absent"
+    assert db.attendance_rollups.calls[-1] == (
+        {"worker_id": "w1", "month": "2024-01"}, {"$inc": {"counts.present": -1, "counts.absent": 1, "earned": -400}}
+    )
+    assert [e["doc_id"] for e in db.sync_log.docs] == [marked["id"], marked["id"]]
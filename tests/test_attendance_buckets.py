@@ -0,0 +1,44 @@
+from datetime import datetime
+
+import pytest
+
+from attendance_buckets import bucket_days, bucket_range, bucket_records, day_id, month_days, parse_day_id, set_day_update
+
+
+def bucket(statuses):
+    days = len(statuses)
+    at = datetime(2024, 2, 1)
+    return {"worker_id": "w:1", "month": "2024-02", "status": statuses,
+            "marked_at": [at] * days, "marked_by": ["u1"] * days, "created_at": [at] * days}
+
+
+def test_day_ids_round_trip_with_colons_in_worker_ids():
+    assert parse_day_id(day_id("w:1", "2024-02-29")) == ("w:1", "2024-02-29")
+    assert parse_day_id("3f2b9c1e-uuid") is None
+    assert parse_day_id(":2024-02-01") is None
+
+
+def test_month_days_handles_leap_years():
+    assert month_days("2024-02") == 29
+    assert month_days("2023-02") == 28
+
+
+def test_bucket_range_is_open_ended():
+    assert bucket_range("w1") == {"$gte": "w1:", "$lte": "w1:~"}
+    assert bucket_range("w1", "2024-01", "2024-03") == {"$gte": "w1:2024-01", "$lte": "w1:2024-03"}
+
+
+def test_bucket_days_and_records_skip_unmarked_days_and_respect_the_period():
+    statuses = [None] * 29
+    statuses[0], statuses[9], statuses[28] = "present", "half", "absent"
+    assert list(bucket_days(bucket(statuses))) == [(0, "2024-02-01", "present"), (9, "2024-02-10", "half"),
+                                                   (28, "2024-02-29", "absent")]
+    records = bucket_records(bucket(statuses), "2024-02-02", "2024-02-28")
+    assert [(r["id"], r["date"], r["status"]) for r in records] == [("w:1:2024-02-10", "2024-02-10", "half")]
+
+
+def test_set_day_update_rejects_malformed_dates():
+    with pytest.raises(ValueError):
+        set_day_update("w1", "2024-02-30", "present", datetime(2024, 2, 1), "u1")
+    update = set_day_update("w1", "2024-02-29", "present", datetime(2024, 2, 1), "u1")
+    assert update[0]["$set"]["month"] == {"$literal": "2024-02"}
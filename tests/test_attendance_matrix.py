@@ -0,0 +1,24 @@
+import pytest
+
+from attendance_matrix import encode_row, matrix_response, month_range
+
+
+def test_month_range():
+    assert month_range("2024-02") == ("2024-02-01", "2024-02-29", 29)
+    with pytest.raises(ValueError):
+        month_range("2024-13")
+
+
+def test_encode_row_marks_unmarked_and_unknown_days():
+    marks = [("2024-02-01", "present"), ("2024-02-03", "half"), ("2024-02-04", "sick"), ("2024-02-29", "holiday")]
+    row = encode_row(marks, 29)
+    assert len(row) == 29
+    assert row[:4] == "P.H?"
+    assert row[-1] == "L"
+
+
+def test_matrix_response_keeps_worker_order():
+    grid = matrix_response("s1", "2024-02", 29, [("w2", [("2024-02-02", "absent")]), ("w1", [])])
+    assert grid["worker_ids"] == ["w2", "w1"]
+    assert grid["rows"] == [".A" + "." * 27, "." * 29]
+    assert grid["codes"]["P"] == "present"
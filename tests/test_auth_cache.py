@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+import jwt
+import pytest
+from fastapi import HTTPException
+
+import auth
+from auth import TTLCache, create_access_token, decode_token_cached, invalidate_user, load_user_profile
+
+
+class Users:
+    """db.users stand-in that applies exclusion projections and counts reads"""
+
+    def __init__(self, *users):
+        self.users = {user["id"]: user for user in users}
+        self.reads = 0
+
+    async def find_one(self, query, projection=None):
+        self.reads += 1
+        user = self.users.get(query["id"])
+        if user is None:
+            return None
+        return {k: v for k, v in user.items() if k not in (projection or {})}
+
+
+class Db:
+    def __init__(self, *users):
+        self.users = Users(*users)
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches(monkeypatch):
+    monkeypatch.setattr(auth, "token_cache", TTLCache(10, 300))
+    monkeypatch.setattr(auth, "profile_cache", TTLCache(10, 60))
+
+
+def test_ttl_cache_expires_and_evicts_least_recently_used():
+    cache = TTLCache(2, 60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # evicts b, the least recently used
+    assert cache.get("b") is None
+    cache.set("d", 4, expires_at=time.time() - 1)  # evicts a; already expired, so dropped on read
+    assert cache.get("d") is None
+    assert cache.stats() == {"size": 1, "maxsize": 2, "hits": 1, "misses": 2}
+
+
+def test_verified_tokens_are_cached_until_their_exp():
+    token = create_access_token({"user_id": "u1", "email": "a@example.com"})
+    first = decode_token_cached(token)
+    first["user_id"] = "someone-else"
+    assert decode_token_cached(token)["user_id"] == "u1"
+    assert auth.token_cache.stats()["hits"] == 1
+
+
+@pytest.mark.parametrize("token", [
+    "not-a-jwt",
+    jwt.encode({"user_id": "u1"}, "another-secret-that-is-long-enough-for-hs256", algorithm="HS256"),
+    jwt.encode({"user_id": "u1", "exp": 1}, auth.SECRET_KEY, algorithm="HS256"),
+])
+def test_bad_tokens_are_rejected_and_not_cached(token):
+    with pytest.raises(HTTPException) as exc:
+        decode_token_cached(token)
+    assert exc.value.status_code == 401
+    assert auth.token_cache.stats()["size"] == 0
+
+
+def test_profiles_are_cached_as_copies_without_password_fields():
+    db = Db({"id": "u1", "email": "a@example.com", "role": "admin", "password_hash": "$2b$12$x"})
+    profile = asyncio.run(load_user_profile(db, "u1"))
+    assert "password_hash" not in profile
+    profile["role"] = "worker"
+
+    again = asyncio.run(load_user_profile(db, "u1"))
+    assert again["role"] == "admin"
+    assert db.users.reads == 1
+
+
+def test_invalidate_user_reloads_the_profile():
+    db = Db({"id": "u1", "role": "admin"})
+    asyncio.run(load_user_profile(db, "u1"))
+    db.users.users["u1"]["role"] = "worker"
+    invalidate_user("u1")
+    assert asyncio.run(load_user_profile(db, "u1"))["role"] == "worker"
+    assert asyncio.run(load_user_profile(db, "missing")) is None
@@ -0,0 +1,96 @@
+import asyncio
+from datetime import datetime
+
+from pymongo.errors import BulkWriteError
+
+from batch import advance_id, payment_object_id
+from repository import insert_once_ordered
+
+USER = {"id": "u1"}
+
+
+def add_worker(repository, worker_id="w1"):
+    asyncio.run(repository.create_worker({
+        "id": worker_id, "user_id": "u1", "site_id": "s1", "name": worker_id, "daily_rate": 400,
+        "created_at": datetime(2024, 1, 1),
+    }))
+
+
+def send(server, *operations):
+    body = server.BatchRequest(operations=[
+        server.BatchOperation(key=key, type=op_type, data=data) for key, op_type, data in operations
+    ])
+    return asyncio.run(server.apply_batch(body, current_user=USER))
+
+
+def test_ids_are_derived_from_tenant_and_key():
+    assert advance_id("u1", "k1") == advance_id("u1", "k1")
+    assert advance_id("u1", "k1") != advance_id("u2", "k1")
+    assert payment_object_id("u1", "k1") == payment_object_id("u1", "k1")
+    assert payment_object_id("u1", "k1") != payment_object_id("u1", "k2")
+
+
+def test_a_replayed_batch_writes_nothing_twice(sqlite_server, sqlite_repository):
+    add_worker(sqlite_repository)
+    operations = [
+        ("a1", "mark_attendance", {"worker_id": "w1", "date": "2024-01-02", "status": "present"}),
+        ("a2", "record_advance", {"worker_id": "w1", "amount": 250, "date": "2024-01-02"}),
+    ]
+    first = send(sqlite_server, *operations)
+    replay = send(sqlite_server, *operations)
+
+    assert [r["ok"] for r in first["results"]] == [True, True]
+    assert first["results"][1]["id"] == advance_id("u1", "a2")
+    assert replay["replayed"] == 2 and replay["applied"] == 0
+    assert [r["id"] for r in replay["results"]] == [r["id"] for r in first["results"]]
+    assert asyncio.run(sqlite_repository.total_advances("w1", "2024-01-01", "2024-01-31")) == 250
+    assert len(asyncio.run(sqlite_repository.changes_since("u1", 0, 10))) == 2
+
+
+def test_a_key_repeated_within_a_batch_is_applied_once(sqlite_server, sqlite_repository):
+    add_worker(sqlite_repository)
+    advance = ("k", "record_advance", {"worker_id": "w1", "amount": 100, "date": "2024-01-02"})
+    result = send(sqlite_server, advance, advance)
+
+    assert [r["replayed"] for r in result["results"]] == [False, True]
+    assert asyncio.run(sqlite_repository.total_advances("w1", "2024-01-01", "2024-01-31")) == 100
+
+
+def test_failed_operations_are_not_remembered(sqlite_server, sqlite_repository):
+    add_worker(sqlite_repository)
+    operation = ("k", "record_advance", {"worker_id": "w2", "amount": 100, "date": "2024-01-02"})
+    assert send(sqlite_server, operation)["results"][0]["error"] == "Worker not found"
+
+    add_worker(sqlite_repository, "w2")
+    assert send(sqlite_server, operation)["results"][0]["ok"] is True
+
+
+class FakeCollection:
+    """bulk_write fails once per queued error and records the operations it was given"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = []
+
+    async def bulk_write(self, operations, ordered):
+        self.calls.append(list(operations))
+        if self.errors:
+            raise BulkWriteError({"writeErrors": [self.errors.pop(0)]})
+
+
+def test_a_duplicate_key_counts_as_already_inserted():
+    collection = FakeCollection({"index": 1, "code": 11000, "errmsg": "E11000 duplicate key"})
+    errors = asyncio.run(insert_once_ordered(collection, ["op0", "op1", "op2", "op3"]))
+
+    assert errors == {}
+    assert collection.calls == [["op0", "op1", "op2", "op3"], ["op2", "op3"]]
+
+
+def test_other_failures_stop_the_rest_at_their_batch_position():
+    collection = FakeCollection(
+        {"index": 0, "code": 11000, "errmsg": "E11000 duplicate key"},
+        {"index": 1, "code": 121, "errmsg": "Document failed validation"},
+    )
+    errors = asyncio.run(insert_once_ordered(collection, ["op0", "op1", "op2", "op3"]))
+
+    assert errors == {2: "Document failed validation", 3: "Not applied: an earlier operation failed"}
@@ -0,0 +1,31 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from cashbook import normalize_time, signed_amount
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("16:54", "16:54"), ("04:54 PM", "16:54"), ("12:05 am", "00:05"), (" 9:07 ", "09:07"),
+])
+def test_normalize_time(value, expected):
+    assert normalize_time(value) == expected
+
+
+@pytest.mark.parametrize("value", ["25:00", "4 PM", "noon", ""])
+def test_normalize_time_rejects_other_formats(value):
+    with pytest.raises(ValueError):
+        normalize_time(value)
+
+
+def test_signed_amount():
+    assert signed_amount({"type": "income", "amount": 120.5}) == 120.5
+    assert signed_amount({"type": "expense", "amount": 80}) == -80
+
+
+def test_an_update_without_fields_is_rejected_before_any_write():
+    import server
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(server.update_cashbook_entry("e1", server.CashbookEntryUpdate(), current_user={"id": "u1"}))
+    assert (exc.value.status_code, exc.value.detail) == (400, "No fields to update")
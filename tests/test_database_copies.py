@@ -0,0 +1,10 @@
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+COPIES = ("api/database.py", "frontend/backend/database.py")
+
+
+def test_database_copies_match_backend():
+    source = (ROOT / "backend" / "database.py").read_text()
+    for copy in COPIES:
+        assert (ROOT / copy).read_text() == source, f"{copy} differs from backend/database.py"
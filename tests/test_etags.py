@@ -0,0 +1,98 @@
+import asyncio
+
+from fastapi.responses import Response
+from starlette.requests import Request
+
+from etags import conditional_response, etag_matches, make_etag, version_key, write_keys
+
+
+class Versions:
+    def __init__(self, versions):
+        self.versions = versions
+
+    async def data_version(self, key):
+        return self.versions.get(key, 0)
+
+
+def request(path="/api/workers", query="site_id=s1", headers=None):
+    raw = [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": query.encode(), "headers": raw})
+
+
+def respond(req, versions, key):
+    async def build():
+        return Response(b"[]")
+    return asyncio.run(conditional_response(req, versions, key, build))
+
+
+def test_write_keys_cover_site_and_tenant_scopes():
+    assert write_keys("u1", "workers", "s1") == [version_key("u1", "workers"), version_key("u1", "workers", "s1")]
+    assert write_keys("u1", "workers") == ["u1:workers:*"]
+
+
+def test_etag_matches_weakly_and_in_lists():
+    etag = make_etag(3, "variant")
+    assert etag_matches(etag.removeprefix("W/"), etag)
+    assert etag_matches(f'"other", {etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches(make_etag(4, "variant"), etag)
+
+
+def test_current_etag_gets_304_and_a_write_invalidates_it():
+    key = version_key("u1", "workers", "s1")
+    versions = Versions({key: 5})
+    first = respond(request(), versions, key)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+
+    assert respond(request(headers={"If-None-Match": etag}), versions, key).status_code == 304
+    versions.versions[key] = 6
+    assert respond(request(headers={"If-None-Match": etag}), versions, key).status_code == 200
+
+
+def test_etag_varies_by_tenant_query_and_accept():
+    versions = Versions({})
+    base = respond(request(), versions, version_key("u1", "workers")).headers["etag"]
+    assert respond(request(), versions, version_key("u2", "workers")).headers["etag"] != base
+    assert respond(request(query="site_id=s2"), versions, version_key("u1", "workers")).headers["etag"] != base
+    ndjson = request(headers={"Accept": "application/x-ndjson"})
+    assert respond(ndjson, versions, version_key("u1", "workers")).headers["etag"] != base
+
+
+def test_etag_varies_by_extra_inputs():
+    versions = Versions({})
+    key = version_key("u1", "notes")
+
+    async def build():
+        return Response(b"[]")
+
+    today = asyncio.run(conditional_response(request(), versions, key, build, extra="until=2024-03-12~"))
+    tomorrow = asyncio.run(conditional_response(request(), versions, key, build, extra="until=2024-03-13~"))
+    assert today.headers["etag"] != tomorrow.headers["etag"]
+
+
+def test_record_write_bumps_versions_alongside_the_change_log(monkeypatch):
+    import server
+    from repository import MongoRepository
+
+    class Repository(MongoRepository):
+        """Each step waits for the other to start, so running them one after the other would time out"""
+
+        def __init__(self):
+            super().__init__(db=None)
+            self.bumped, self.logged = asyncio.Event(), asyncio.Event()
+
+        async def bump_data_versions(self, keys):
+            self.bumped.set()
+            await asyncio.wait_for(self.logged.wait(), 1)
+
+        async def record_changes(self, user_id, changes):
+            self.logged.set()
+            await asyncio.wait_for(self.bumped.wait(), 1)
+
+    async def run():
+        monkeypatch.setattr(server, "repository", Repository())
+        await server.record_write("u1", "workers", "s1", ["w1"])
+
+    asyncio.run(run())
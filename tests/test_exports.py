@@ -0,0 +1,68 @@
+import asyncio
+import csv
+import io
+import zipfile
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+import exports
+from exports import csv_chunks, export_response, xlsx_chunks
+from server import export_attendance_report
+
+COLUMNS = ["worker_id", "date", "amount", "marked_at"]
+ROWS = [
+    {"worker_id": ObjectId("65a000000000000000000001"), "date": "2024-01-02", "amount": 250.5,
+     "marked_at": datetime(2024, 1, 2, 9, 30)},
+    {"worker_id": "w2", "date": "2024-01-03", "amount": None, "marked_at": None},
+    {"worker_id": "w3\x01<&>", "date": "2024-01-04", "amount": 7},
+]
+
+
+async def cursor(rows):
+    for row in rows:
+        yield row
+
+
+def collect(chunks):
+    async def main():
+        return [chunk async for chunk in chunks]
+    return asyncio.run(main())
+
+
+def test_csv_export_writes_the_header_and_every_row(monkeypatch):
+    monkeypatch.setattr(exports, "EXPORT_CHUNK_ROWS", 2)
+    chunks = collect(csv_chunks(COLUMNS, cursor(ROWS)))
+    assert len(chunks) == 2
+    assert list(csv.reader(io.StringIO("".join(chunks)))) == [
+        COLUMNS,
+        ["65a000000000000000000001", "2024-01-02", "250.5", "2024-01-02T09:30:00"],
+        ["w2", "2024-01-03", "", ""],
+        ["w3\x01<&>", "2024-01-04", "7", ""],
+    ]
+
+
+def test_xlsx_export_is_a_readable_workbook(monkeypatch):
+    monkeypatch.setattr(exports, "EXPORT_CHUNK_ROWS", 2)
+    workbook = zipfile.ZipFile(io.BytesIO(b"".join(collect(xlsx_chunks(COLUMNS, cursor(ROWS), "Pay & Days")))))
+    assert workbook.testzip() is None
+    assert b'name="Pay &amp; Days"' in workbook.read("xl/workbook.xml")
+    sheet = workbook.read("xl/worksheets/sheet1.xml").decode()
+    assert sheet.count("<row ") == len(ROWS) + 1
+    assert '<c r="C2"><v>250.5</v></c>' in sheet
+    assert "<t>w3&lt;&amp;&gt;</t>" in sheet  # control characters dropped, markup escaped
+
+
+def test_export_response_names_the_download():
+    response = export_response("xlsx", COLUMNS, cursor([]), "attendance-report")
+    assert response.media_type == exports.XLSX_MEDIA_TYPE
+    assert response.headers["content-disposition"] == 'attachment; filename="attendance-report.xlsx"'
+
+
+@pytest.mark.parametrize("dates", [{"start_date": "garbage"}, {"end_date": "2024-13-01"}])
+def test_bad_dates_are_rejected_before_the_download_starts(dates):
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(export_attendance_report(current_user={"id": "u1"}, **dates))
+    assert exc.value.status_code == 400
@@ -0,0 +1,46 @@
+import pytest
+
+from financial_report import UNASSIGNED_SITE, build_financial_report
+
+WORKERS = [("w1", "s1", 400), ("w2", "s2", None)]
+
+
+def test_every_period_is_present_and_zero_filled():
+    report = build_financial_report(
+        WORKERS,
+        [("w1", "2024-01-02", "present"), ("w2", "2024-01-04", "half")],
+        [("w1", "2024-01-02", 100)],
+        [("w2", "2024-01-04T10:30:00", 50)],
+        "2024-01-01", "2024-01-05", "day",
+    )
+    series = report["series"]
+    assert series["period"] == ["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04", "2024-01-05"]
+    assert series["wages"] == [0.0, 400.0, 0.0, 250.0, 0.0]
+    assert series["advances"] == [0.0, 100.0, 0.0, 0.0, 0.0]
+    assert series["payments"] == [0.0, 0.0, 0.0, 50.0, 0.0]
+    assert series["balance"] == [0.0, 300.0, 0.0, 200.0, 0.0]
+    assert report["totals"] == {"wages": 650.0, "advances": 100.0, "payments": 50.0, "balance": 500.0}
+    assert [site["site_id"] for site in report["sites"]] == ["s1", "s2"]
+    assert report["sites"][0]["series"]["wages"] == [0.0, 400.0, 0.0, 0.0, 0.0]
+
+
+def test_empty_period_is_all_zeros():
+    report = build_financial_report(WORKERS, [], [], [], "2024-01-01", "2024-03-31", "month")
+    assert report["series"]["period"] == ["2024-01-01", "2024-02-01", "2024-03-01"]
+    assert report["series"]["wages"] == [0.0, 0.0, 0.0]
+    assert report["sites"] == []
+
+
+def test_rows_outside_the_period_and_unknown_workers():
+    report = build_financial_report(
+        WORKERS, [("w1", "2023-12-31", "present")], [("gone", "2024-01-01", 30)], [],
+        "2024-01-01", "2024-01-07", "week",
+    )
+    assert report["series"]["period"] == ["2024-01-01"]
+    assert report["totals"]["wages"] == 0.0
+    assert [site["site_id"] for site in report["sites"]] == [UNASSIGNED_SITE]
+
+
+def test_unknown_grouping_is_rejected():
+    with pytest.raises(ValueError):
+        build_financial_report(WORKERS, [], [], [], "2024-01-01", "2024-01-31", "year")
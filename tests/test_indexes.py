@@ -0,0 +1,88 @@
+import asyncio
+import logging
+
+import indexes
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+
+class Collection:
+    def __init__(self, db, name, groups=(), existing=()):
+        self.db, self.name = db, name
+        self.groups = list(groups)
+        self.existing = set(existing)
+
+    def aggregate(self, pipeline, allowDiskUse):
+        return Cursor(self.groups)
+
+    async def index_information(self):
+        return {name: {} for name in self.existing}
+
+    async def create_indexes(self, models):
+        self.db.created.extend((self.name, model.document["name"]) for model in models)
+
+    async def drop_index(self, name):
+        self.db.dropped.append((self.name, name))
+
+    async def delete_many(self, query):
+        self.db.deleted.extend(query["_id"]["$in"])
+
+
+class Db:
+    def __init__(self, groups=(), existing=None):
+        self.created, self.dropped, self.deleted = [], [], []
+        self.collections = {"attendance": Collection(self, "attendance", groups)}
+        for collection, names in (existing or {}).items():
+            self.collections[collection] = Collection(self, collection, existing=names)
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, Collection(self, name))
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+def duplicate(*ids):
+    return {"count": len(ids), "records": [{"_id": i, "marked_at": None, "created_at": None} for i in ids]}
+
+
+def test_startup_warns_about_duplicate_attendance_instead_of_deleting_it(caplog):
+    db = Db(groups=[duplicate(1, 2, 3), duplicate(4, 5)])
+    with caplog.at_level(logging.WARNING, logger="indexes"):
+        asyncio.run(indexes.ensure_indexes(db))
+
+    assert db.deleted == []
+    assert ("attendance", "worker_date_unique") not in db.created
+    assert ("attendance_rollups", "worker_month_unique") in db.created
+    assert "3 duplicate attendance records" in caplog.text
+
+
+def test_unique_attendance_index_is_built_when_there_are_no_duplicates():
+    db = Db()
+    asyncio.run(indexes.ensure_indexes(db))
+
+    assert ("attendance", "worker_date_unique") in db.created
+
+
+def test_dedupe_keeps_one_record_per_day():
+    db = Db(groups=[duplicate(1, 2, 3)])
+    assert asyncio.run(indexes.dedupe_attendance(db)) == 2
+    assert len(db.deleted) == 2
+
+
+def test_the_non_unique_advance_id_index_is_replaced():
+    db = Db(existing={"advances": {"id"}})
+    asyncio.run(indexes.ensure_indexes(db))
+
+    assert db.dropped == [("advances", "id")]
+    assert ("advances", "id_unique") in db.created
@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+USER = {"id": "u1", "email": "u1@example.com"}
+
+
+class Sites:
+    """The slice of the sites collection the legacy routes use"""
+
+    def __init__(self):
+        self.docs = []
+
+    def _find(self, query):
+        return next((d for d in self.docs if all(d.get(k) == v for k, v in query.items())), None)
+
+    async def insert_one(self, doc):
+        doc["_id"] = object()
+        self.docs.append(dict(doc))
+
+    async def find_one(self, query, projection):
+        doc = self._find(query)
+        return {k: v for k, v in doc.items() if k != "_id"} if doc else None
+
+    async def find_one_and_update(self, query, update, projection, return_document):
+        doc = self._find(query)
+        if doc:
+            doc.update(update["$set"])
+        return await self.find_one(query, projection) if doc else None
+
+    async def find_one_and_delete(self, query, projection):
+        doc = await self.find_one(query, projection)
+        self.docs = [d for d in self.docs if not all(d.get(k) == v for k, v in query.items())]
+        return doc
+
+
+@pytest.fixture
+def server(sqlite_server, monkeypatch):
+    monkeypatch.setattr(sqlite_server, "db", SimpleNamespace(sites=Sites()))
+    return sqlite_server
+
+
+def test_sites_are_keyed_on_id_and_owned_by_the_current_user(server, sqlite_repository):
+    site = asyncio.run(server.create_site({"name": "North", "location": "Aizawl"}, current_user=USER))
+    assert "_id" not in site and site["user_id"] == "u1"
+
+    assert asyncio.run(server.get_site_detail(site["id"], current_user=USER))["name"] == "North"
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(server.get_site_detail(site["id"], current_user={"id": "u2"}))
+    assert exc.value.status_code == 404
+
+    updated = asyncio.run(server.update_site(site["id"], {"name": "South", "user_id": "u2"}, current_user=USER))
+    assert (updated["name"], updated["user_id"]) == ("South", "u1")
+    assert asyncio.run(server.delete_site(site["id"], current_user=USER)) == {"deleted": True}
+    assert asyncio.run(server.delete_site(site["id"], current_user=USER)) == {"deleted": False}
+
+    assert asyncio.run(sqlite_repository.data_version("u1:sites:*")) == 3
+    changes = asyncio.run(sqlite_repository.changes_since("u1", 0, 10))
+    assert [(c["collection"], c["deleted"]) for c in changes] == [("sites", False)] * 2 + [("sites", True)]
+
+
+def test_a_site_update_without_fields_is_rejected(server):
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(server.update_site("s1", {"id": "s2"}, current_user=USER))
+    assert (exc.value.status_code, exc.value.detail) == (400, "No fields to update")
+
+
+def test_deleting_a_worker_invalidates_its_site_and_logs_a_tombstone(server, sqlite_repository):
+    asyncio.run(sqlite_repository.create_worker({
+        "id": "w1", "user_id": "u1", "site_id": "s1", "name": "w1", "daily_rate": 400, "created_at": datetime(2024, 1, 1),
+    }))
+    assert asyncio.run(server.delete_worker("w1", current_user={"id": "u2"})) == {"deleted": False}
+    assert asyncio.run(server.delete_worker("w1", current_user=USER)) == {"deleted": True}
+
+    assert asyncio.run(sqlite_repository.data_version("u1:workers:s1")) == 1
+    assert [(c["doc_id"], c["deleted"]) for c in asyncio.run(sqlite_repository.changes_since("u1", 0, 10))] == [("w1", True)]
@@ -0,0 +1,86 @@
+import asyncio
+from types import SimpleNamespace
+
+from fastapi import FastAPI
+
+from metrics import CommandMetrics, Histogram, MetricsMiddleware, MetricsRegistry
+
+
+def call(app, path, body=b""):
+    """Drive one request through an ASGI app; returns the response status"""
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+             "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"", "headers": [],
+             "client": ("test", 0), "server": ("test", 80)}
+    asyncio.run(app(scope, receive, send))
+    return sent[0]["status"]
+
+
+def command(name, micros):
+    return SimpleNamespace(command_name=name, duration_micros=micros)
+
+
+def metrics_app():
+    registry = MetricsRegistry()
+    listener = CommandMetrics(registry)
+    app = FastAPI()
+
+    @app.post("/workers/{worker_id}")
+    async def touch(worker_id: str, payload: dict):
+        # What pymongo's listener would see for the commands this request issues
+        listener.succeeded(command("find", 2000))
+        listener.succeeded(command("find", 3000))
+        listener.failed(command("update", 1000))
+        return {"worker_id": worker_id}
+
+    app.add_middleware(MetricsMiddleware, registry=registry)
+    return app, registry, listener
+
+
+def test_requests_are_recorded_under_their_route_template():
+    app, registry, _ = metrics_app()
+    assert call(app, "/workers/w1", b'{"x": 1}') == 200
+    assert call(app, "/workers/w2", b"{}") == 200
+    assert call(app, "/nowhere") == 404
+
+    text = registry.render()
+    assert 'http_request_duration_seconds_count{method="POST",route="/workers/{worker_id}",status="200"} 2' in text
+    assert 'http_request_duration_seconds_count{method="POST",route="unmatched",status="404"} 1' in text
+    assert 'http_request_size_bytes_sum{method="POST",route="/workers/{worker_id}"} 10' in text
+    assert "http_requests_in_flight 0" in text
+
+
+def test_mongo_commands_are_attributed_to_the_issuing_route():
+    app, registry, listener = metrics_app()
+    call(app, "/workers/w1", b"{}")
+    listener.succeeded(command("ping", 500))  # outside any request
+
+    text = registry.render()
+    assert 'mongo_commands_total{route="/workers/{worker_id}",command="find",outcome="success"} 2' in text
+    assert 'mongo_commands_total{route="/workers/{worker_id}",command="update",outcome="failure"} 1' in text
+    assert 'mongo_command_seconds_total{route="/workers/{worker_id}",command="find"} 0.005' in text
+    assert 'mongo_commands_total{route="background",command="ping",outcome="success"} 1' in text
+
+
+def test_histogram_buckets_are_cumulative_and_labels_escaped():
+    histogram = Histogram("h", "help", ("route",), (1, 10))
+    for value in (0.5, 5, 50):
+        histogram.observe(('/a"b',), value)
+    lines = histogram.render()
+    assert 'h_bucket{route="/a\\"b",le="1"} 1' in lines
+    assert 'h_bucket{route="/a\\"b",le="10"} 2' in lines
+    assert 'h_bucket{route="/a\\"b",le="+Inf"} 3' in lines
+    assert 'h_sum{route="/a\\"b"} 55.5' in lines
+
+
+def test_extra_gauges_are_rendered():
+    text = MetricsRegistry().render({"mongo_pool_checked_out": ("Connections in use", 3)})
+    assert "# TYPE mongo_pool_checked_out gauge\nmongo_pool_checked_out 3\n" in text
@@ -0,0 +1,127 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from notes import REMINDER_TIME, ReminderScheduler, due_at, remind_at
+
+
+def test_due_at_uses_the_reminder_time_for_date_only_values():
+    assert due_at("2024-03-05") == datetime.combine(datetime(2024, 3, 5).date(), REMINDER_TIME)
+    assert due_at("2024-03-05T14:30:00+05:30") == datetime(2024, 3, 5, 14, 30)
+
+
+def test_only_open_tasks_with_an_unsent_reminder_are_pending():
+    task = {"type": "task", "reminder": True, "completed": False, "due_date": "2024-03-05T08:00:00"}
+    assert remind_at(task) == datetime(2024, 3, 5, 8)
+    assert remind_at({**task, "type": "note"}) is None
+    assert remind_at({**task, "reminder": False}) is None
+    assert remind_at({**task, "completed": True}) is None
+    assert remind_at({**task, "due_date": None}) is None
+    assert remind_at({**task, "reminded_at": datetime(2024, 3, 5, 8)}) is None
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, keys):
+        field, _ = keys[0]
+        self.docs.sort(key=lambda doc: doc[field])
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+    async def to_list(self, length):
+        return self.docs[:length]
+
+
+class Notes:
+    """The slice of the notes collection the scheduler uses"""
+
+    def __init__(self, notes):
+        self.notes = notes
+
+    def find(self, query, projection):
+        horizon = query["remind_at"]["$lte"]
+        return Cursor([dict(n) for n in self.notes if n.get("remind_at") and n["remind_at"] <= horizon])
+
+    async def find_one_and_update(self, query, update, projection):
+        for note in self.notes:
+            if note["id"] == query["id"] and note.get("remind_at") == query["remind_at"]:
+                before = dict(note)
+                note.update(update["$set"])
+                note.pop("remind_at")
+                return before
+        return None
+
+
+class Db:
+    def __init__(self, notes):
+        self.notes = Notes(notes)
+
+
+def test_reload_loads_reminders_within_the_horizon_soonest_first():
+    now = datetime(2024, 3, 5, 8)
+    db = Db([
+        {"id": "late", "remind_at": now + timedelta(minutes=90)},
+        {"id": "b", "remind_at": now + timedelta(minutes=30)},
+        {"id": "a", "remind_at": now - timedelta(minutes=5)},
+    ])
+    scheduler = ReminderScheduler(horizon_minutes=60, heap_size=10)
+    scheduler.db = db
+    asyncio.run(scheduler._reload(now))
+
+    assert sorted(note_id for _, note_id in scheduler._heap) == ["a", "b"]
+    assert scheduler.stats()["loaded_until"] == now + timedelta(minutes=60)
+
+
+def test_a_full_heap_is_loaded_only_up_to_its_last_reminder():
+    now = datetime(2024, 3, 5, 8)
+    db = Db([{"id": str(i), "remind_at": now + timedelta(minutes=i)} for i in range(5)])
+    scheduler = ReminderScheduler(horizon_minutes=60, heap_size=3)
+    scheduler.db = db
+    asyncio.run(scheduler._reload(now))
+
+    assert scheduler.stats()["pending"] == 3
+    assert scheduler.stats()["loaded_until"] == now + timedelta(minutes=2)
+
+
+def test_fire_marks_the_reminder_sent_once_and_skips_stale_entries():
+    at = datetime(2024, 3, 5, 8)
+    db = Db([{"id": "t1", "remind_at": at}])
+    fired = []
+
+    async def on_fire(note):
+        fired.append(note["id"])
+
+    scheduler = ReminderScheduler()
+    scheduler.db, scheduler._on_fire = db, on_fire
+    asyncio.run(scheduler._fire(at, "t1"))
+    asyncio.run(scheduler._fire(at, "t1"))
+
+    assert fired == ["t1"]
+    assert "remind_at" not in db.notes.notes[0] and db.notes.notes[0]["reminded_at"]
+    assert scheduler.fired == 1
+
+
+def test_a_running_scheduler_fires_due_reminders_and_reloads_on_invalidate():
+    db = Db([{"id": "t1", "remind_at": datetime.utcnow() - timedelta(seconds=1)}])
+    fired = []
+
+    async def on_fire(note):
+        fired.append(note["id"])
+
+    async def run():
+        scheduler = ReminderScheduler(horizon_minutes=60)
+        await scheduler.start(db, on_fire=on_fire)
+        await asyncio.sleep(0.05)
+        db.notes.notes.append({"id": "t2", "remind_at": datetime.utcnow()})
+        scheduler.invalidate()
+        await asyncio.sleep(0.05)
+        await scheduler.stop()
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert fired == ["t1", "t2"]
+    assert scheduler.reloads >= 2
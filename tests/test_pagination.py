@@ -0,0 +1,33 @@
+import base64
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from pagination import decode_cursor, encode_cursor, keyset_query
+
+
+def test_cursor_round_trip_keeps_types():
+    values = ["2024-01-02", datetime(2024, 1, 2, 3, 4, 5), 7]
+    assert decode_cursor(encode_cursor(values)) == values
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor!", base64.urlsafe_b64encode(b"{broken").decode(), ""])
+def test_tampered_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(cursor)
+    assert exc.value.status_code == 400
+
+
+def test_keyset_query_rejects_cursor_for_another_sort():
+    with pytest.raises(HTTPException) as exc:
+        keyset_query({"user_id": "u1"}, [("created_at", 1), ("id", 1)], ["2024-01-01"])
+    assert exc.value.status_code == 400
+
+
+def test_keyset_query_continues_after_the_last_key():
+    query = keyset_query({"user_id": "u1"}, [("date", -1), ("id", -1)], ["2024-01-02", "b"])
+    assert query == {"$and": [{"user_id": "u1"}, {"$or": [
+        {"date": {"$lt": "2024-01-02"}},
+        {"date": "2024-01-02", "id": {"$lt": "b"}},
+    ]}]}
@@ -0,0 +1,43 @@
+import asyncio
+import hashlib
+import threading
+
+import pytest
+
+import auth
+from auth import hash_password, password_needs_rehash, run_password_hash, verify_password
+
+
+@pytest.fixture(autouse=True)
+def fast_bcrypt(monkeypatch):
+    monkeypatch.setattr(auth, "BCRYPT_ROUNDS", 4)
+
+
+def test_bcrypt_hashes_verify_and_are_salted():
+    first, second = asyncio.run(hash_password("s3cret")), asyncio.run(hash_password("s3cret"))
+    assert first.startswith("$2b$04$") and first != second
+    assert asyncio.run(verify_password("s3cret", first))
+    assert not asyncio.run(verify_password("wrong", first))
+    assert not password_needs_rehash(first)
+
+
+def test_legacy_sha256_hashes_verify_and_need_a_rehash():
+    legacy = hashlib.sha256(b"s3cret").hexdigest()
+    assert password_needs_rehash(legacy)
+    assert asyncio.run(verify_password("s3cret", legacy))
+    assert not asyncio.run(verify_password("wrong", legacy))
+
+
+@pytest.mark.parametrize("plain, hashed", [("", "$2b$04$abc"), ("s3cret", ""), ("s3cret", None)])
+def test_missing_password_or_hash_never_verifies(plain, hashed):
+    assert not asyncio.run(verify_password(plain, hashed))
+
+
+def test_hashing_runs_in_the_dedicated_pool_off_the_loop():
+    async def main():
+        loop_thread = threading.current_thread().name
+        return loop_thread, await run_password_hash(lambda: threading.current_thread().name)
+
+    loop_thread, hash_thread = asyncio.run(main())
+    assert hash_thread != loop_thread
+    assert hash_thread.startswith("password-hash")
@@ -0,0 +1,35 @@
+import random
+
+import pytest
+
+from payroll import compute_payroll, payroll_rows
+from server import build_salary_record
+
+
+def test_vectorised_totals_match_build_salary_record():
+    rng = random.Random(7)
+    workers = [(f"w{i}", rng.choice([None, 350, 500, 725.5])) for i in range(40)]
+    attendance = [(rng.choice(workers)[0], rng.choice(["present", "half", "absent", "holiday"])) for _ in range(600)]
+    advances = [(rng.choice(workers)[0], rng.choice([50, 125.25, 300])) for _ in range(80)]
+    attendance.append(("unknown-worker", "present"))
+    advances.append(("unknown-worker", 999))
+
+    rows = payroll_rows(compute_payroll(workers, attendance, advances), "2024-01-01", "2024-01-31")
+
+    for (worker_id, rate), row in zip(workers, rows):
+        counts = {}
+        for attendance_worker, status in attendance:
+            if attendance_worker == worker_id:
+                counts[status] = counts.get(status, 0) + 1
+        advance_total = sum(amount for advance_worker, amount in advances if advance_worker == worker_id)
+        expected = build_salary_record(worker_id, 500 if rate is None else rate, counts, advance_total,
+                                       "2024-01-01", "2024-01-31").model_dump()
+        for field, value in row.items():
+            assert value == pytest.approx(expected[field]), (worker_id, field)
+
+
+def test_workers_without_records_get_zero_rows():
+    rows = payroll_rows(compute_payroll([("w1", 400)], [], []), "2024-01-01", "2024-01-31")
+    assert rows == [{"date_from": "2024-01-01", "date_to": "2024-01-31", "worker_id": "w1", "total_days": 0,
+                     "present_days": 0, "half_days": 0, "absent_days": 0, "daily_earnings": 0.0,
+                     "total_advances": 0.0, "total_earnings": 0.0, "net_payable": 0.0}]
@@ -0,0 +1,42 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+import pytest
+from bson import ObjectId
+from pydantic import BaseModel
+
+from responses import FastJSONResponse, dumps, model_response
+
+
+class Salary(BaseModel):
+    worker_id: str
+    net_payable: float
+    computed_at: datetime
+
+
+def test_dumps_handles_documents_as_stored():
+    doc = {"_id": ObjectId("65a000000000000000000001"), "date": datetime(2024, 1, 2, 3, 4, 5),
+           "counts": np.array([1, 2]), "total": np.float64(1.5), 7: "non-string key"}
+    assert json.loads(dumps(doc)) == {"_id": "65a000000000000000000001", "date": "2024-01-02T03:04:05",
+                                      "counts": [1, 2], "total": 1.5, "7": "non-string key"}
+
+
+def test_dumps_rejects_unknown_types():
+    with pytest.raises(TypeError):
+        dumps({"amount": Decimal("1.5")})
+
+
+def test_fast_json_response_renders_with_orjson():
+    response = FastJSONResponse({"items": [{"_id": ObjectId("65a000000000000000000001")}], "next_cursor": None})
+    assert response.media_type == "application/json"
+    assert response.body == b'{"items":[{"_id":"65a000000000000000000001"}],"next_cursor":null}'
+
+
+def test_model_response_serialises_the_model_directly():
+    salary = Salary(worker_id="w1", net_payable=250.0, computed_at=datetime(2024, 1, 31))
+    response = model_response(salary, status_code=201)
+    assert response.status_code == 201
+    assert response.media_type == "application/json"
+    assert json.loads(response.body) == {"worker_id": "w1", "net_payable": 250.0, "computed_at": "2024-01-31T00:00:00"}
@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+USER = {"id": "u1"}
+
+
+def add_workers(repository, *workers):
+    for worker_id, site_id in workers:
+        asyncio.run(repository.create_worker({
+            "id": worker_id, "user_id": "u1", "site_id": site_id, "name": worker_id, "daily_rate": 400,
+            "created_at": datetime(2024, 1, 1),
+        }))
+
+
+def roll_call(server, date, entries, site_id="s1"):
+    body = server.AttendanceRollCall(site_id=site_id, date=date, entries=[
+        server.RollCallEntry(worker_id=worker_id, status=status) for worker_id, status in entries
+    ])
+    return asyncio.run(server.mark_roll_call(body, current_user=USER))
+
+
+def day_statuses(repository, worker_ids, day):
+    async def read():
+        return {r["worker_id"]: r["status"] async for r in repository.site_attendance_records(worker_ids, day, day)}
+    return asyncio.run(read())
+
+
+def test_roll_call_marks_owned_workers_and_reports_the_rest(sqlite_server, sqlite_repository):
+    add_workers(sqlite_repository, ("w1", "s1"), ("w2", "s1"), ("w3", "s2"))
+    result = roll_call(sqlite_server, "2024-01-02", [("w1", "present"), ("w2", "half"), ("w3", "present"), ("ghost", "absent")])
+
+    assert (result["marked"], result["failed"]) == (2, 2)
+    assert [(r["worker_id"], r["ok"], r.get("error")) for r in result["results"]] == [
+        ("w1", True, None), ("w2", True, None), ("w3", False, "Worker not found"), ("ghost", False, "Worker not found"),
+    ]
+    assert day_statuses(sqlite_repository, ["w1", "w2", "w3"], "2024-01-02") == {"w1": "present", "w2": "half"}
+
+
+def test_a_second_roll_call_overwrites_the_day(sqlite_server, sqlite_repository):
+    add_workers(sqlite_repository, ("w1", "s1"))
+    roll_call(sqlite_server, "2024-01-02", [("w1", "present")])
+    roll_call(sqlite_server, "2024-01-02", [("w1", "absent")])
+
+    assert day_statuses(sqlite_repository, ["w1"], "2024-01-02") == {"w1": "absent"}
+    assert asyncio.run(sqlite_repository.attendance_status_counts("w1", "2024-01-01", "2024-01-31")) == {"absent": 1}
+
+
+def test_roll_call_bumps_the_site_version_and_logs_each_record(sqlite_server, sqlite_repository):
+    add_workers(sqlite_repository, ("w1", "s1"), ("w2", "s1"))
+    roll_call(sqlite_server, "2024-01-02", [("w1", "present"), ("w2", "present")])
+
+    assert asyncio.run(sqlite_repository.data_version("u1:attendance:s1")) == 1
+    changes = asyncio.run(sqlite_repository.changes_since("u1", 0, 10))
+    assert [(c["collection"], c["deleted"]) for c in changes] == [("attendance", False), ("attendance", False)]
+
+
+def test_roll_call_rejects_a_malformed_date(sqlite_server, sqlite_repository):
+    add_workers(sqlite_repository, ("w1", "s1"))
+    with pytest.raises(HTTPException) as exc:
+        roll_call(sqlite_server, "2024-02-30", [("w1", "present")])
+    assert exc.value.status_code == 400
+
+
+def test_single_marks_and_roll_calls_store_the_same_fields(sqlite_server, sqlite_repository):
+    add_workers(sqlite_repository, ("w1", "s1"), ("w2", "s1"))
+    roll_call(sqlite_server, "2024-01-02", [("w1", "present")])
+    asyncio.run(sqlite_server.mark_attendance(
+        sqlite_server.AttendanceCreate(worker_id="w2", date="2024-01-02", status="present"), current_user=USER
+    ))
+
+    async def read():
+        return [r async for r in sqlite_repository.site_attendance_records(["w1", "w2"], "2024-01-02", "2024-01-02")]
+    first, second = asyncio.run(read())
+    assert first.keys() == second.keys()
+    assert "site_id" not in first
+
+
+def test_single_mark_rejects_a_malformed_date(sqlite_server, sqlite_repository):
+    add_workers(sqlite_repository, ("w1", "s1"))
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(sqlite_server.mark_attendance(
+            sqlite_server.AttendanceCreate(worker_id="w1", date="02/01/2024", status="present"), current_user=USER
+        ))
+    assert exc.value.status_code == 400
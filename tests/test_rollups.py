@@ -0,0 +1,26 @@
+import pytest
+
+from rollups import rollup_delta, split_period, status_earning
+
+
+@pytest.mark.parametrize("status, earned", [("present", 400), ("half", 200), ("absent", 0), ("holiday", 0)])
+def test_status_earning(status, earned):
+    assert status_earning(status, 400) == earned
+
+
+def test_rollup_delta_moves_a_day_between_statuses():
+    assert rollup_delta(None, "present", 400) == {"counts.present": 1, "earned": 400}
+    assert rollup_delta("present", "half", 400) == {"counts.present": -1, "counts.half": 1, "earned": -200}
+    assert rollup_delta("absent", "holiday", 400) == {"counts.absent": -1, "counts.holiday": 1}
+    assert rollup_delta("present", None, 400) == {"counts.present": -1, "earned": -400}
+
+
+def test_rollup_delta_is_empty_when_nothing_changes():
+    assert rollup_delta("present", "present", 400) == {}
+
+
+def test_split_period_into_full_months_and_partial_ranges():
+    assert split_period("2024-01-15", "2024-04-10") == (
+        ["2024-02", "2024-03"], [("2024-01-15", "2024-01-31"), ("2024-04-01", "2024-04-10")]
+    )
+    assert split_period("2024-02-01", "2024-02-29") == (["2024-02"], [])
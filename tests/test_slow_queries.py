@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+from slow_queries import SLOW_QUERY_COLLECTION, SlowQueryRecorder, redact, redact_plan
+
+PLAN = {"queryPlanner": {"winningPlan": {
+    "stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "user_id_1", "indexBounds": {"user_id": ['["u1", "u1"]']}},
+}}}
+
+
+class Recorded:
+    def __init__(self):
+        self.docs = []
+
+    async def insert_one(self, doc):
+        self.docs.append(doc)
+
+
+class Database:
+    def __init__(self):
+        self.explained = []
+
+    async def command(self, command):
+        self.explained.append(command)
+        return PLAN
+
+
+class Db:
+    """Motor database stand-in: the capped collection, and client[...] for explain"""
+
+    def __init__(self):
+        self.slow_queries = Recorded()
+        self.target = Database()
+        self.client = {"worksite": self.target}
+
+    async def create_collection(self, name, **options):
+        assert name == SLOW_QUERY_COLLECTION and options["capped"]
+
+    def __getitem__(self, name):
+        assert name == SLOW_QUERY_COLLECTION
+        return self.slow_queries
+
+
+def event(request_id, command, millis, name="find", collection="workers"):
+    body = {name: collection, **command, "lsid": {"id": "session"}, "$db": "worksite"}
+    return SimpleNamespace(request_id=request_id, connection_id=("db", 27017), command_name=name, command=body,
+                           database_name="worksite", duration_micros=int(millis * 1000))
+
+
+def record(events, threshold_ms=100):
+    async def main():
+        db = Db()
+        recorder = SlowQueryRecorder(threshold_ms=threshold_ms)
+        await recorder.start(db)
+        for started in events:
+            recorder.started(started)
+            recorder.succeeded(started)
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if recorder._queue.empty():
+                break
+        await asyncio.sleep(0.01)
+        await recorder.stop()
+        return db
+    return asyncio.run(main())
+
+
+def test_redact_keeps_shape_and_drops_literals():
+    query = {"user_id": "u1", "date": {"$gte": datetime(2024, 1, 1)}, "status": {"$in": ["present", "half"]}, "n": 5}
+    assert redact(query) == {"user_id": "<str>", "date": {"$gte": "<datetime>"}, "status": {"$in": ["<str>"]},
+                             "n": "<number>"}
+    assert redact({"date": -1, "id": 1}) == {"date": -1, "id": 1}
+
+
+def test_redact_plan_strips_index_bounds():
+    plan = redact_plan(PLAN["queryPlanner"]["winningPlan"])
+    assert plan["inputStage"] == {"stage": "IXSCAN", "indexName": "user_id_1", "indexBounds": {"user_id": ["<str>"]}}
+
+
+def test_slow_commands_are_recorded_with_a_redacted_shape_and_plan():
+    db = record([
+        event(1, {"filter": {"user_id": "u1"}, "sort": {"created_at": 1}}, millis=250),
+        event(2, {"filter": {"user_id": "u2"}}, millis=5),
+    ])
+    [doc] = db.slow_queries.docs
+    assert (doc["collection"], doc["command"], doc["outcome"], doc["duration_ms"]) == ("workers", "find", "success", 250)
+    assert doc["route"] == "background"
+    assert doc["shape"] == {"filter": {"user_id": "<str>"}, "sort": {"created_at": 1}}
+    assert doc["plan"]["inputStage"]["indexBounds"] == {"user_id": ["<str>"]}
+    # The explain is sent without the driver's session fields
+    [explained] = db.target.explained
+    assert "lsid" not in explained["explain"] and "$db" not in explained["explain"]
+
+
+def test_unexplainable_commands_and_the_log_itself_are_ignored():
+    db = record([
+        event(1, {}, millis=500, name="insert"),
+        event(2, {"filter": {}}, millis=500, collection=SLOW_QUERY_COLLECTION),
+    ])
+    assert db.slow_queries.docs == []
@@ -0,0 +1,100 @@
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+
+def worker(worker_id, site_id="s1", rate=400, user_id="u1"):
+    return {"id": worker_id, "user_id": user_id, "site_id": site_id, "name": worker_id.upper(),
+            "daily_rate": rate, "created_at": datetime(2024, 1, 1, 0, 0, int(worker_id[1:]))}
+
+
+@pytest.fixture
+def run(sqlite_repository):
+    """Run scenario(repository) against a fresh SQLite file holding four workers"""
+    async def seed():
+        for item in (worker("w1"), worker("w2"), worker("w3", site_id="s2"), worker("w4", user_id="u2")):
+            await sqlite_repository.create_worker(item)
+    asyncio.run(seed())
+    return lambda scenario: asyncio.run(scenario(sqlite_repository))
+
+
+def test_workers_page_through_with_a_cursor(run):
+    async def scenario(repository):
+        first = json.loads((await repository.list_workers("u1", limit=2)).body)
+        second = json.loads((await repository.list_workers("u1", limit=2, cursor=first["next_cursor"])).body)
+        with pytest.raises(HTTPException):
+            await repository.list_workers("u1", cursor="tampered")
+        return first, second
+
+    first, second = run(scenario)
+    assert [w["id"] for w in first["items"]] == ["w1", "w2"]
+    assert [w["id"] for w in second["items"]] == ["w3"]
+    assert second["next_cursor"] is None
+
+
+def test_marking_a_day_twice_keeps_one_record(run):
+    async def scenario(repository):
+        first = await repository.upsert_attendance("w1", "2024-01-02", "present", "u1", 400)
+        second = await repository.upsert_attendance("w1", "2024-01-02", "half", "u1", 400)
+        counts = await repository.attendance_status_counts("w1", "2024-01-01", "2024-01-31")
+        return first, second, counts
+
+    first, second, counts = run(scenario)
+    assert first["id"] == second["id"]
+    assert counts == {"half": 1}
+
+
+def test_site_payroll_and_summary(run):
+    async def scenario(repository):
+        _, ids = await repository.mark_attendance_many("2024-01-02", [("w1", "present", 400), ("w2", "half", 400)], "u1")
+        await repository.upsert_attendance("w1", "2024-02-01", "absent", "u1", 400)
+        await repository.create_advance({"id": "a1", "worker_id": "w1", "amount": 150.0, "date": "2024-01-05"})
+        payroll = [row async for row in repository.site_payroll_rows("u1", "s1", "2024-01-01", "2024-01-31")]
+        summary = await repository.attendance_summary("u1", "s1", "2024-01", "2024-02")
+        records = [r async for r in repository.site_attendance_records(["w1", "w2"], "2024-01-01", "2024-12-31")]
+        return ids, payroll, summary, records
+
+    ids, payroll, summary, records = run(scenario)
+    assert set(ids) == {"w1", "w2"}
+    assert payroll == [
+        ({"id": "w1", "name": "W1", "daily_rate": 400}, {"present": 1}, 150.0),
+        ({"id": "w2", "name": "W2", "daily_rate": 400}, {"half": 1}, 0.0),
+    ]
+    assert [(row["worker_id"], row["month"], row["counts"], row["earned"]) for row in summary] == [
+        ("w1", "2024-01", {"present": 1}, 400.0),
+        ("w1", "2024-02", {"absent": 1}, 0.0),
+        ("w2", "2024-01", {"half": 1}, 200.0),
+    ]
+    assert [(r["worker_id"], r["date"]) for r in records] == [("w1", "2024-01-02"), ("w1", "2024-02-01"), ("w2", "2024-01-02")]
+
+
+def test_period_inputs_are_scoped_to_the_tenant_and_site(run):
+    async def scenario(repository):
+        for worker_id in ("w1", "w3", "w4"):
+            await repository.upsert_attendance(worker_id, "2024-01-02", "present", "u1", 400)
+        return await repository.period_inputs("u1", "s1", "2024-01-01", "2024-01-31")
+
+    workers, attendance, advances = run(scenario)
+    assert [w[0] for w in workers] == ["w1", "w2"]
+    assert attendance == [("w1", "2024-01-02", "present")]
+    assert advances == []
+
+
+def test_data_versions_only_move_forward(run):
+    async def scenario(repository):
+        before = await repository.data_version("u1:workers:*")
+        await repository.bump_data_versions(["u1:workers:*", "u1:workers:s1"])
+        await repository.bump_data_versions(["u1:workers:*"])
+        return before, await repository.data_version("u1:workers:*"), await repository.data_version("u1:workers:s1")
+
+    assert run(scenario) == (0, 2, 1)
+
+
+def test_mongo_only_endpoints_answer_501(sqlite_server):
+    with pytest.raises(HTTPException) as exc:
+        sqlite_server.require_mongo()
+    assert exc.value.status_code == 501
+    assert asyncio.run(sqlite_server.get_db_health()) == {"status": "ok", "engine": sqlite_server.STORAGE_ENGINE}
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import sync
+from pagination import encode_cursor
+from sync import SYNC_LOG_TTL_DAYS, collapse, contiguous, decode_token, encode_token, next_token, token_expired
+
+
+def entry(seq, age_seconds=0, collection="workers", doc_id="w1", deleted=False):
+    return {"seq": seq, "at": datetime.utcnow() - timedelta(seconds=age_seconds),
+            "collection": collection, "doc_id": doc_id, "deleted": deleted}
+
+
+def test_token_round_trip():
+    seq, issued_at = decode_token(encode_token(42))
+    assert seq == 42
+    assert datetime.utcnow() - issued_at < timedelta(minutes=1)
+
+
+@pytest.mark.parametrize("values", [[True, datetime.utcnow()], ["1", datetime.utcnow()], [1, "2024-01-01"], [1]])
+def test_malformed_token_is_rejected(values):
+    with pytest.raises(HTTPException) as exc:
+        decode_token(encode_cursor(values))
+    assert exc.value.status_code == 400
+
+
+def test_contiguous_stops_at_a_fresh_gap():
+    entries = [entry(4), entry(5), entry(7), entry(8)]
+    assert [e["seq"] for e in contiguous(entries, 3)] == [4, 5]
+
+
+def test_contiguous_skips_a_stale_gap():
+    entries = [entry(4, age_seconds=3600), entry(6, age_seconds=3600), entry(7)]
+    assert [e["seq"] for e in contiguous(entries, 2)] == [4, 6, 7]
+
+
+def test_collapse_keeps_the_latest_change_per_document():
+    changes = collapse([
+        entry(1, doc_id="w1"), entry(2, doc_id="w1", deleted=True),
+        entry(3, collection="advances", doc_id="a1"),
+    ])
+    assert changes["workers"] == {"w1": True}
+    assert changes["advances"] == {"a1": False}
+    assert changes["notes"] == {}
+
+
+def test_page_tokens_carry_the_time_of_their_last_entry():
+    old = (datetime.utcnow() - timedelta(days=20)).replace(microsecond=0)  # tokens keep milliseconds
+    entries = [entry(4), entry(5)]
+    entries[-1]["at"] = old
+    seq, logged_at = decode_token(next_token(3, datetime.utcnow(), entries, entries))
+    assert (seq, logged_at) == (5, old)
+
+
+def test_tokens_with_nothing_to_consume_are_refreshed_but_gaps_keep_their_age():
+    old = (datetime.utcnow() - timedelta(days=20)).replace(microsecond=0)  # tokens keep milliseconds
+    _, refreshed = decode_token(next_token(5, old, [], []))
+    assert datetime.utcnow() - refreshed < timedelta(minutes=1)
+    _, waiting = decode_token(next_token(5, old, [entry(7)], []))
+    assert waiting == old
+
+
+def test_token_expires_with_the_entries_it_has_not_seen():
+    assert not token_expired(datetime.utcnow() - timedelta(days=SYNC_LOG_TTL_DAYS - 1))
+    assert token_expired(datetime.utcnow() - timedelta(days=SYNC_LOG_TTL_DAYS))
+
+
+def test_a_page_token_expires_with_the_log_it_points_into(sqlite_server, sqlite_repository, monkeypatch):
+    asyncio.run(sqlite_repository.record_changes("u1", [("workers", "w1", False), ("workers", "w2", False), ("workers", "w3", False)]))
+    ten_days_ago = datetime.utcnow() - timedelta(days=10)
+    conn = sqlite3.connect(sqlite_repository.path)
+    with conn:
+        conn.execute("UPDATE sync_log SET at = ? WHERE seq < 3", (ten_days_ago.isoformat(),))
+    user = {"id": "u1"}
+
+    # The client reads the first page of the old entries, then stops
+    monkeypatch.setattr(sqlite_server, "SYNC_PAGE_SIZE", 1)
+    page = asyncio.run(sqlite_server.sync_changes(since=encode_token(0, ten_days_ago - timedelta(seconds=1)), current_user=user))
+    assert decode_token(json.loads(page.body)["token"])[0] == 1
+
+    # Later the log TTL has removed seq 1 and 2; resuming must not silently skip seq 2
+    monkeypatch.setattr(sync, "SYNC_LOG_TTL_DAYS", 5)
+    with conn:
+        conn.execute("DELETE FROM sync_log WHERE seq < 3")
+    conn.close()
+    result = asyncio.run(sqlite_server.sync_changes(since=json.loads(page.body)["token"], current_user=user))
+    assert result["full_sync_required"]
+    assert decode_token(result["token"])[0] == 3
+
+
+def test_sqlite_bumps_versions_and_logs_changes_in_one_transaction(sqlite_repository, monkeypatch):
+    writes = []
+    write = sqlite_repository._write
+
+    async def counted(func, *args):
+        writes.append(func)
+        return await write(func, *args)
+
+    monkeypatch.setattr(sqlite_repository, "_write", counted)
+    asyncio.run(sqlite_repository.record_write(["u1:workers:*", "u1:workers:s1"], "u1", [("workers", "w1", False)]))
+
+    assert len(writes) == 1
+    assert asyncio.run(sqlite_repository.data_version("u1:workers:s1")) == 1
+    assert [c["seq"] for c in asyncio.run(sqlite_repository.changes_since("u1", 0, 10))] == [1]